@@ -1,23 +1,271 @@
+from functools import lru_cache
 from typing import Optional
 from fastapi import APIRouter, Request, Depends, HTTPException, Query
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi.responses import JSONResponse
 import logging
 
 
-from api.funcs import get_main_sql
+from api.cache.funcs import cached_aggregate_async
+from api.funcs import MainSqlShape, build_main_sql, get_current_end_date, get_main_sql_shape, main_sql_statement
+from api.rollup.funcs import ROLLUP_CURRENCIES
 from api.payments.funcs import get_dates
-from mydb import db, get_db
+from mydb import db, get_db, text
+from sqlalchemy import TextClause, bindparam
 from sqlalchemy.orm import Session
-from utility_helpers import do_sql_sel
-from dependencies import get_current_user
+from dependencies import get_current_user, get_group_membership, payments_etag
+from api.groups.services import GroupMembership
 from models.models import User, Payment, Category
 
 # Створюємо router замість Blueprint
 router = APIRouter(tags=["api"])
 
 
-@router.get("/api/payments/period")
+@main_sql_statement
+def _period_statement(shape: MainSqlShape, dialect_name: str) -> str:
+    if dialect_name == 'sqlite':
+        amount_func = "CAST(sum(`amount`) AS INTEGER)"
+    else:
+        amount_func = 'convert(sum(`amount`), UNSIGNED)'
+
+    # Корінь категорії - предок з parent_id = 0 з category_closure
+    return f"""
+    select r.id as category_id, r.name as name, {amount_func} as amount,
+    count(*) as cnt
+    from (
+    {build_main_sql(shape)}
+    ) p
+    left join (
+        `category_closure` cc
+        join `categories` r on r.id = cc.ancestor_id and r.parent_id = 0
+    ) on cc.descendant_id = p.category_id
+    where 1=1 
+    group by r.id, r.name
+    order by 3 desc
+    """
+
+
+@main_sql_statement
+def _years_statement(shape: MainSqlShape) -> str:
+    return f"""
+        SELECT YEAR(rdate) as year,
+               ROUND(SUM(amount), 2) as amount,
+               COUNT(*) as cnt
+        FROM ({build_main_sql(shape)}) p
+        GROUP BY YEAR(rdate)
+        ORDER BY year DESC
+        """
+
+
+_years_grouped_statement = text("""
+SELECT YEAR(rdate) as year,
+       ROUND(SUM(amount), 2) as amount,
+       COUNT(*) as cnt
+FROM
+(
+SELECT rdate, amount, currency FROM payments WHERE amount > 0 AND (is_deleted = 0 OR is_deleted IS NULL) AND user_id = :user_id
+) p
+WHERE 1=1
+GROUP BY YEAR(rdate) ORDER BY 1 DESC
+""")
+
+
+@main_sql_statement
+def _months_statement(shape: MainSqlShape) -> str:
+    return f"""
+    SELECT MONTH(p.rdate) as month,
+           ROUND(SUM(p.amount), 2) as amount,
+           COUNT(*) as cnt
+    FROM ({build_main_sql(shape)}) p
+    WHERE YEAR(p.rdate) = :year
+    GROUP BY MONTH(p.rdate)
+    ORDER BY month DESC
+    """
+
+
+@lru_cache(maxsize=None)
+def _period_rollup_statement(dialect_name: str, has_group_user: bool) -> TextClause:
+    if dialect_name == 'sqlite':
+        amount_func = "CAST(sum(r.`amount_sum`) AS INTEGER)"
+    else:
+        amount_func = 'convert(sum(r.`amount_sum`), UNSIGNED)'
+
+    group_user = "and r.user_id = :group_user_id" if has_group_user else ""
+    return text(f"""
+    select r.root_category_id as category_id, c.name as name, {amount_func} as amount,
+    CAST(sum(r.cnt) AS SIGNED) as cnt
+    from payments_monthly_rollup r
+    left join `categories` c on c.id = r.root_category_id
+    where r.user_id IN :member_ids {group_user}
+    and r.currency_view = :currency and r.`year` = :year and r.`month` = :month
+    group by r.root_category_id, c.name
+    order by 3 desc
+    """).bindparams(bindparam("member_ids", expanding=True))
+
+
+def _current_period() -> int:
+    """
+    Останній місяць (year * 100 + month), який враховують live-запити (p.rdate < get_current_end_date()):
+    rollup містить і майбутні місяці, тож читання без вибраного періоду обмежуються ним
+    """
+    last_day = datetime.strptime(get_current_end_date(), '%Y-%m-%d') - timedelta(days=1)
+    return last_day.year * 100 + last_day.month
+
+
+_years_rollup_statement = text("""
+SELECT `year`,
+       ROUND(SUM(amount_sum), 2) as amount,
+       CAST(SUM(cnt) AS SIGNED) as cnt
+FROM payments_monthly_rollup
+WHERE user_id IN :member_ids AND currency_view = :currency
+AND `year` * 100 + `month` <= :current_period
+GROUP BY `year`
+ORDER BY `year` DESC
+""").bindparams(bindparam("member_ids", expanding=True))
+
+
+_months_rollup_statement = text("""
+SELECT `month`,
+       ROUND(SUM(amount_sum), 2) as amount,
+       CAST(SUM(cnt) AS SIGNED) as cnt
+FROM payments_monthly_rollup
+WHERE user_id IN :member_ids AND currency_view = :currency AND `year` = :year
+GROUP BY `month`
+ORDER BY `month` DESC
+""").bindparams(bindparam("member_ids", expanding=True))
+
+
+@main_sql_statement
+def _dashboard_statement(shape: MainSqlShape) -> str:
+    # Базовий набір рахується один раз (CTE, що використовується тричі, MySQL матеріалізує один раз),
+    # далі з нього - суми за роками, місяцями вибраного року та коренями категорій вибраного місяця
+    return f"""
+    WITH base AS (
+        SELECT YEAR(p.rdate) AS `year`, MONTH(p.rdate) AS `month`,
+               r.id AS category_id, r.name AS name, p.amount
+        FROM ({build_main_sql(shape)}) p
+        LEFT JOIN (
+            `category_closure` cc
+            JOIN `categories` r ON r.id = cc.ancestor_id AND r.parent_id = 0
+        ) ON cc.descendant_id = p.category_id
+    )
+    SELECT 'year' AS kind, `year`, NULL AS `month`, NULL AS category_id, NULL AS name,
+           SUM(amount) AS amount, COUNT(*) AS cnt
+    FROM base
+    GROUP BY `year`
+    UNION ALL
+    SELECT 'month', `year`, `month`, NULL, NULL, SUM(amount), COUNT(*)
+    FROM base
+    WHERE `year` = :year
+    GROUP BY `year`, `month`
+    UNION ALL
+    SELECT 'category', `year`, `month`, category_id, name, SUM(amount), COUNT(*)
+    FROM base
+    WHERE `year` = :year AND `month` = :month
+    GROUP BY `year`, `month`, category_id, name
+    """
+
+
+@lru_cache(maxsize=None)
+def _dashboard_rollup_statement(has_group_user: bool) -> TextClause:
+    group_user = "AND r.user_id = :group_user_id" if has_group_user else ""
+    return text(f"""
+    WITH base AS (
+        SELECT r.`year`, r.`month`, r.root_category_id AS category_id, c.name AS name,
+               r.amount_sum, r.cnt
+        FROM payments_monthly_rollup r
+        LEFT JOIN `categories` c ON c.id = r.root_category_id
+        WHERE r.user_id IN :member_ids {group_user} AND r.currency_view = :currency
+        AND r.`year` * 100 + r.`month` <= :current_period
+    )
+    SELECT 'year' AS kind, `year`, NULL AS `month`, NULL AS category_id, NULL AS name,
+           SUM(amount_sum) AS amount, SUM(cnt) AS cnt
+    FROM base
+    GROUP BY `year`
+    UNION ALL
+    SELECT 'month', `year`, `month`, NULL, NULL, SUM(amount_sum), SUM(cnt)
+    FROM base
+    WHERE `year` = :year
+    GROUP BY `year`, `month`
+    UNION ALL
+    SELECT 'category', `year`, `month`, category_id, name, SUM(amount_sum), SUM(cnt)
+    FROM base
+    WHERE `year` = :year AND `month` = :month
+    GROUP BY `year`, `month`, category_id, name
+    """).bindparams(bindparam("member_ids", expanding=True))
+
+
+@router.get("/api/payments/dashboard", dependencies=[Depends(payments_etag)])
+async def payments_dashboard(
+    year: str = Query("", description="Рік для фільтрації"),
+    month: str = Query("", description="Місяць для фільтрації"),
+    mono_user_id: Optional[str] = Query(None, description="ID користувача Monobank"),
+    currency: str = Query("UAH", description="Валюта"),
+    group_user_id: Optional[int] = Query(None, description="ID користувача групи"),
+    source: Optional[str] = Query(None, description="Джерело платежу для фільтрації (mono|pryvat|pwa|revolut|wise)"),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership),
+):
+    """
+    Дані головного екрану одним запитом: суми за роками, за місяцями вибраного року
+    та за категоріями вибраного місяця (замість /years, /{year}/months та /period)
+    """
+    _, _, start_date = get_dates(month, year)
+    period = datetime.strptime(start_date, '%Y-%m-%d')
+
+    data = {
+        "user_id": current_user.id,
+        "mono_user_id": mono_user_id,
+        "currency": currency or 'UAH',
+        "source": source,
+        "group_user_id": group_user_id,
+        "year": period.year,
+        "month": period.month,
+        **membership.as_params(),
+    }
+
+    if not mono_user_id and not source and data["currency"] in ROLLUP_CURRENCIES:
+        data["current_period"] = _current_period()
+        statement = _dashboard_rollup_statement(bool(group_user_id))
+    else:
+        statement = _dashboard_statement(get_main_sql_shape(data))
+    rows = await cached_aggregate_async("dashboard", statement, data)
+
+    years, months, categories = [], [], []
+    for row in rows:
+        amount = float(row["amount"] or 0)
+        if row["kind"] == "year":
+            years.append({"year": int(row["year"]), "amount": round(amount, 2), "cnt": int(row["cnt"])})
+        elif row["kind"] == "month":
+            months.append({
+                "month": int(row["month"]),
+                "amount": round(amount, 2),
+                "cnt": int(row["cnt"]),
+                "currency": data["currency"],
+            })
+        else:
+            categories.append({
+                "category_id": row["category_id"],
+                "name": row["name"],
+                "amount": int(round(amount)),
+                "cnt": int(row["cnt"]),
+            })
+
+    years.sort(key=lambda item: item["year"], reverse=True)
+    months.sort(key=lambda item: item["month"], reverse=True)
+    categories.sort(key=lambda item: item["amount"], reverse=True)
+
+    return {
+        "year": period.year,
+        "month": period.month,
+        "currency": data["currency"],
+        "years": years,
+        "months": months,
+        "categories": categories,
+    }
+
+
+@router.get("/api/payments/period", dependencies=[Depends(payments_etag)])
 async def payments_for_period(
     request: Request,
     year: str = Query("", description="Рік для фільтрації"),
@@ -29,6 +277,7 @@ async def payments_for_period(
     group_user_id: Optional[str] = Query(None, description="ID користувача групи"),
     source: Optional[str] = Query(None, description="Джерело платежу для фільтрації (mono|pryvat|pwa|revolut|wise)"),
     current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership),
     db: Session = Depends(get_db)
 ):
     """
@@ -60,6 +309,7 @@ async def payments_for_period(
         "mono_user_id": mono_user_id,
         "currency": currency or 'UAH',
         "source": source,
+        **membership.as_params(),
     }
 
     # Додаємо фільтрацію за користувачем з групи
@@ -69,123 +319,83 @@ async def payments_for_period(
         except (ValueError, TypeError):
             data["group_user_id"] = group_user_id
 
-    main_sql = get_main_sql(data)
+    shape = get_main_sql_shape(data)
 
     dialect_name = db.get_bind().dialect.name
+    if dialect_name not in ('sqlite', 'mysql'):
+        raise HTTPException(status_code=400, detail=f"Substring function not implemented for dialect: {dialect_name}")
 
-    if dialect_name == 'sqlite':
-        amount_func = "CAST(sum(`amount`) AS INTEGER)"
-    elif dialect_name == 'mysql':
-        amount_func = 'convert(sum(`amount`), UNSIGNED)'
+    # Календарний місяць без фільтрів, яких немає в rollup, читається з payments_monthly_rollup
+    if not (start_date and end_date) and not mono_user_id and not source and data["currency"] in ROLLUP_CURRENCIES:
+        period = datetime.strptime(calculated_start_date, '%Y-%m-%d')
+        data.update(year=period.year, month=period.month)
+        statement = _period_rollup_statement(dialect_name, bool(group_user_id))
     else:
-        raise HTTPException(status_code=400, detail=f"Substring function not implemented for dialect: {dialect_name}")
+        statement = _period_statement(shape, dialect_name)
 
-    sql = f"""
-    select 
-    IF(c.parent_id = 0, p.category_id, (select id from categories where id=c.parent_id)) as category_id
-    , 
-    IF(c.parent_id = 0, c.name, (select name from categories where id=c.parent_id)) as name
-    , {amount_func} as amount,
-    count(*) as cnt
-    from (
-    {main_sql}
-    ) p left join `categories` c
-    on p.category_id = c.id
-    where 1=1 
-    group by IF(c.parent_id = 0, p.category_id, (select id from categories where id=c.parent_id))
-    , 
-    IF(c.parent_id = 0, c.name, (select name from categories where id=c.parent_id)) order by 3 desc
-    """
-    return do_sql_sel(sql, data)
+    return await cached_aggregate_async("period", statement, data)
 
 
-@router.get("/api/payments/years")
+@router.get("/api/payments/years", dependencies=[Depends(payments_etag)])
 async def payments_by_years(
     grouped: Optional[bool] = Query(False, description="Чи групувати за роками"),
     mono_user_id: Optional[str] = Query(None, description="ID користувача Monobank"),
     currency: str = Query("UAH", description="Валюта"),
     current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership),
 ):
     """
     Повертає платежі згруповані за роками з підтримкою валют UAH, EUR, USD
     """
 
-    substring_func = 'YEAR(rdate)'
-
     data = {"user_id": current_user.id}
     if grouped:
-        main_sql = (f"SELECT rdate, amount, currency FROM payments "
-                    f"WHERE amount > 0 AND (is_deleted = 0 OR is_deleted IS NULL) AND user_id = :user_id")
-    else:
-        data["user_id"] = current_user.id
-        data["mono_user_id"] = mono_user_id
-        data["currency"] = currency or 'UAH'
-
-        # Use get_main_sql for proper currency conversion
-        main_sql_inner = get_main_sql(data)
-
-        sql = f"""
-        SELECT {substring_func} as year,
-               ROUND(SUM(amount), 2) as amount,
-               COUNT(*) as cnt
-        FROM ({main_sql_inner}) p
-        GROUP BY {substring_func}
-        ORDER BY year DESC
-        """
+        return await cached_aggregate_async("years_grouped", _years_grouped_statement, data)
 
-        return do_sql_sel(sql, data)
-
-    sql = f"""
-SELECT {substring_func} as year,
-       ROUND(SUM(amount), 2) as amount,
-       COUNT(*) as cnt
-FROM
-(
-{main_sql}
-) p
-WHERE 1=1
-GROUP BY {substring_func} ORDER BY 1 DESC
-"""
+    data["mono_user_id"] = mono_user_id
+    data["currency"] = currency or 'UAH'
+    data.update(membership.as_params())
 
-    return do_sql_sel(sql, data)
+    if not mono_user_id and data["currency"] in ROLLUP_CURRENCIES:
+        data["current_period"] = _current_period()
+        statement = _years_rollup_statement
+    else:
+        # Use main SQL for proper currency conversion
+        statement = _years_statement(get_main_sql_shape(data))
+    return await cached_aggregate_async("years", statement, data)
 
 
-@router.get("/api/payments/{year}/months")
+@router.get("/api/payments/{year}/months", dependencies=[Depends(payments_etag)])
 async def payment_by_months(
     year: int,
     mono_user_id: Optional[str] = Query(None, description="ID користувача Monobank"),
     currency: str = Query("UAH", description="Валюта"),
     current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership),
     db: Session = Depends(get_db)
 ):
     """
     Повертає платежі згруповані за місяцями в році з підтримкою валют UAH, EUR, USD
     """
 
-    # Use get_main_sql for proper currency conversion
+    # Use main SQL for proper currency conversion
     data = {
         "user_id": current_user.id,
         "start_date": f"{year}-01-01",
         "end_date": f"{year + 1}-01-01",
-        "currency": currency or 'UAH'
+        "currency": currency or 'UAH',
+        "year": year,
+        **membership.as_params(),
     }
 
     if mono_user_id:
         data["mono_user_id"] = mono_user_id
-
-    main_sql = get_main_sql(data)
-
-    sql = f"""
-    SELECT MONTH(p.rdate) as month,
-           ROUND(SUM(p.amount), 2) as amount,
-           COUNT(*) as cnt
-    FROM ({main_sql}) p
-    WHERE YEAR(p.rdate) = {year}
-    GROUP BY MONTH(p.rdate)
-    ORDER BY month DESC
-    """
-
-    result = do_sql_sel(sql, data)
+        statement = _months_statement(get_main_sql_shape(data))
+    elif data["currency"] in ROLLUP_CURRENCIES:
+        statement = _months_rollup_statement
+    else:
+        statement = _months_statement(get_main_sql_shape(data))
+    result = await cached_aggregate_async("months", statement, data)
 
     # Format results
     return [
@@ -0,0 +1,445 @@
+import asyncio
+import datetime
+import inspect
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Hashable, Iterable
+
+from sqlalchemy import TextClause, event
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from fastapi_sqlalchemy import db
+
+from api.rollup.funcs import ROLLUP_BUCKETS_KEY
+from api.versions.funcs import DATA_VERSIONS_KEY, RATES_SCOPE
+from app.config import AGGREGATE_CACHE_MAX_BYTES, AGGREGATE_CACHE_MAX_ENTRIES, AGGREGATE_CACHE_TTL
+from models.models import Category, Config
+from utility_helpers import do_sql_sel
+
+logger = logging.getLogger()
+
+# Ключі session.info: власники, дані яких змінились не через платежі (категорії, конфіг),
+# та зібрана при commit інвалідація, яка застосовується після успішного commit
+CACHE_OWNERS_KEY = "aggregate_cache_owners"
+CACHE_PENDING_KEY = "aggregate_cache_pending"
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires: float
+    size: int
+    user_ids: frozenset
+    group_id: int | None
+    periods: frozenset | None  # (year, month), None - всі місяці
+    fx: bool
+
+
+def _estimate_size(value, _depth: int = 0) -> int:
+    """
+    Приблизний розмір результату в байтах (списки словників зі скалярами)
+    """
+    size = sys.getsizeof(value)
+    if _depth > 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(_estimate_size(k, _depth + 1) + _estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_estimate_size(item, _depth + 1) for item in value)
+    return size
+
+
+def _month_periods(start_date, end_date) -> frozenset | None:
+    """
+    Місяці діапазону [start_date, end_date). Без start_date - None (всі місяці)
+    """
+    if not start_date or not end_date:
+        return None
+    start = datetime.date.fromisoformat(str(start_date)[:10])
+    last = max(datetime.date.fromisoformat(str(end_date)[:10]) - datetime.timedelta(days=1), start)
+    periods = set()
+    year, month = start.year, start.month
+    while (year, month) <= (last.year, last.month):
+        periods.add((year, month))
+        year, month = year + month // 12, month % 12 + 1
+    return frozenset(periods)
+
+
+@dataclass
+class _FlightCall:
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: BaseException | None = None
+    waiters: list = field(default_factory=list)  # (loop, future) асинхронних викликачів
+    loop: asyncio.AbstractEventLoop | None = None  # цикл подій асинхронного лідера
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SingleFlight:
+    """
+    Об'єднує однакові одночасні обчислення: перший викликач з ключем (лідер) виконує функцію,
+    решта чекають на нього і отримують той самий результат або виняток.
+    Синхронні (потоки) та асинхронні викликачі з одним ключем чекають одне обчислення,
+    але синхронний do() не можна викликати з потоку циклу подій асинхронного лідера:
+    блокуючи цикл, він не дав би лідеру завершитись (такий виклик - RuntimeError)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _FlightCall] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def _join(self, key: Hashable, loop: asyncio.AbstractEventLoop | None = None) -> tuple[_FlightCall, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                return call, False
+            call = self._calls[key] = _FlightCall(loop=loop)
+            self.executions += 1
+            return call, True
+
+    def _finish(self, key: Hashable, call: _FlightCall, value: Any = None, error: BaseException | None = None):
+        with self._lock:
+            del self._calls[key]
+            call.value, call.error = value, error
+            call.done.set()
+            waiters, call.waiters = call.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve_future, future, call)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Синхронний режим: fn виконується в потоці лідера, інші потоки чекають
+        """
+        call, leader = self._join(key)
+        if not leader:
+            if call.loop is not None and not call.done.is_set() and _running_loop() is call.loop:
+                raise RuntimeError("SingleFlight.do() would block the event loop of its async leader, use do_async()")
+            call.done.wait()
+            return call.result()
+        try:
+            value = fn()
+        except BaseException as err:
+            self._finish(key, call, error=err)
+            raise
+        self._finish(key, call, value)
+        return value
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Асинхронний режим: корутинна fn виконується в циклі подій, синхронна - в threadpool,
+        щоб цикл подій приймав однакові запити, поки лідер чекає на БД
+        """
+        loop = asyncio.get_running_loop()
+        call, leader = self._join(key, loop)
+        if leader:
+            # Окрема задача: скасування запиту лідера не скасовує обчислення для інших
+            asyncio.ensure_future(self._run_async(key, call, fn))
+        future = loop.create_future()
+        with self._lock:
+            if call.done.is_set():
+                _resolve_future(future, call)
+            else:
+                call.waiters.append((loop, future))
+        return await future
+
+    async def _run_async(self, key: Hashable, call: _FlightCall, fn: Callable[[], Any]):
+        try:
+            if inspect.iscoroutinefunction(fn):
+                value = await fn()
+            else:
+                value = await run_in_threadpool(fn)
+        except BaseException as err:
+            self._finish(key, call, error=err)
+            return
+        self._finish(key, call, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"executions": self.executions, "saved": self.shared, "in_flight": len(self._calls)}
+
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _resolve_future(future: asyncio.Future, call: _FlightCall):
+    if future.done():
+        return
+    if call.error is not None:
+        future.set_exception(call.error)
+    else:
+        future.set_result(call.value)
+
+
+class AggregateCache:
+    """
+    LRU + TTL кеш результатів агрегатних запитів з обмеженням кількості записів і пам'яті.
+    Записи позначені власниками (user_id), групою, місяцями та валютою, тож після commit
+    скидаються лише ті, що покривають змінені місяці. Кеш живе в процесі (один uvicorn процес),
+    зміни з інших процесів (скрипти) обмежені TTL
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        # Лічильник інвалідацій: результат, порахований до інвалідації, не зберігається
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Однакові одночасні промахи кешу рахуються одним запитом до БД
+        self.flight = SingleFlight()
+
+    def _remove(self, key: tuple) -> CacheEntry:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    def get(self, key: tuple) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry.expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry.value
+
+    def put(self, key: tuple, entry: CacheEntry, generation: int):
+        with self._lock:
+            if generation != self._generation or entry.size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _compute_and_put(self, key: tuple, compute: Callable[[], Any], tags: dict) -> Any:
+        generation = self._generation
+        value = compute()
+        self.put(key, self._new_entry(value, tags), generation)
+        return value
+
+    async def _compute_and_put_async(self, key: tuple, compute: Callable[[], Any], tags: dict) -> Any:
+        generation = self._generation
+        value = await compute()
+        self.put(key, self._new_entry(value, tags), generation)
+        return value
+
+    def _new_entry(self, value: Any, tags: dict) -> CacheEntry:
+        return CacheEntry(
+            value=value,
+            expires=time.monotonic() + self.ttl,
+            size=_estimate_size(value),
+            user_ids=frozenset(tags["user_ids"]),
+            group_id=tags.get("group_id"),
+            periods=tags.get("periods"),
+            fx=tags.get("fx", False),
+        )
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], Any], **tags) -> Any:
+        """
+        Повертає збережений результат або обчислює і зберігає його (одне обчислення на ключ).
+        tags: user_ids, group_id, periods, fx - для інвалідації.
+        Результат спільний для всіх запитів - викликачі його не змінюють
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        return self.flight.do(key, lambda: self._compute_and_put(key, compute, tags))
+
+    async def get_or_compute_async(self, key: tuple, compute: Callable[[], Any], **tags) -> Any:
+        """
+        Те саме для async ендпоінтів: синхронний compute виконується в threadpool.
+        Обчислення йде окремою задачею і може пережити запит лідера (middleware закриває його сесію),
+        тож compute отримує власну сесію db
+        """
+        found, value = self.get(key)
+        if found:
+            return value
+        if inspect.iscoroutinefunction(compute):
+            async def compute_in_session():
+                with db():
+                    return await compute()
+
+            return await self.flight.do_async(key, lambda: self._compute_and_put_async(key, compute_in_session, tags))
+
+        def compute_in_session():
+            with db():
+                return compute()
+
+        return await self.flight.do_async(key, lambda: self._compute_and_put(key, compute_in_session, tags))
+
+    def invalidate(
+            self,
+            buckets: Iterable[tuple[int, int, int]] = (),
+            user_ids: Iterable[int] = (),
+            group_ids: Iterable[int] = (),
+            fx: bool = False,
+    ) -> int:
+        """
+        Скидає записи, що покривають змінені місяці (user_id, year, month),
+        всі записи користувачів/груп та (fx) всі записи в EUR/USD
+        """
+        months_by_user: dict[int, set] = {}
+        for user_id, year, month in buckets:
+            months_by_user.setdefault(user_id, set()).add((year, month))
+        user_ids, group_ids = set(user_ids), set(group_ids)
+
+        def is_stale(entry: CacheEntry) -> bool:
+            if fx and entry.fx:
+                return True
+            if entry.user_ids & user_ids or (entry.group_id is not None and entry.group_id in group_ids):
+                return True
+            for user_id in entry.user_ids & months_by_user.keys():
+                if entry.periods is None or entry.periods & months_by_user[user_id]:
+                    return True
+            return False
+
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if is_stale(entry)]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                **{f"flight_{name}": value for name, value in self.flight.stats().items()},
+            }
+
+
+aggregate_cache = AggregateCache(AGGREGATE_CACHE_TTL, AGGREGATE_CACHE_MAX_ENTRIES, AGGREGATE_CACHE_MAX_BYTES)
+
+
+# Як у sqlalchemy text(): :name, але не ::cast
+_BIND_PARAM_RE = re.compile(r"(?<![:\w\x5c]):(\w+)(?!:)")
+
+
+@lru_cache(maxsize=None)
+def _statement_params(statement: TextClause) -> frozenset:
+    return frozenset(_BIND_PARAM_RE.findall(statement.text))
+
+
+def _key_value(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(value)
+    return value
+
+
+def _aggregate_key_and_tags(name: str, statement: TextClause, data: dict) -> tuple[tuple, dict]:
+    # У ключі лише параметри, які використовує запит: учасники групи з однаковими
+    # фільтрами отримують один ключ, навіть якщо user_id у них різний
+    used = _statement_params(statement)
+    params = tuple(sorted((k, _key_value(v)) for k, v in data.items() if k in used and v not in (None, "")))
+    tags = {
+        "user_ids": data.get("member_ids") or [data["user_id"]],
+        "group_id": data.get("group_id"),
+        "periods": _month_periods(data.get("start_date"), data.get("end_date")),
+        "fx": (data.get("currency") or "UAH") != "UAH",
+    }
+    return (name, statement, params), tags
+
+
+def cached_aggregate(
+        name: str, statement: TextClause, data: dict, compute: Callable[[], Any] | None = None
+) -> Any:
+    """
+    Результат запиту statement з параметрами data з кешу (за замовчуванням - do_sql_sel).
+    Теги інвалідації беруться з member_ids та дат data
+    """
+    key, tags = _aggregate_key_and_tags(name, statement, data)
+    return aggregate_cache.get_or_compute(key, compute or (lambda: do_sql_sel(statement, data)), **tags)
+
+
+async def cached_aggregate_async(
+        name: str, statement: TextClause, data: dict, compute: Callable[[], Any] | None = None
+) -> Any:
+    """
+    cached_aggregate для async ендпоінтів: однакові одночасні запити чекають одне обчислення
+    """
+    key, tags = _aggregate_key_and_tags(name, statement, data)
+    return await aggregate_cache.get_or_compute_async(key, compute or (lambda: do_sql_sel(statement, data)), **tags)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_cache_owners(session, flush_context, instances):
+    # Категорії та конфіг змінюють назви/підписи в уже порахованих результатах користувача чи групи
+    owners = session.info.setdefault(CACHE_OWNERS_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Category, Config)):
+            owners.add((obj.user_id, getattr(obj, "group_id", None)))
+
+
+def _snapshot_cache_invalidation(session):
+    # Виконується першим (insert=True), поки rollup і версії ще не забрали свої позначки
+    session.flush()
+    owners = session.info.pop(CACHE_OWNERS_KEY, set())
+    session.info[CACHE_PENDING_KEY] = {
+        "buckets": set(session.info.get(ROLLUP_BUCKETS_KEY, ())),
+        "user_ids": {user_id for user_id, _ in owners if user_id is not None},
+        "group_ids": {group_id for _, group_id in owners if group_id is not None},
+        "fx": RATES_SCOPE in session.info.get(DATA_VERSIONS_KEY, ()),
+    }
+
+
+event.listen(Session, "before_commit", _snapshot_cache_invalidation, insert=True)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_cache_invalidation(session):
+    pending = session.info.pop(CACHE_PENDING_KEY, None)
+    if pending and (pending["buckets"] or pending["user_ids"] or pending["group_ids"] or pending["fx"]):
+        aggregate_cache.invalidate(**pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_invalidation(session):
+    session.info.pop(CACHE_OWNERS_KEY, None)
+    session.info.pop(CACHE_PENDING_KEY, None)
@@ -0,0 +1,131 @@
+import logging
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from fastapi_sqlalchemy import db
+from api.rollup.funcs import mark_rollup_payments
+from models import Category, CategoryClosure, Payment
+from mydb import SessionLocal, text
+
+logger = logging.getLogger()
+
+# Повна перебудова дерева: кожна категорія - сама собі предок (depth 0) плюс усі предки по parent_id.
+# depth < 20 - захист від циклів у parent_id
+REBUILD_CATEGORY_CLOSURE_SQL = """
+INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM categories
+    UNION ALL
+    SELECT t.ancestor_id, c.id, t.depth + 1
+    FROM tree t
+    JOIN categories c ON c.parent_id = t.descendant_id
+    WHERE t.depth < 20
+)
+SELECT ancestor_id, descendant_id, depth FROM tree
+"""
+
+
+def rebuild_category_closure(session: Session | None = None) -> int:
+    """
+    Перебудовує category_closure з categories.parent_id. Commit робить викликач
+    """
+    session = session or db.session
+    session.execute(delete(CategoryClosure))
+    # Корені категорій могли змінитись для будь-якого платежу
+    mark_rollup_payments(session)
+    return session.execute(text(REBUILD_CATEGORY_CLOSURE_SQL)).rowcount
+
+
+def ensure_category_closure_on_startup() -> bool:
+    """
+    Заповнює порожню category_closure при старті (lifespan), наприклад одразу після створення таблиці.
+    Використовує SessionLocal, бо middleware fastapi_sqlalchemy ще не ініціалізований
+    """
+    session = SessionLocal()
+    try:
+        if session.query(CategoryClosure.id).first() or not session.query(Category.id).first():
+            return False
+        rebuild_category_closure(session)
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _ancestor_rows(parent_id: int | None) -> list:
+    if not parent_id:
+        return []
+    return db.session.query(CategoryClosure.ancestor_id, CategoryClosure.depth).filter(
+        CategoryClosure.descendant_id == parent_id
+    ).all()
+
+
+def add_category_closure(category_id: int, parent_id: int | None):
+    """
+    Додає нову категорію (листок) в дерево: вона сама та всі предки батька
+    """
+    rows = [{"ancestor_id": category_id, "descendant_id": category_id, "depth": 0}]
+    rows += [
+        {"ancestor_id": row.ancestor_id, "descendant_id": category_id, "depth": row.depth + 1}
+        for row in _ancestor_rows(parent_id)
+    ]
+    db.session.execute(insert(CategoryClosure), rows)
+
+
+def move_category_closure(category_id: int, parent_id: int | None):
+    """
+    Переносить піддерево категорії під іншого батька
+    """
+    subtree = db.session.query(CategoryClosure.descendant_id, CategoryClosure.depth).filter(
+        CategoryClosure.ancestor_id == category_id
+    ).all()
+    subtree_ids = [row.descendant_id for row in subtree]
+    if parent_id in subtree_ids:
+        raise HTTPException(400, 'Категорію не можна перенести у власну підкатегорію')
+
+    # Платежі піддерева переходять під інший корінь - їх місяці в rollup треба перерахувати
+    mark_rollup_payments(db.session, Payment.category_id.in_(subtree_ids))
+
+    # Відв'язуємо піддерево від старих предків, внутрішні зв'язки лишаються
+    db.session.execute(
+        delete(CategoryClosure).where(
+            CategoryClosure.descendant_id.in_(subtree_ids),
+            CategoryClosure.ancestor_id.not_in(subtree_ids),
+        )
+    )
+
+    rows = [
+        {"ancestor_id": ancestor.ancestor_id, "descendant_id": node.descendant_id, "depth": ancestor.depth + node.depth + 1}
+        for ancestor in _ancestor_rows(parent_id)
+        for node in subtree
+    ]
+    if rows:
+        db.session.execute(insert(CategoryClosure), rows)
+
+
+def delete_category_closure(category_id: int):
+    """
+    Прибирає категорію з дерева. Підкатегорії лишаються без цього предка і без усіх його предків:
+    їх parent_id вказує на видалену категорію, тож (як і при перебудові) вони стають коренями своїх піддерев
+    """
+    subtree_ids = [row.descendant_id for row in db.session.query(CategoryClosure.descendant_id).filter(
+        CategoryClosure.ancestor_id == category_id
+    )]
+    mark_rollup_payments(db.session, Payment.category_id.in_(subtree_ids))
+    # Відв'язуємо піддерево від предків категорії, як у move_category_closure
+    db.session.execute(
+        delete(CategoryClosure).where(
+            CategoryClosure.descendant_id.in_(subtree_ids),
+            CategoryClosure.ancestor_id.not_in(subtree_ids),
+        )
+    )
+    db.session.execute(
+        delete(CategoryClosure).where(
+            (CategoryClosure.ancestor_id == category_id) | (CategoryClosure.descendant_id == category_id)
+        )
+    )
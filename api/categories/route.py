@@ -12,7 +12,7 @@ from api.categories.services import (
     get_category_,
 )
 from api.schemas import CategoryResponse
-from dependencies import get_current_user
+from dependencies import get_current_user, categories_etag
 from models.models import User
 
 # Створюємо Pydantic моделі для запитів та відповідей
@@ -31,7 +31,7 @@ class CategoryUpdate(CategoryBase):
 router = APIRouter(tags=["categories"])
 
 
-@router.get("/api/categories", response_model=List[CategoryResponse])
+@router.get("/api/categories", response_model=List[CategoryResponse], dependencies=[Depends(categories_etag)])
 async def get_categories(current_user: User = Depends(get_current_user)):
     """
     Отримання списку категорій користувача
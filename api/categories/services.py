@@ -3,6 +3,7 @@ from fastapi import HTTPException
 from api.schemas.common import CategoryResponse
 
 
+from api.categories.funcs import add_category_closure, delete_category_closure, move_category_closure
 from models.models import Group, UserGroupAssociation
 from fastapi_sqlalchemy import db
 from models import Category
@@ -71,6 +72,8 @@ def add_category_(user_id: int, data: dict) -> dict:
 
     try:
         db.session.add(category)
+        db.session.flush()
+        add_category_closure(category.id, category.parent_id)
         db.session.commit()
     except Exception as err:
         db.session.rollback()
@@ -89,9 +92,16 @@ def edit_category_(user_id, category_id: int, data: dict) -> dict:
         raise HTTPException(404, 'Not found categories')
 
     data['user_id'] = user_id
+    old_parent_id = category.parent_id
     category.update(**data)
 
-    db.session.commit()
+    try:
+        if category.parent_id != old_parent_id:
+            move_category_closure(category.id, category.parent_id)
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        raise err
     return CategoryResponse.model_validate(category).model_dump()
 
 
@@ -104,8 +114,13 @@ def delete_category_(category_id: int) -> dict:
     if not category:
         raise HTTPException(404, 'Not found categories')
 
-    db.session.delete(category)
-    db.session.commit()
+    try:
+        delete_category_closure(category.id)
+        db.session.delete(category)
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        raise err
 
     return {"result": "ok"}
 
@@ -72,13 +72,12 @@ def check_and_fill_spr_config_table() -> bool:
    
 
 def add_new_config_row(data: dict) -> dict:
-
+    """
+    Додає правило (flush без commit): платежі, яких воно стосується, оновлюються в тій самій транзакції.
+    Commit робить викликач
+    """
     config = Config(**data)
-    try:
-        db.session.add(config)
-        db.session.commit()
-    except Exception as err:
-        db.session.rollback()
-        raise err
+    db.session.add(config)
+    db.session.flush()
 
     return ConfigResponse.model_validate(config).model_dump()
@@ -48,6 +48,9 @@ def add_config_(user_id: int, data: dict) -> list[dict]:
     """
     add config
     """
+    # api.payments тягне роутер, а той - api.config, тому імпорт тут
+    from api.payments.funcs import update_payments_excluded_from_stat, update_payments_phone_label
+
     result = []
     
     is_multiple = True
@@ -68,7 +71,17 @@ def add_config_(user_id: int, data: dict) -> list[dict]:
             raise HTTPException(status_code=400, detail='not allowed multiple values for this key')
 
     data['user_id'] = user_id
-    result.append(add_new_config_row(data))
+    try:
+        result.append(add_new_config_row(data))
+        # Нове правило телефону - підписуємо тільки платежі з цим номером
+        if data['type_data'] == ConfigTypes.PHONE_TO_NAME.value:
+            update_payments_phone_label(user_id, data['value_data'], data.get('add_value'))
+        if data['type_data'] == ConfigTypes.EXCLUDE_FROM_STAT.value:
+            update_payments_excluded_from_stat(user_id, data['value_data'], True)
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        raise err
 
     return result
 
@@ -77,13 +90,25 @@ def edit_config_(config_id: int, data: dict) -> dict:
     """
     edit mono user
     """
+    from api.payments.funcs import update_payments_excluded_from_stat, update_payments_phone_label
+
     config = db.session.query(Config).get(config_id)
     if not config:
         raise HTTPException(status_code=404, detail='Not found config')
 
+    old_type_data, old_value_data = config.type_data, config.value_data
     config.update(**data)
 
     try:
+        # Переписуємо тільки платежі, яких стосується старе і нове значення правила
+        if old_type_data == ConfigTypes.PHONE_TO_NAME.value:
+            update_payments_phone_label(config.user_id, old_value_data, None)
+        if config.type_data == ConfigTypes.PHONE_TO_NAME.value:
+            update_payments_phone_label(config.user_id, config.value_data, config.add_value)
+        if old_type_data == ConfigTypes.EXCLUDE_FROM_STAT.value:
+            update_payments_excluded_from_stat(config.user_id, old_value_data, False)
+        if config.type_data == ConfigTypes.EXCLUDE_FROM_STAT.value:
+            update_payments_excluded_from_stat(config.user_id, config.value_data, True)
         db.session.commit()
     except Exception as err:
         db.session.rollback()
@@ -96,12 +121,18 @@ def delete_config_(config_id: int) -> dict[str, str]:
     """
     delete mono user
     """
+    from api.payments.funcs import update_payments_excluded_from_stat, update_payments_phone_label
+
 
     config = db.session.query(Config).get(config_id)
     if not config:
         raise HTTPException(status_code=404, detail='Not found config')
 
     try:
+        if config.type_data == ConfigTypes.PHONE_TO_NAME.value:
+            update_payments_phone_label(config.user_id, config.value_data, None)
+        if config.type_data == ConfigTypes.EXCLUDE_FROM_STAT.value:
+            update_payments_excluded_from_stat(config.user_id, config.value_data, False)
         db.session.delete(config)
         db.session.commit()
     except Exception as err:
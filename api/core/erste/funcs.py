@@ -8,9 +8,8 @@ from typing import List, Dict, Any
 import pdfplumber
 from io import BytesIO
 
-from models.models import User
 from api.schemas import PaymentData
-from api.funcs import find_category, get_last_rate
+from api.core.funcs import ImportContext
 
 logger = logging.getLogger()
 
@@ -163,12 +162,12 @@ def parse_ecomm_transaction_multiline(lines: List[str], year: int) -> Dict[str,
         logger.error(f"Помилка при парсингу E-COMM транзакції: {e}")
         return None
 
-def erste_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
+def erste_to_pmt(context: ImportContext, transaction: Dict[str, Any]) -> PaymentData | None:
     """
     Конвертує транзакцію Erste Bank в PaymentData
     
     Args:
-        user: Користувач
+        context: Контекст імпорту (користувач, правила, курси)
         transaction: Дані транзакції з PDF
         
     Returns:
@@ -184,18 +183,18 @@ def erste_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
         # Очищуємо опис від зайвих символів та пробілів
         description = re.sub(r'\s+', ' ', description).strip()
         
-        category_id, is_deleted = find_category(user, description)
+        category_id, is_deleted = context.find_category(description)
         
         # Створюємо унікальний ID для банківського платежу
-        unique_string = f"erste_{user.id}_{transaction['date'].strftime('%Y%m%d')}_{description}_{transaction['amount']}"
+        unique_string = f"erste_{context.user.id}_{transaction['date'].strftime('%Y%m%d')}_{description}_{transaction['amount']}"
         bank_payment_id = hashlib.md5(unique_string.encode()).hexdigest()
         
         # Конвертуємо EUR в UAH
         eur_amount = abs(transaction['amount'])
-        uah_amount = eur_amount * get_last_rate("EUR", transaction['date'])
+        uah_amount = eur_amount * context.rate("EUR", transaction['date'])
         
         return PaymentData(
-            user_id=user.id,
+            user_id=context.user.id,
             rdate=transaction['date'],
             category_id=category_id,
             mydesc=description.replace("'", ""),
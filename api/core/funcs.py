@@ -2,43 +2,178 @@
 import hashlib
 import logging
 import datetime
+from dataclasses import dataclass, field
+from typing import Iterable
 
-from pandas import Series
+import numpy as np
+from pandas import DataFrame, Series, to_datetime, to_numeric
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
 
 from models.models import User
 from api.schemas import PaymentData
-from api.funcs import find_category, get_last_rate
+from api.payments.funcs import create_bank_payment_id
+from api.rates.funcs import as_rate_datetime, rate_table
+from api.rules.funcs import UserRuleSet, user_rules
+from fastapi_sqlalchemy import db
 
 logger = logging.getLogger()
 
 
-def p24_to_pmt(user: User, data: Series) -> PaymentData | None:
-    if data.iloc[0] == 'Дата':
-        return None
-
-    try:
-        amount = data.iloc[4] * -1
-    except Exception as err:
-        print(f"Error: {err}")
-        amount = 0
-
-    mydesc = data.iloc[3]
-    category_id, is_deleted = find_category(user, mydesc)
-
-    if data.iloc[7] not in ["EUR", "USD", "UAH"]:
-        mydesc = data.iloc[3] + f"; {data.iloc[6]}{data.iloc[7]}"
-
-    return PaymentData(
-        user_id=user.id,
-        rdate=datetime.datetime.strptime(data.iloc[0], "%d.%m.%Y %H:%M:%S"),
-        category_id=category_id,
-        mydesc=mydesc,
-        amount=round(amount),
-        currency=data.iloc[7] if data.iloc[7] in ["EUR", "USD"] else "UAH",
-        type_payment="card",
-        source="p24",
-        bank_payment_id=hashlib.md5(str(data).encode()).hexdigest(),
-        currency_amount=float(data.iloc[6]) if data.iloc[7] in ["EUR", "USD"] else data.iloc[
-                                                                              4] * -1,
-        is_deleted=is_deleted,
+def _as_datetime64(dates: Iterable) -> np.ndarray:
+    if isinstance(dates, (Series, np.ndarray)) and np.issubdtype(dates.dtype, np.datetime64):
+        return np.asarray(dates, dtype="datetime64[us]")
+    return np.asarray([as_rate_datetime(value) for value in dates], dtype="datetime64[us]")
+
+
+@dataclass
+class ImportContext:
+    """
+    Спільний стан одного імпорту виписки для всіх конвертерів api/core/*:
+    користувач, його скомпільовані правила категорій та курси вікна виписки.
+    Курси валют виписки за min..max дату беруться з RateTable один раз (prefetch_rates),
+    далі пошук на дату рядка - у вікні в пам'яті, без запитів і звірки версії на кожен рядок
+    """
+    user: User
+    session: Session
+    rules: UserRuleSet
+    _rates: dict[str, tuple[np.ndarray, np.ndarray]] = field(default_factory=dict)
+    _window: tuple[np.datetime64, np.datetime64] | None = None
+
+    @classmethod
+    def create(cls, user: User, session: Session | None = None) -> "ImportContext":
+        session = session or db.session
+        return cls(user=user, session=session, rules=user_rules.get(session, user.id))
+
+    def prefetch_rates(self, currencies: Iterable[str], dates: Iterable):
+        """
+        Завантажує курси всіх валют виписки для її діапазону дат
+        """
+        dates = _as_datetime64(dates)
+        if not len(dates):
+            return
+        start, end = dates.min(), dates.max()
+        if self._window:
+            start, end = min(start, self._window[0]), max(end, self._window[1])
+        if self._window != (start, end):
+            self._rates = {}
+        self._window = (start, end)
+        for currency in dict.fromkeys(currencies):
+            if currency != "UAH" and currency not in self._rates:
+                self._rates[currency] = rate_table.window(
+                    self.session, currency, start.astype(datetime.datetime), end.astype(datetime.datetime)
+                )
+
+    def rates(self, currency: str, dates: Iterable) -> np.ndarray:
+        """
+        Курс currency (як get_last_rate) на кожну дату, NaN - курсу немає
+        """
+        dates = _as_datetime64(dates)
+        if currency == "UAH":
+            return np.ones(len(dates))
+        window = self._rates.get(currency)
+        if window is None or not len(dates) or dates.min() < self._window[0] or dates.max() > self._window[1]:
+            # Валюту чи дату не завантажено наперед - звичайний пошук у RateTable
+            return rate_table.rates_for(self.session, currency, dates)
+        window_dates, window_rates = window
+        positions = np.searchsorted(window_dates, dates, side="right") - 1
+        rates = window_rates[np.maximum(positions, 0)] if len(window_rates) else np.full(len(dates), np.nan)
+        rates[positions < 0] = np.nan
+        return rates
+
+    def rate(self, currency: str, end_date) -> float:
+        """
+        get_last_rate з вікна імпорту
+        """
+        sale_rate = self.rates(currency, [end_date])[0]
+        if np.isnan(sale_rate):
+            raise Exception(f"not found rates for {currency}")
+        return float(sale_rate)
+
+    def frame_rates(self, currencies: Series, dates: Series) -> np.ndarray:
+        """
+        Курс для кожного рядка виписки: один векторний пошук на валюту, NaN - курсу немає
+        (такі рядки логуються попередженням: конвертери ставлять їм суму 0)
+        """
+        self.prefetch_rates(currencies.unique(), dates)
+        rates = np.full(len(currencies), np.nan)
+        for currency, positions in currencies.groupby(currencies.to_numpy()).indices.items():
+            rates[positions] = self.rates(currency, dates.iloc[positions])
+            if missing := int(np.isnan(rates[positions]).sum()):
+                logger.warning(f"not found rates for {currency}: {missing} statement rows, amount set to 0")
+        return rates
+
+    def find_category(self, description: str) -> tuple[int, bool]:
+        """
+        find_category з правилами, скомпільованими на початку імпорту
+        """
+        category_id, is_deleted = self.rules.find_category(description)
+        if not category_id:
+            category_id = self.rules.category_id(self.session, description)
+        return category_id, is_deleted
+
+    def category_columns(self, descriptions: Series) -> tuple[list, list]:
+        """
+        Категорії колонки описів: кожен унікальний опис перевіряється один раз
+        """
+        categories = {description: self.find_category(description) for description in dict.fromkeys(descriptions)}
+        return (
+            [categories[description][0] for description in descriptions],
+            [categories[description][1] for description in descriptions],
+        )
+
+
+# Пакетна валідація платежів виписки: один виклик замість PaymentData на кожен рядок
+PAYMENTS_ADAPTER = TypeAdapter(list[PaymentData])
+
+
+def validate_payments(columns: dict, bank_payment_ids: list | None = None) -> list[dict]:
+    """
+    Колонки платежів (списки однакової довжини) -> список словників як PaymentData.model_dump().
+    Без bank_payment_ids ідентифікатор рахується create_bank_payment_id з уже провалідованих даних
+    """
+    keys = list(columns)
+    records = [dict(zip(keys, values)) for values in zip(*columns.values())]
+    payments = PAYMENTS_ADAPTER.dump_python(PAYMENTS_ADAPTER.validate_python(records))
+    for i, payment in enumerate(payments):
+        payment["bank_payment_id"] = bank_payment_ids[i] if bank_payment_ids is not None else create_bank_payment_id(payment)
+    return payments
+
+
+def p24_frame_to_payments(context: ImportContext, df: DataFrame) -> list[dict]:
+    """
+    Виписка ПриватБанку (p24) -> платежі: витрати, дати та суми - операціями над колонками
+    """
+    df = df[df.iloc[:, 0] != 'Дата']
+    if df.empty:
+        return []
+
+    descriptions = df.iloc[:, 3]
+    card_amount = to_numeric(df.iloc[:, 4], errors="coerce").fillna(0) * -1
+    currency_code = df.iloc[:, 7]
+    is_rate_currency = currency_code.isin(["EUR", "USD"]).to_numpy()
+    category_ids, is_deleted = context.category_columns(descriptions)
+
+    mydesc = descriptions.where(
+        currency_code.isin(["EUR", "USD", "UAH"]),
+        descriptions + "; " + df.iloc[:, 6].map(lambda value: f"{value}") + currency_code.map(lambda value: f"{value}"),
+    )
+    currency_amount = np.where(
+        is_rate_currency, to_numeric(df.iloc[:, 6], errors="coerce"), card_amount.to_numpy()
     )
+
+    # Ідентифікатор p24 - md5 від представлення рядка: рахується порядково, щоб збігатись з уже імпортованими
+    bank_payment_ids = df.apply(lambda row: hashlib.md5(str(row).encode()).hexdigest(), axis=1).tolist()
+
+    return validate_payments({
+        "user_id": [context.user.id] * len(df),
+        "rdate": list(to_datetime(df.iloc[:, 0], format="%d.%m.%Y %H:%M:%S").dt.to_pydatetime()),
+        "category_id": category_ids,
+        "mydesc": mydesc.tolist(),
+        "amount": np.round(card_amount.to_numpy()).astype(int).tolist(),
+        "currency": np.where(is_rate_currency, currency_code.to_numpy(), "UAH").tolist(),
+        "type_payment": ["card"] * len(df),
+        "source": ["p24"] * len(df),
+        "currency_amount": currency_amount.tolist(),
+        "is_deleted": is_deleted,
+    }, bank_payment_ids)
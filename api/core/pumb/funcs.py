@@ -10,9 +10,8 @@ from typing import List, Dict, Any
 import pdfplumber
 from io import BytesIO
 
-from models.models import User
 from api.schemas import PaymentData
-from api.funcs import find_category
+from api.core.funcs import ImportContext
 
 logger = logging.getLogger()
 
@@ -141,12 +140,12 @@ def parse_transaction_line(line: str) -> Dict[str, Any] | None:
         logger.error(f"Помилка при парсингу рядка транзакції '{line}': {e}")
         return None
 
-def pumb_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
+def pumb_to_pmt(context: ImportContext, transaction: Dict[str, Any]) -> PaymentData | None:
     """
     Конвертує транзакцію ПУМБ в PaymentData
     
     Args:
-        user: Користувач
+        context: Контекст імпорту (користувач, правила, курси)
         transaction: Дані транзакції з PDF
         
     Returns:
@@ -162,11 +161,11 @@ def pumb_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
         # Очищуємо опис від зайвих символів
         description = re.sub(r'\s+', ' ', description).strip()
         
-        category_id, is_deleted = find_category(user, description)
+        category_id, is_deleted = context.find_category(description)
         
         # Створюємо унікальний ID для банківського платежу
         # Включаємо порядковий номер для гарантії унікальності
-        unique_string = (f"pumb_{user.id}_{transaction['date'].strftime('%Y%m%d')}_"
+        unique_string = (f"pumb_{context.user.id}_{transaction['date'].strftime('%Y%m%d')}_"
                         f"{description}_{transaction['uah_amount']}_{transaction.get('sequence_number', 0)}_"
                         )  # Мікросекунди для унікальності
         bank_payment_id = hashlib.md5(unique_string.encode()).hexdigest()
@@ -189,7 +188,7 @@ def pumb_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
                 currency_amount = transaction['currency_amount']
         
         return PaymentData(
-            user_id=user.id,
+            user_id=context.user.id,
             rdate=transaction['date'],
             category_id=category_id,
             mydesc=description.replace("'", ""),
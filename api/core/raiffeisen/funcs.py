@@ -7,9 +7,8 @@ from decimal import Decimal
 from typing import List, Dict, Any
 from io import StringIO
 
-from models.models import User
 from api.schemas import PaymentData
-from api.funcs import find_category, get_last_rate
+from api.core.funcs import ImportContext
 
 logger = logging.getLogger()
 
@@ -142,12 +141,12 @@ def parse_transaction_row(row: Dict[str, str]) -> Dict[str, Any] | None:
         return None
 
 
-def raiffeisen_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData | None:
+def raiffeisen_to_pmt(context: ImportContext, transaction: Dict[str, Any]) -> PaymentData | None:
     """
     Convert Raiffeisen transaction to PaymentData
 
     Args:
-        user: User object
+        context: Import context (user, rules, rates)
         transaction: Transaction data from CSV
 
     Returns:
@@ -165,10 +164,10 @@ def raiffeisen_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData |
         description = description.replace('"', '').strip()
 
         # Find category
-        category_id, is_deleted = find_category(user, description)
+        category_id, is_deleted = context.find_category(description)
 
         # Create unique bank payment ID
-        unique_string = (f"raiffeisen_{user.id}_{transaction['date'].strftime('%Y%m%d')}_"
+        unique_string = (f"raiffeisen_{context.user.id}_{transaction['date'].strftime('%Y%m%d')}_"
                         f"{description}_{abs(transaction['amount_uah'])}")
         bank_payment_id = hashlib.md5(unique_string.encode()).hexdigest()
 
@@ -181,12 +180,12 @@ def raiffeisen_to_pmt(user: User, transaction: Dict[str, Any]) -> PaymentData |
             try:
                 uah_amount = transaction['amount_uah']
             except:
-                uah_amount = currency_amount * get_last_rate(currency, transaction['date'])
+                uah_amount = currency_amount * context.rate(currency, transaction['date'])
         else:
             uah_amount = currency_amount
 
         return PaymentData(
-            user_id=user.id,
+            user_id=context.user.id,
             rdate=transaction['date'],
             category_id=category_id,
             mydesc=description.replace("'", ""),
@@ -1,39 +1,39 @@
 # _*_ coding:UTF-8 _*_
 import logging
 
-from models.models import User
-from api.payments.funcs import create_bank_payment_id
-from api.funcs import find_category, get_last_rate
-from api.schemas import PaymentData
+import numpy as np
+from pandas import DataFrame, to_datetime
 
-logger = logging.getLogger()
-
-
-def revolut_to_pmt(user: User, data) -> PaymentData | None:
-    if data["Amount"] > 0:
-        return None
+from api.core.funcs import ImportContext, validate_payments
 
-    try:
-        amount = data["Amount"] * -1 * get_last_rate(data["Currency"], data["Started Date"])
-    except Exception as err:
-        logger.error(f"{err}")
-        amount = 0
-
-    description = data["Description"]
-    category_id, is_deleted = find_category(user, description)
+logger = logging.getLogger()
 
-    pmt = PaymentData(
-        user_id=user.id,
-        rdate=data["Started Date"],
-        category_id=category_id,
-        mydesc=description.replace("'", ""),
-        amount=amount,
-        currency=data["Currency"],
-        type_payment="card",
-        source="revolut",
-        currency_amount=data["Amount"] * -1,
-        is_deleted=is_deleted,
-    )
 
-    pmt.bank_payment_id = create_bank_payment_id(pmt.dict())
-    return pmt
+def revolut_frame_to_payments(context: ImportContext, df: DataFrame) -> list[dict]:
+    """
+    Виписка Revolut -> платежі: витрати, дати, курси та суми - операціями над колонками.
+    Сума в UAH округлюється до цілого, як у PaymentData.amount та інших банків
+    """
+    df = df[~(df["Amount"] > 0)]
+    if df.empty:
+        return []
+
+    rdate = to_datetime(df["Started Date"])
+    currency_amount = df["Amount"].astype(float) * -1
+    rates = context.frame_rates(df["Currency"], rdate)
+    amount = np.nan_to_num(currency_amount.to_numpy() * rates, nan=0.0)
+    descriptions = df["Description"].fillna("")
+    category_ids, is_deleted = context.category_columns(descriptions)
+
+    return validate_payments({
+        "user_id": [context.user.id] * len(df),
+        "rdate": list(rdate.dt.to_pydatetime()),
+        "category_id": category_ids,
+        "mydesc": descriptions.str.replace("'", "", regex=False).tolist(),
+        "amount": np.round(amount).astype(int).tolist(),
+        "currency": df["Currency"].tolist(),
+        "type_payment": ["card"] * len(df),
+        "source": ["revolut"] * len(df),
+        "currency_amount": currency_amount.tolist(),
+        "is_deleted": is_deleted,
+    })
@@ -1,43 +1,39 @@
 # _*_ coding:UTF-8 _*_
 import logging
-import datetime
 
-from pandas import Series
+import numpy as np
+from pandas import DataFrame, api as pd_api, to_datetime
 
-from models.models import User
-from api.schemas import PaymentData
-from api.funcs import find_category, get_last_rate
+from api.core.funcs import ImportContext, validate_payments
 
 logger = logging.getLogger()
 
 
-def wise_to_pmt(user: User, data: Series) -> PaymentData | None:
-    if data["Amount"] > 0:
-        return None
-
-    current_date = data["Date"] if isinstance(data["Date"], datetime.datetime) else datetime.datetime.strptime(
-        data["Date"],
-        "%d-%m-%Y"
-    )
-    try:
-        amount = data["Amount"] * -1 * get_last_rate(data["Currency"], current_date)
-    except Exception as err:
-        logger.error(f"{err}")
-        amount = 0
-
-    description = data["Merchant"] if isinstance(data["Merchant"], str) else data["Description"]
-    category_id, is_deleted = find_category(user, description)
-
-    return PaymentData(
-        user_id=user.id,
-        rdate=current_date,
-        category_id=category_id,
-        mydesc=description.replace("'", ""),
-        amount=round(amount),
-        currency=data["Currency"],
-        type_payment="card",
-        source="wise",
-        bank_payment_id=data["ID"] if "ID" in data else data["TransferWise ID"],
-        currency_amount=float(data["Amount"]) * -1,
-        is_deleted=is_deleted,
-    )
+def wise_frame_to_payments(context: ImportContext, df: DataFrame) -> list[dict]:
+    """
+    Виписка Wise -> платежі: витрати, дати, курси та суми - операціями над колонками
+    """
+    df = df[~(df["Amount"] > 0)]
+    if df.empty:
+        return []
+
+    rdate = df["Date"]
+    if not pd_api.types.is_datetime64_any_dtype(rdate):
+        rdate = to_datetime(rdate, format="%d-%m-%Y")
+    currency_amount = df["Amount"].astype(float) * -1
+    amount = np.nan_to_num(currency_amount.to_numpy() * context.frame_rates(df["Currency"], rdate), nan=0.0)
+    descriptions = df["Merchant"].where(df["Merchant"].map(lambda value: isinstance(value, str)), df["Description"])
+    category_ids, is_deleted = context.category_columns(descriptions)
+
+    return validate_payments({
+        "user_id": [context.user.id] * len(df),
+        "rdate": list(rdate.dt.to_pydatetime()),
+        "category_id": category_ids,
+        "mydesc": descriptions.str.replace("'", "", regex=False).tolist(),
+        "amount": np.round(amount).astype(int).tolist(),
+        "currency": df["Currency"].tolist(),
+        "type_payment": ["card"] * len(df),
+        "source": ["wise"] * len(df),
+        "currency_amount": currency_amount.tolist(),
+        "is_deleted": is_deleted,
+    }, (df["ID"] if "ID" in df else df["TransferWise ID"]).tolist())
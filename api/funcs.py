@@ -1,120 +1,154 @@
 import logging
 from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, NamedTuple
 
-from api.config.schemas import ConfigTypes
-from api.mono.funcs import get_category_id
+from sqlalchemy import TextClause, bindparam
+
+from api.groups.services import resolve_group_membership
+from api.rates.funcs import rate_table
+from api.rules.funcs import user_rules
+from fastapi_sqlalchemy import db
 from models import Payment, User
-from mydb import db
-from utility_helpers import do_sql_sel
+from mydb import text
 
 logger = logging.getLogger()
 
 
 def get_last_rate(currency, end_date):
-    if currency == 'UAH':
-        return 1
+    """
+    Останній курс currency на end_date (з RateTable в пам'яті, без запиту до БД)
+    """
+    sale_rate = rate_table.get_rate(db.session, currency, end_date)
+    if sale_rate is None:
+        raise Exception(f"not found rates for {currency}")
+    return sale_rate
 
-    sql_get_rate = f"""SELECT `saleRate` 
-    FROM spr_exchange_rates 
-    WHERE currency = '{currency}' AND rdate <= '{end_date}' 
-    ORDER BY rdate DESC 
-    LIMIT 1"""
 
-    result = do_sql_sel(sql_get_rate)
+def get_last_rates(pairs) -> dict:
+    """
+    Курси як у get_last_rate для багатьох пар (валюта, дата).
+    Повертає {(валюта, дата): курс}; пар без курсу в результаті немає
+    """
+    result = {}
+    for currency, end_date in dict.fromkeys(pairs):
+        sale_rate = rate_table.get_rate(db.session, currency, end_date)
+        if sale_rate is not None:
+            result[(currency, end_date)] = sale_rate
+    return result
 
-    if len(result) < 1:
-        raise Exception(f"not found rates for {currency}")
 
-    sale_rate = result[0]["saleRate"]
+class MainSqlShape(NamedTuple):
+    """
+    Форма фільтрів основного запиту. Визначає текст SQL, тому є ключем кешу
+    скомпільованих запитів - значення фільтрів завжди передаються як bound параметри
+    """
+    currency: str
+    has_start_date: bool
+    has_category: bool
+    has_source: bool
+    has_q: bool
+    has_group_user: bool
+    has_mono_user: bool
+    has_search: bool = False
+    deleted: bool = False
+
+
+def get_main_sql_shape(data: dict) -> MainSqlShape:
+    """
+    Нормалізує параметри запиту (in-place) та повертає форму фільтрів.
+    Очікує group_id та member_ids з GroupMembership.as_params(); якщо їх немає,
+    членство визначається тут (для викликів поза запитом)
+    """
+    if "member_ids" not in data:
+        data.update(resolve_group_membership(data["user_id"]).as_params())
+
+    data["currency"] = data.get("currency") or "UAH"
 
-    return sale_rate
+    if not data.get("end_date"):
+        data["end_date"] = get_current_end_date()
+    if q := data.get("q"):
+        data["q_like"] = f"%{q.lower()}%"
+    if search := data.get("search"):
+        # Кожне слово - обов'язкова фраза: з ngram парсером це точний збіг підрядка, а не будь-яка біграма
+        words = search.replace('"', " ").split()
+        data["search_against"] = " ".join(f'+"{word}"' for word in words)
+
+    return MainSqlShape(
+        currency="UAH" if data["currency"] == "UAH" else "FX",
+        has_start_date=bool(data.get("start_date")),
+        has_category=bool(data.get("category_id")),
+        has_source=bool(data.get("source")),
+        has_q=bool(q),
+        has_group_user=bool(data.get("group_user_id")),
+        has_mono_user=bool(data.get("mono_user_id")),
+        has_search=bool(search),
+        deleted=bool(data.get("deleted")),
+    )
 
 
-def get_main_sql(
-        data: dict | None,
-        um: list = None,
-) -> str:
+@lru_cache(maxsize=None)
+def build_main_sql(shape: MainSqlShape) -> str:
+    """
+    Будує текст основного запиту платежів для форми фільтрів.
+    Результат кешується, тож SQL збирається один раз на кожну форму
+    """
     condition = []
     joins = []
-    if um is None:
-        um = []
 
-    user_id = data.get("user_id")
-    data["type_data"] = ConfigTypes.EXCLUDE_FROM_STAT.value
-
-    if not data.get("end_date"):
-        data["end_date"] = get_current_end_date()
-    if data.get("start_date"):
+    if shape.has_start_date:
         condition.append(" and p.`rdate` >= :start_date")
 
     condition.append(" and p.`rdate` < :end_date")
 
+    # Учасники групи визначені заздалегідь, тож сканування - це простий діапазон по (user_id, rdate)
+    condition.append(" and p.user_id IN :member_ids")
+
     # Додаємо фільтр за конкретним користувачем групи
-    if data.get("group_user_id"):
+    if shape.has_group_user:
         condition.append(" and p.user_id = :group_user_id")
-    else:
-        # Якщо не вказано конкретного користувача, фільтруємо за всіма користувачами групи
-        condition.append(" and p.user_id IN (SELECT u.id FROM users u JOIN user_group_association uga ON u.id = uga.user_id JOIN `groups` g ON uga.group_id = g.id WHERE g.id = (SELECT g.id FROM `groups` g JOIN user_group_association uga ON g.id = uga.group_id WHERE uga.user_id = :user_id LIMIT 1))")
 
     # Додаємо JOIN для категорій, щоб включити як користувацькі, так і групові категорії
     joins.append("""
     LEFT JOIN categories c ON p.category_id = c.id
     LEFT JOIN categories gc ON (
         c.name = gc.name AND 
-        gc.group_id = (SELECT g.id FROM `groups` g JOIN user_group_association uga ON g.id = uga.group_id WHERE uga.user_id = :user_id LIMIT 1) AND
+        gc.group_id = :group_id AND
         (c.parent_id = gc.parent_id OR (c.parent_id IS NULL AND gc.parent_id IS NULL))
     )
     """)
 
     # Залишаємо фільтр за mono_user_id для зворотної сумісності
-    if data.get("mono_user_id"):
+    if shape.has_mono_user:
         condition.append(" and mono_user_id = :mono_user_id")
 
     # Фільтрація по джерелу платежу
-    if data.get("source"):
+    if shape.has_source:
         condition.append(" and p.source = :source")
 
-    if data.get("q"):
-        condition.append(" and (c.`name` like %:q% or gc.`name` like %:q%)")
-
-    if data.get("category_id"):
-        # Додаємо рекурсивний CTE для категорій
-        recursive_cte = """
-        WITH RECURSIVE CategoryPath AS (
-            SELECT id, name, parent_id, group_id, user_id
-            FROM categories
-            WHERE id = :category_id AND (
-                group_id IN (
-                    SELECT g.id 
-                    FROM `groups` g
-                    JOIN user_group_association uga ON g.id = uga.group_id
-                    WHERE uga.user_id = :user_id
-                ) OR 
-                user_id = :user_id OR 
-                group_id IS NULL
-            )
-            UNION ALL
-            SELECT c.id, c.name, c.parent_id, c.group_id, c.user_id
-            FROM categories c
-            INNER JOIN CategoryPath cp ON cp.id = c.parent_id
-            WHERE (
-                c.group_id IN (
-                    SELECT g.id 
-                    FROM `groups` g
-                    JOIN user_group_association uga ON g.id = uga.group_id
-                    WHERE uga.user_id = :user_id
-                ) OR 
-                c.user_id = :user_id OR 
-                c.group_id IS NULL
-            )
-        )
-        """
-        joins.append("JOIN CategoryPath cp ON p.category_id = cp.id")
-    else:
-        recursive_cte = ""
+    # Пошук по опису платежу або назві категорії
+    if shape.has_q:
+        condition.append(" and (LOWER(p.`mydesc`) LIKE :q_like or c.`name` LIKE :q_like or gc.`name` LIKE :q_like)")
+
+    # Повнотекстовий пошук по FULLTEXT (ngram) індексу, релевантність повертається як score
+    score = ""
+    if shape.has_search:
+        condition.append(" and MATCH(p.`mydesc`) AGAINST (:search_against IN BOOLEAN MODE)")
+        score = ",\n           MATCH(p.`mydesc`) AGAINST (:search_against IN BOOLEAN MODE) AS score"
+
+    if shape.has_category:
+        # Піддерево категорії з category_closure - звичайний join замість рекурсивного CTE
+        joins.append("""
+    JOIN category_closure cc ON cc.descendant_id = p.category_id AND cc.ancestor_id = :category_id
+    JOIN categories cr ON cr.id = cc.ancestor_id AND (
+        cr.group_id = :group_id OR
+        cr.user_id = :user_id OR
+        cr.group_id IS NULL
+    )
+    """)
 
     # Currency conversion logic
-    if data.get("currency") == "UAH":
+    if shape.currency == "UAH":
         # For UAH display: use currency_amount for UAH payments (exact amount with kopiykas)
         # but use amount for EUR/USD payments (converted to UAH)
         amount_calc = """CASE
@@ -122,17 +156,26 @@ def get_main_sql(
             ELSE p.amount
         END"""
     else:
-        # For EUR/USD: convert from UAH (amount field) or use original currency_amount
+        # For EUR/USD: convert from UAH (amount field) or use original currency_amount.
+        # Курс береться з щоденної таблиці (одна строка на валюту/день, forward-fill) простим join по даті;
+        # корельований підзапит лишається тільки як запасний варіант для днів, яких ще немає в таблиці
+        joins.append("""
+    LEFT JOIN spr_exchange_rates_daily er ON er.currency = :currency AND er.rdate = DATE(p.rdate)
+    """)
         amount_calc = f"""ROUND(
            CASE
                WHEN p.currency = :currency THEN p.currency_amount
                WHEN p.currency = 'UAH' AND :currency IN ('EUR', 'USD')
-               THEN p.amount / (
-                   SELECT COALESCE(MAX(e.saleRate), 1)
-                   FROM spr_exchange_rates e
-                   WHERE e.currency = :currency AND e.rdate <= p.rdate
-                   ORDER BY e.rdate DESC
-                   LIMIT 1
+               THEN p.amount / COALESCE(
+                   er.saleRate,
+                   (
+                       SELECT e.saleRate
+                       FROM spr_exchange_rates e
+                       WHERE e.currency = :currency AND e.rdate <= p.rdate
+                       ORDER BY e.rdate DESC
+                       LIMIT 1
+                   ),
+                   1
                )
                WHEN p.currency IN ('EUR', 'USD') AND :currency = 'UAH'
                THEN p.amount
@@ -140,24 +183,43 @@ def get_main_sql(
            END, 2)"""
 
     sql = f"""
-    {recursive_cte}
     SELECT p.id, p.rdate, p.category_id, p.mydesc,
            {amount_calc} AS amount,
-           p.mono_user_id, p.currency, p.currency_amount, p.source, p.user_id,
-           :currency AS display_currency
+           p.mono_user_id, p.currency, p.currency_amount, p.source, p.user_id, p.phone_label,
+           :currency AS display_currency{score}
     FROM `payments` p
     {' '.join(joins)}
     WHERE 1=1
-    AND `is_deleted` = 0
+    AND `is_deleted` = {1 if shape.deleted else 0}
     AND `currency_amount` > 0
-    AND p.mydesc NOT IN (SELECT value_data FROM config WHERE type_data = :type_data AND user_id = :user_id)
+    AND p.`excluded_from_stat` = 0
     {' '.join(condition)}
-    {' '.join(um)}
     """
 
     return sql
 
 
+def get_main_sql(data: dict) -> str:
+    """
+    Повертає текст основного запиту для параметрів data (нормалізує data in-place)
+    """
+    return build_main_sql(get_main_sql_shape(data))
+
+
+def main_sql_statement(builder: Callable[..., str]) -> Callable[..., TextClause]:
+    """
+    Декоратор для побудови запитів поверх основного SQL.
+    builder(shape, *args) повертає текст SQL; результат загортається в text()
+    та кешується за аргументами, тож SQLAlchemy повторно використовує скомпільовану форму
+    """
+    @lru_cache(maxsize=256)
+    @wraps(builder)
+    def wrapper(*args) -> TextClause:
+        return text(builder(*args)).bindparams(bindparam("member_ids", expanding=True))
+
+    return wrapper
+
+
 def get_current_end_date():
     curr_date = datetime.now()
     year = f'{curr_date:%Y}'
@@ -167,8 +229,14 @@ def get_current_end_date():
 
 
 def add_bulk_payments(data: list[dict]):
+    from api.payments.funcs import enrich_payments
+    from api.rollup.funcs import mark_rollup_buckets
+
     result = False
+    enrich_payments(data)
     try:
+        # bulk insert йде повз ORM, тому місяці для rollup позначаємо вручну
+        mark_rollup_buckets(db.session, ((row.get("user_id"), row.get("rdate")) for row in data))
         db.session.bulk_insert_mappings(Payment, data)
         db.session.commit()
         result = True
@@ -219,26 +287,10 @@ def add_payments_individually(data: list[dict]):
 
 
 def find_category(user: User, description: str) -> tuple[int, bool]:
-    category_id = None
-    is_deleted = False
-    user_config = user.config
-    for config_row in user_config:
-        if config_row.type_data not in (
-                ConfigTypes.IS_DELETED_BY_DESCRIPTION.value, ConfigTypes.CATEGORY_REPLACE.value):
-            continue
-        # set as deleted according to rules
-        if config_row.type_data == ConfigTypes.IS_DELETED_BY_DESCRIPTION.value:
-            if description == config_row.value_data:
-                is_deleted = 1
-        # for replace category according to rules
-        if config_row.type_data == ConfigTypes.CATEGORY_REPLACE.value:
-            if config_row.add_value and description.find(config_row.value_data.strip()) > -1:
-                try:
-                    category_id = int(config_row.add_value)
-                    break
-                except Exception as err:
-                    logging.warning(f'can not set category id for cat: {config_row.add_value=}, {err}')
+    # Правила користувача скомпільовані один раз (api.rules.funcs), без запитів на кожен платіж
+    rules = user_rules.get(db.session, user.id)
+    category_id, is_deleted = rules.find_category(description)
 
     if not category_id:
-        category_id = get_category_id(user.id, description)
+        category_id = rules.category_id(db.session, description)
     return category_id, is_deleted
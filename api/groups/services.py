@@ -1,5 +1,8 @@
 import logging
-from sqlalchemy import and_
+from dataclasses import dataclass
+
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import aliased
 from fastapi import HTTPException, status
 
 from models.models import Group, UserGroupAssociation
@@ -7,6 +10,40 @@ from fastapi_sqlalchemy import db
 
 logger = logging.getLogger()
 
+# Роль учасника, який керує платежами інших учасників групи (як і власник групи, groups.owner_id)
+GROUP_ADMIN_ROLE = "owner"
+
+
+def group_admin_clause(admin_user_id: int, target_user_id):
+    """
+    Умова EXISTS: admin_user_id є адміністратором (власник групи або роль GROUP_ADMIN_ROLE)
+    у групі, де є target_user_id. target_user_id - значення або колонка (Payment.user_id)
+    """
+    target = aliased(UserGroupAssociation)
+    admin = aliased(UserGroupAssociation)
+    return exists().where(
+        target.user_id == target_user_id,
+        admin.group_id == target.group_id,
+        admin.user_id == admin_user_id,
+        Group.id == target.group_id,
+        or_(admin.role == GROUP_ADMIN_ROLE, Group.owner_id == admin_user_id),
+    )
+
+
+def is_group_admin(user_id: int, group_id: int | None) -> bool:
+    """
+    Чи є user_id адміністратором групи group_id (власник групи або роль GROUP_ADMIN_ROLE)
+    """
+    if group_id is None:
+        return False
+    return bool(db.session.query(exists().where(
+        UserGroupAssociation.group_id == group_id,
+        UserGroupAssociation.user_id == user_id,
+        Group.id == UserGroupAssociation.group_id,
+        or_(UserGroupAssociation.role == GROUP_ADMIN_ROLE, Group.owner_id == user_id),
+    )).scalar())
+
+
 def check_user_in_group(target_user_id: int, admin_user_id: int) -> bool:
     """
     Перевіряє, чи є admin_user_id адміністратором у групі, в якій знаходиться target_user_id.
@@ -18,29 +55,49 @@ def check_user_in_group(target_user_id: int, admin_user_id: int) -> bool:
     Returns:
         bool: True, якщо admin_user_id є адміністратором групи, в якій є target_user_id
     """
-    # Знаходимо групи, в яких знаходиться цільовий користувач
-    target_user_groups = db.session.query(UserGroupAssociation).filter(
-        UserGroupAssociation.user_id == target_user_id
+    is_admin = db.session.query(group_admin_clause(admin_user_id, target_user_id)).scalar()
+    if not is_admin:
+        logger.info(f"Користувач {admin_user_id} не є адміністратором жодної групи користувача {target_user_id}")
+    return bool(is_admin)
+
+
+@dataclass(frozen=True)
+class GroupMembership:
+    """
+    Членство користувача в групі, визначене один раз на запит
+    """
+    user_id: int
+    group_id: int | None
+    member_ids: tuple[int, ...]
+
+    def as_params(self) -> dict:
+        """
+        Bound параметри для SQL запитів (member_ids - для IN :member_ids)
+        """
+        return {"group_id": self.group_id, "member_ids": list(self.member_ids)}
+
+
+def resolve_group_membership(user_id: int) -> GroupMembership:
+    """
+    Одним запитом знаходить групу користувача та всіх її учасників.
+    Якщо користувач не в групі, учасником вважається лише він сам
+    """
+    member = aliased(UserGroupAssociation)
+    rows = db.session.query(
+        UserGroupAssociation.group_id,
+        member.user_id,
+    ).join(
+        member, member.group_id == UserGroupAssociation.group_id
+    ).filter(
+        UserGroupAssociation.user_id == user_id
+    ).order_by(
+        UserGroupAssociation.id, member.user_id
     ).all()
-    
-    if not target_user_groups:
-        logger.info(f"Користувач {target_user_id} не належить до жодної групи")
-        return False
-    
-    # Для кожної групи перевіряємо, чи є admin_user_id адміністратором
-    for association in target_user_groups:
-        # Перевіряємо, чи є admin_user_id у цій групі та чи є він адміном
-        admin_association = db.session.query(UserGroupAssociation).filter(
-            and_(
-                UserGroupAssociation.group_id == association.group_id,
-                UserGroupAssociation.user_id == admin_user_id,
-                UserGroupAssociation.is_admin == True
-            )
-        ).first()
-        
-        if admin_association:
-            logger.info(f"Користувач {admin_user_id} є адміністратором групи {association.group_id}")
-            return True
-    
-    logger.info(f"Користувач {admin_user_id} не є адміністратором жодної групи користувача {target_user_id}")
-    return False
+
+    if not rows:
+        return GroupMembership(user_id=user_id, group_id=None, member_ids=(user_id,))
+
+    # Як і раніше, беремо першу групу користувача
+    group_id = rows[0].group_id
+    member_ids = tuple(row.user_id for row in rows if row.group_id == group_id)
+    return GroupMembership(user_id=user_id, group_id=group_id, member_ids=member_ids)
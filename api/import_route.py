@@ -4,7 +4,7 @@ from typing import Literal
 
 from fastapi import APIRouter, Depends, UploadFile, Form, HTTPException, status
 
-from api.services import bank_import
+from api.imports.services import get_import_job_, submit_import_job_
 from dependencies import get_current_user
 from models import User
 
@@ -12,7 +12,7 @@ router = APIRouter()
 logger = logging.getLogger()
 
 
-@router.post("/api/import", status_code=status.HTTP_200_OK)
+@router.post("/api/import", status_code=status.HTTP_202_ACCEPTED)
 async def import_bank_statement(
     file: UploadFile,
     mode: Literal["wise", "p24", "revolut", "pumb", "erste", "raiffeisen"] = Form(..., description="Тип банку: 'wise', 'p24', 'revolut', 'pumb', 'erste', 'raiffeisen'"),
@@ -20,7 +20,8 @@ async def import_bank_statement(
     current_user: User = Depends(get_current_user)
 ):
     """
-    Універсальний імпорт банківських виписок
+    Універсальний імпорт банківських виписок. Файл обробляється фоновою задачею,
+    відповідь - задача імпорту (id, status); прогрес і результат - GET /api/import/jobs/{id}
     
     Параметри:
         file: Файл з банківськими транзакціями
@@ -40,4 +41,15 @@ async def import_bank_statement(
             detail=f"Непідтримуваний тип банку: {mode}. Підтримуються: wise, p24, revolut, pumb, erste, raiffeisen"
         )
     
-    return await bank_import(current_user, mode, file, action)
+    return await submit_import_job_(current_user, mode, file, action)
+
+
+@router.get("/api/import/jobs/{job_id}")
+async def get_import_job(
+    job_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Стан задачі імпорту: статус, прогрес, кількість записаних і пропущених платежів, результат
+    """
+    return get_import_job_(current_user.id, job_id)
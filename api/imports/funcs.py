@@ -0,0 +1,206 @@
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any
+
+from fastapi import HTTPException
+from fastapi_sqlalchemy import db
+
+from api.core.funcs import ImportContext
+from api.funcs import add_bulk_payments
+from api.mono.funcs import add_new_payment
+from api.services import convert_statement, parse_statement
+from app.config import IMPORT_PARSE_WORKERS, IMPORT_SAVE_CHUNK_SIZE, IMPORT_WRITE_WORKERS
+from models.models import ImportJob, Payment, User
+from mydb import SessionLocal
+
+logger = logging.getLogger()
+
+# Статуси задачі імпорту; задачі в активних статусах після перезапуску процесу вже не завершаться
+JOB_ACTIVE_STATUSES = ("queued", "parsing", "converting", "saving")
+
+_parse_executor: ProcessPoolExecutor | None = None
+_write_executor: ThreadPoolExecutor | None = None
+# Посилання на запущені задачі, щоб їх не зібрав GC до завершення
+_running_jobs: set[asyncio.Task] = set()
+
+
+class ImportJobError(Exception):
+    """
+    Помилка даних виписки для користувача. На відміну від HTTPException
+    серіалізується pickle, тож передається з процесу парсингу
+    """
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def get_parse_executor() -> ProcessPoolExecutor:
+    global _parse_executor
+    if _parse_executor is None:
+        # spawn: дочірні процеси не успадковують з'єднання пулу БД і потоки процесу uvicorn
+        _parse_executor = ProcessPoolExecutor(IMPORT_PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _parse_executor
+
+
+def get_write_executor() -> ThreadPoolExecutor:
+    global _write_executor
+    if _write_executor is None:
+        _write_executor = ThreadPoolExecutor(IMPORT_WRITE_WORKERS, thread_name_prefix="import-write")
+    return _write_executor
+
+
+def shutdown_import_executors():
+    global _parse_executor, _write_executor
+    for task in list(_running_jobs):
+        task.cancel()
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+    if _write_executor is not None:
+        _write_executor.shutdown(wait=False, cancel_futures=True)
+    _parse_executor = _write_executor = None
+
+
+def parse_statement_job(bank: str, filename: str, file_content: bytes):
+    # Виконується в процесі пулу парсингу
+    try:
+        return parse_statement(bank, filename, file_content)
+    except HTTPException as err:
+        raise ImportJobError(err.detail) from None
+
+
+def update_import_job(job_id: int, **fields):
+    """
+    Записує стан задачі окремою короткою транзакцією - прогрес видно одразу, незалежно від запису платежів
+    """
+    session = SessionLocal()
+    try:
+        session.query(ImportJob).filter(ImportJob.id == job_id).update(
+            {**fields, "updated": _now()}, synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def fail_interrupted_import_jobs() -> int:
+    """
+    Позначає як failed задачі, перервані перезапуском (lifespan)
+    """
+    session = SessionLocal()
+    try:
+        count = session.query(ImportJob).filter(ImportJob.status.in_(JOB_ACTIVE_STATUSES)).update(
+            {"status": "failed", "error": "Імпорт перервано перезапуском сервера", "finished": _now()},
+            synchronize_session=False,
+        )
+        session.commit()
+        return count
+    finally:
+        session.close()
+
+
+def save_payments(job_id: int, data: list[dict[str, Any]]) -> dict[str, int]:
+    """
+    Записує платежі частинами по IMPORT_SAVE_CHUNK_SIZE (commit і прогрес на кожну частину).
+    Уже імпортовані bank_payment_id пропускаються; кожен рядок отримує ознаку sql, як і раніше
+    """
+    counts = {"created_rows": 0, "duplicate_rows": 0, "error_rows": 0}
+    seen = set()
+    for start in range(0, len(data), IMPORT_SAVE_CHUNK_SIZE):
+        chunk = data[start:start + IMPORT_SAVE_CHUNK_SIZE]
+        bank_payment_ids = [row["bank_payment_id"] for row in chunk if row.get("bank_payment_id")]
+        existing = {
+            bank_payment_id for (bank_payment_id,) in db.session.query(Payment.bank_payment_id).filter(
+                Payment.bank_payment_id.in_(bank_payment_ids)
+            )
+        } if bank_payment_ids else set()
+
+        new_rows = []
+        for row in chunk:
+            bank_payment_id = row.get("bank_payment_id")
+            if bank_payment_id and (bank_payment_id in existing or bank_payment_id in seen):
+                row["sql"] = False
+                counts["duplicate_rows"] += 1
+                continue
+            if bank_payment_id:
+                seen.add(bank_payment_id)
+            new_rows.append(row)
+
+        if new_rows and add_bulk_payments(new_rows):
+            for row in new_rows:
+                row["sql"] = True
+            counts["created_rows"] += len(new_rows)
+        else:
+            for row in new_rows:
+                try:
+                    add_new_payment(row)
+                    row["sql"] = True
+                    counts["created_rows"] += 1
+                except Exception as err:
+                    logger.error(f"Import job {job_id}: payment not saved: {err}")
+                    row["sql"] = False
+                    counts["error_rows"] += 1
+
+        update_import_job(job_id, processed_rows=start + len(chunk), **counts)
+    return counts
+
+
+def save_import_job(job_id: int, parsed):
+    """
+    Конвертація (категорії, курси) і запис платежів - у потоці пулу запису з власною сесією db
+    """
+    with db():
+        job = db.session.get(ImportJob, job_id)
+        bank, action = job.bank, job.action
+        context = ImportContext.create(db.session.get(User, job.user_id))
+
+        update_import_job(job_id, status="converting")
+        data = convert_statement(context, bank, parsed)
+        if not data:
+            raise ImportJobError("Невалідні дані у файлі")
+
+        counts = {}
+        if action == "import":
+            update_import_job(job_id, status="saving", total_rows=len(data))
+            counts = save_payments(job_id, data)
+
+        update_import_job(
+            job_id, status="done", total_rows=len(data), processed_rows=len(data), finished=_now(),
+            result=json.dumps(data, default=str, ensure_ascii=False), **counts,
+        )
+
+
+async def run_import_job(job_id: int, bank: str, filename: str, file_content: bytes):
+    """
+    Парсинг у пулі процесів, конвертація та запис у пулі потоків - event loop не блокується
+    """
+    loop = asyncio.get_running_loop()
+    write_executor = get_write_executor()
+    try:
+        await loop.run_in_executor(write_executor, partial(update_import_job, job_id, status="parsing", started=_now()))
+        parsed = await loop.run_in_executor(get_parse_executor(), parse_statement_job, bank, filename, file_content)
+        await loop.run_in_executor(write_executor, save_import_job, job_id, parsed)
+    except asyncio.CancelledError:
+        raise
+    except Exception as err:
+        if isinstance(err, ImportJobError):
+            logger.warning(f"Import job {job_id} ({bank}, {filename}) rejected: {err}")
+            detail = str(err)
+        else:
+            logger.error(f"Import job {job_id} ({bank}, {filename}) failed: {err}", exc_info=True)
+            detail = f"Помилка при імпорті файлу: {err}"
+        await loop.run_in_executor(
+            write_executor, partial(update_import_job, job_id, status="failed", error=detail, finished=_now())
+        )
+
+
+def start_import_job(job_id: int, bank: str, filename: str, file_content: bytes) -> asyncio.Task:
+    task = asyncio.create_task(run_import_job(job_id, bank, filename, file_content))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return task
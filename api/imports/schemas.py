@@ -0,0 +1,32 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field, field_validator
+
+
+class ImportJobResponse(BaseModel):
+    id: int
+    bank: str
+    filename: Optional[str] = None
+    action: str
+    status: str = Field(..., description="queued | parsing | converting | saving | done | failed")
+    total_rows: int = Field(0, description="Кількість платежів у виписці (відома після конвертації)")
+    processed_rows: int = Field(0, description="Скільки з них уже оброблено")
+    created_rows: int = 0
+    duplicate_rows: int = 0
+    error_rows: int = 0
+    error: Optional[str] = None
+    result: Optional[List[Dict[str, Any]]] = Field(None, description="Платежі з ознакою sql (після завершення)")
+    created: Optional[datetime] = None
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+
+    model_config = {
+        "from_attributes": True
+    }
+
+    @field_validator("result", mode="before")
+    @classmethod
+    def parse_result(cls, value):
+        return json.loads(value) if isinstance(value, str) else value
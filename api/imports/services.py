@@ -0,0 +1,46 @@
+import logging
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi_sqlalchemy import db
+
+from api.imports.funcs import _now, start_import_job
+from api.imports.schemas import ImportJobResponse
+from models.models import ImportJob, User
+
+logger = logging.getLogger()
+
+
+async def submit_import_job_(user: User, bank: str, file: UploadFile, action: str = "import") -> dict:
+    """
+    Створює задачу імпорту виписки і запускає її у фоні. Результат - через get_import_job_
+
+    Параметри:
+        user: Користувач
+        bank: Назва банку ("wise", "revolut", "p24", "pumb", "erste", "raiffeisen")
+        file: Завантажений файл через FastAPI UploadFile
+        action: Дія - "show" для попереднього перегляду або "import" для імпорту даних
+    """
+    if not file:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Файл не знайдено в запиті')
+
+    if file.filename == '':
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Не вказано імя файлу')
+
+    file_content = await file.read()
+    job = ImportJob(
+        user_id=user.id, bank=bank, filename=file.filename, action=action, status="queued",
+        created=_now(),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    start_import_job(job.id, bank, file.filename, file_content)
+    logger.info(f"Import job {job.id} queued: {bank}, {file.filename}, {len(file_content)} bytes")
+    return ImportJobResponse.model_validate(job).model_dump(exclude={"result"})
+
+
+def get_import_job_(user_id: int, job_id: int) -> dict:
+    job = db.session.query(ImportJob).filter(ImportJob.id == job_id, ImportJob.user_id == user_id).one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail='Not found import job')
+    return ImportJobResponse.model_validate(job).model_dump()
@@ -6,12 +6,11 @@ import time
 
 import requests
 from fastapi import HTTPException
-from sqlalchemy import and_
 
 from app.config import MONO_API_URL, BASE_URL
-from api.config.schemas import ConfigTypes
 from api.mono.services import get_mono_users_
-from models.models import Category, Config, MonoUser, Payment, User
+from api.rules.funcs import user_rules
+from models.models import Config, MonoUser, Payment, User
 from fastapi_sqlalchemy import db
 
 mono_logger = logging.getLogger('mono')
@@ -150,26 +149,13 @@ def convert_dates(start_date: str = None, end_date: str = None):
 def set_category(
         user_id: int, mono_user: MonoUser, mcc: int, description: str
 ):
-    is_deleted = 0
-    category_id = None
     category_name = _mcc(mcc)
-    user_config = mono_user.user.config
-    for config_row in user_config:
-        # set as deleted according to rules
-        if config_row.type_data == ConfigTypes.IS_DELETED_BY_DESCRIPTION.value:
-            if description.find(config_row.value_data) > -1:
-                is_deleted = 1
-        # for replace category according to rules
-        if config_row.type_data == ConfigTypes.CATEGORY_REPLACE.value:
-            if config_row.add_value and description.find(config_row.value_data) > -1:
-                try:
-                    category_id, description = int(config_row.add_value), category_name
-                    break
-                except Exception as err:
-                    mono_logger.warning(f'can not set category id for cat: {config_row.add_value=}, {err}')
+    # Правила видалення та заміни категорії за описом - скомпільовані для власника моно користувача
+    rules = user_rules.get(db.session, mono_user.user_id)
+    category_id, is_deleted = rules.mono_category(description)
 
     if not category_id:
-        category_id = get_category_id(user_id, category_name)
+        category_id = rules.category_id(db.session, category_name)
     return category_id, category_name, is_deleted
 
 
@@ -384,26 +370,15 @@ def get_mono_user(mono_user_id: int) -> MonoUser | None:
 
 
 def get_category_id(user_id: int, category_name: str) -> int:
-    category = db.session.query(Category).filter(
-        and_(
-            Category.name.like(f'%{category_name}%'), Category.user_id == user_id, Category.parent_id == 0, )
-    ).one_or_none()
-
-    if category:
-        category_id = category.id
-    else:
-        # new_category = Category()
-        # data = {"name": category_name, "parent_id": 0, "user_id": user_id}
-        # new_category.from_dict(**data)
-        # db.session.add(new_category)
-        # db.session.commit()
-        # category_id = new_category.id
-        category_id = 17  # Інші #TODO: need to do another something
-    return category_id
+    # Коренева категорія з назвою, що містить category_name, з кешу правил користувача (інакше "Інші")
+    return user_rules.get(db.session, user_id).category_id(db.session, category_name)
 
 
 def add_new_payment(data) -> Payment:
+    from api.payments.funcs import enrich_payments
+
     result = None
+    enrich_payments([data])
     try:
         new_payment = Payment(**data)
         db.session.add(new_payment)
@@ -417,12 +392,15 @@ def add_new_payment(data) -> Payment:
 
 
 def sync_payment(data: dict) -> dict:
+    from api.payments.funcs import enrich_payments
+
     result = None
     try:
         payment = db.session.query(Payment).filter(
             Payment.bank_payment_id == data['bank_payment_id']
         ).one_or_none()
         if payment:
+            enrich_payments([data])
             payment.update(**data)
         else:
             result = add_new_payment(data)
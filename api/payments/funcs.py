@@ -1,13 +1,69 @@
+import base64
+import binascii
 import hashlib
+import json
 import re
 from datetime import datetime
 from pandas import Timestamp
 
-from sqlalchemy import and_
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import Session
 
 from api.config.schemas import ConfigTypes
 from fastapi_sqlalchemy import db
-from models import Config
+from api.groups.services import group_admin_clause
+from api.rollup.funcs import mark_rollup_payments
+from models import Config, Payment
+
+
+# Дозволені сортування для списку платежів (тільки ті, що мають індекс або дешеві)
+PAYMENTS_SORT_COLUMNS = {
+    "rdate": "p.`rdate`",
+    "amount": "ROUND(p.`amount`, 2)",
+    "id": "p.`id`",
+}
+PAYMENTS_DEFAULT_SORT = "-amount"
+# Сортування результатів повнотекстового пошуку (score рахується тільки для форми з has_search)
+PAYMENTS_RELEVANCE_SORT = "p.`score`"
+
+
+def parse_payments_sort(sort: str | None) -> tuple[str, bool]:
+    """
+    Перетворює параметр сортування ('amount', '-rdate', ...) у (колонка, desc)
+    """
+    sort = sort or PAYMENTS_DEFAULT_SORT
+    is_desc = sort.startswith("-")
+    column = sort.lstrip("-+")
+    if column not in PAYMENTS_SORT_COLUMNS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Непідтримуване сортування: {sort}. Дозволено: {', '.join(PAYMENTS_SORT_COLUMNS)}"
+        )
+    return column, is_desc
+
+
+def encode_cursor(value, row_id: int) -> str:
+    """
+    Кодує позицію останнього рядка сторінки у непрозорий курсор.
+    Float зберігається як є (json відтворює його точно), округлення - справа викликача
+    """
+    if isinstance(value, (datetime, Timestamp)):
+        value = f"{value:%Y-%m-%d %H:%M:%S}"
+    raw = json.dumps({"v": value, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Розкодовує курсор у (значення сортування, id)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return data["v"], int(data["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Невалідний курсор")
 
 
 def create_bank_payment_id(data):
@@ -50,6 +106,22 @@ def conv_refuel_data_to_desc(data: dict) -> str:
     return result
 
 
+PHONE_PATTERN = re.compile(r"(\+38)?0\d{9}")
+
+
+def normalize_phone(value: str | None) -> str | None:
+    """
+    Повертає перший номер телефону з рядка у форматі +380XXXXXXXXX або None
+    """
+    if not value:
+        return None
+    match = PHONE_PATTERN.search(value)
+    if not match:
+        return None
+    phone = match.group(0)
+    return phone if phone.startswith("+38") else f"+38{phone}"
+
+
 def get_user_phones_from_config(user_id: int) -> dict:
     user_phones = {}
     user_config = db.session.query(
@@ -62,10 +134,110 @@ def get_user_phones_from_config(user_id: int) -> dict:
         )
     ).all()
     for config in user_config:
-        user_phones[config.value_data] = config.add_value
+        if phone := normalize_phone(config.value_data):
+            user_phones[phone] = config.add_value
     return user_phones
 
 
+def set_payments_phone(rows: list[dict]) -> list[dict]:
+    """
+    Заповнює phone (номер з опису) та phone_label (ім'я з PHONE_TO_NAME власника платежу) in-place.
+    Конфіг телефонів читається тільки для рядків з номером і один раз на користувача
+    """
+    phones_by_user = {}
+    for row in rows:
+        row["phone"] = normalize_phone(row.get("mydesc"))
+        row["phone_label"] = None
+        if row["phone"]:
+            user_id = row.get("user_id")
+            if user_id not in phones_by_user:
+                phones_by_user[user_id] = get_user_phones_from_config(user_id)
+            row["phone_label"] = phones_by_user[user_id].get(row["phone"])
+    return rows
+
+
+def update_payments_phone_label(user_id: int, phone_value: str, label: str | None) -> int:
+    """
+    Переписує phone_label тільки в платежах користувача з цим номером (після зміни правила PHONE_TO_NAME).
+    Commit робить викликач
+    """
+    phone = normalize_phone(phone_value)
+    if not phone:
+        return 0
+    return db.session.query(Payment).filter(
+        Payment.user_id == user_id,
+        Payment.phone == phone,
+    ).update({Payment.phone_label: label}, synchronize_session=False)
+
+
+def get_user_excluded_from_stat(user_id: int) -> set:
+    rows = db.session.query(Config.value_data).filter(
+        Config.user_id == user_id,
+        Config.type_data == ConfigTypes.EXCLUDE_FROM_STAT.value,
+    ).all()
+    return {row.value_data for row in rows}
+
+
+def set_payments_excluded_from_stat(rows: list[dict]) -> list[dict]:
+    """
+    Заповнює excluded_from_stat in-place: опис збігається з правилом EXCLUDE_FROM_STAT власника платежу
+    """
+    excluded_by_user = {}
+    for row in rows:
+        user_id = row.get("user_id")
+        if user_id not in excluded_by_user:
+            excluded_by_user[user_id] = get_user_excluded_from_stat(user_id)
+        row["excluded_from_stat"] = row.get("mydesc") in excluded_by_user[user_id]
+    return rows
+
+
+def enrich_payments(rows: list[dict]) -> list[dict]:
+    """
+    Поля платежу, що залежать від опису та правил користувача, рахуються один раз при записі
+    """
+    set_payments_phone(rows)
+    set_payments_excluded_from_stat(rows)
+    return rows
+
+
+def update_payments_excluded_from_stat(user_id: int, mydesc: str, excluded: bool) -> int:
+    """
+    Перемикає excluded_from_stat тільки в платежах користувача з цим описом (після зміни правила).
+    Commit робить викликач
+    """
+    mark_rollup_payments(db.session, Payment.user_id == user_id, Payment.mydesc == mydesc)
+    return db.session.query(Payment).filter(
+        Payment.user_id == user_id,
+        Payment.mydesc == mydesc,
+    ).update({Payment.excluded_from_stat: excluded}, synchronize_session=False)
+
+
+REFLAG_EXCLUDED_FROM_STAT_SQL = """
+UPDATE payments
+SET excluded_from_stat = EXISTS (
+    SELECT 1 FROM config c
+    WHERE c.user_id = payments.user_id
+    AND c.type_data = :type_data
+    AND c.value_data = payments.mydesc
+)
+"""
+
+
+def reflag_excluded_from_stat(user_id: int | None = None, session: Session | None = None) -> int:
+    """
+    Перераховує excluded_from_stat одним UPDATE (для всіх або для одного користувача).
+    Commit робить викликач
+    """
+    session = session or db.session
+    sql = REFLAG_EXCLUDED_FROM_STAT_SQL
+    data = {"type_data": ConfigTypes.EXCLUDE_FROM_STAT.value}
+    if user_id is not None:
+        sql += " WHERE user_id = :user_id"
+        data["user_id"] = user_id
+    mark_rollup_payments(session, *([Payment.user_id == user_id] if user_id is not None else []))
+    return session.execute(text(sql), data).rowcount
+
+
 def get_dates(month, year):
     current_date = datetime.now()
     if not year:
@@ -88,3 +260,16 @@ def get_dates(month, year):
     start_date = f"{year}-{month_int:02d}-01"
     end_date = f"{year_int if month_int < 12 else year_int + 1}-{month_int + 1 if month_int < 12 else 1:02d}-01"
     return current_date, end_date, start_date
+
+
+def get_allowed_payments(user_id: int, payment_ids: list[int]) -> list:
+    """
+    Платежі зі списку, які user_id може змінювати: власні та учасників груп, де він адміністратор.
+    Один запит на весь список; повертає (id, user_id, rdate)
+    """
+    if not payment_ids:
+        return []
+    return db.session.query(Payment.id, Payment.user_id, Payment.rdate).filter(
+        Payment.id.in_(payment_ids),
+        or_(Payment.user_id == user_id, group_admin_clause(user_id, Payment.user_id)),
+    ).all()
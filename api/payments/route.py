@@ -1,19 +1,29 @@
 # _*_ coding:UTF-8 _*_
 
 from fastapi import APIRouter, Depends, Body, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional
 
-from api.payments.schemas import PaymentCreate, PaymentUpdate, PaymentCategoryUpdate, PaymentBulkDelete
+from api.payments.schemas import (
+    PaymentCreate, PaymentUpdate, PaymentCategoryUpdate, PaymentBulkCreate, PaymentBulkDelete,
+    PaymentFilter, PaymentFilterCategoryUpdate,
+)
 from api.payments.services import (
     add_payment_,
+    add_payments_bulk_,
     del_payment_,
     upd_payment_,
     get_payment_detail,
     get_payments_detail,
+    get_payments_page,
+    stream_payments_detail,
+    search_payments,
     change_payments_category_,
-    bulk_delete_payments_
+    bulk_delete_payments_,
+    update_payments_by_filter_,
 )
-from dependencies import get_current_user
+from api.groups.services import GroupMembership
+from dependencies import get_current_user, get_group_membership, payments_etag
 from models.models import User
 
 router = APIRouter(tags=["payments"])
@@ -29,7 +39,19 @@ async def add_payment(
     return add_payment_(current_user.id, payment_data=payment)
 
 
-@router.get("/api/payments")
+@router.post("/api/payments/bulk")
+async def add_payments_bulk(
+    bulk_data: PaymentBulkCreate = Body(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Додавання багатьох платежів однією транзакцією.
+    Повертає результат по кожному платежу (created|duplicate|error)
+    """
+    return add_payments_bulk_(current_user.id, payments=bulk_data.payments)
+
+
+@router.get("/api/payments", dependencies=[Depends(payments_etag)])
 async def get_payments(
     year: Optional[str] = Query(None, description="Рік для фільтрації"),
     month: Optional[str] = Query(None, description="Місяць для фільтрації"),
@@ -38,12 +60,17 @@ async def get_payments(
     currency: Optional[str] = Query("UAH", description="Валюта для відображення сум"),
     group_user_id: Optional[str] = Query(None, description="ID користувача групи"),
     source: Optional[str] = Query(None, description="Джерело платежу для фільтрації (mono|pryvat|webapp|revolut|wise)"),
-    current_user: User = Depends(get_current_user)
+    sort: Optional[str] = Query(None, description="Сортування: rdate|amount|id, з '-' для спадання (за замовчуванням -amount)"),
+    after: Optional[str] = Query(None, description="Курсор наступної сторінки (next_cursor з попередньої відповіді)"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Розмір сторінки. Якщо вказано, відповідь має вигляд {items, next_cursor}"),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
 ):
     """
     Отримання списку платежів з можливістю фільтрації.
     Якщо не вказано рік і місяць, повертаються платежі за поточний місяць.
     Якщо вказано q, виконується пошук.
+    Якщо вказано limit, повертається сторінка з курсором на наступну.
     """
     # Передаємо всі параметри запиту до сервісу
     params = {
@@ -53,9 +80,74 @@ async def get_payments(
         "category_id": category_id,
         "currency": currency,
         "group_user_id": group_user_id,
-        "source": source
+        "source": source,
+        "sort": sort,
+        "after": after,
+        "limit": limit,
+    }
+    if limit:
+        return get_payments_page(current_user.id, params=params, membership=membership)
+    return get_payments_detail(current_user.id, params=params, membership=membership)
+
+
+@router.get("/api/payments/stream")
+async def stream_payments(
+    year: Optional[str] = Query(None, description="Рік для фільтрації"),
+    month: Optional[str] = Query(None, description="Місяць для фільтрації"),
+    q: Optional[str] = Query(None, description="Пошуковий запит"),
+    category_id: Optional[str] = Query(None, description="ID категорії для фільтрації. Спеціальне значення '_' для останніх платежів"),
+    currency: Optional[str] = Query("UAH", description="Валюта для відображення сум"),
+    group_user_id: Optional[str] = Query(None, description="ID користувача групи"),
+    source: Optional[str] = Query(None, description="Джерело платежу для фільтрації (mono|pryvat|webapp|revolut|wise)"),
+    sort: Optional[str] = Query(None, description="Сортування: rdate|amount|id, з '-' для спадання (за замовчуванням -amount)"),
+    after: Optional[str] = Query(None, description="Курсор, після якого починати стрім"),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
+):
+    """
+    Потоковий список платежів у форматі NDJSON (один JSON об'єкт на рядок)
+    """
+    params = {
+        "year": year,
+        "month": month,
+        "q": q,
+        "category_id": category_id,
+        "currency": currency,
+        "group_user_id": group_user_id,
+        "source": source,
+        "sort": sort,
+        "after": after,
+    }
+    return StreamingResponse(
+        stream_payments_detail(current_user.id, params=params, membership=membership),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.get("/api/payments/search")
+async def search_payments_route(
+    q: str = Query(..., min_length=2, description="Пошуковий запит (мінімум 2 символи)"),
+    currency: Optional[str] = Query("UAH", description="Валюта для відображення сум"),
+    group_user_id: Optional[str] = Query(None, description="ID користувача групи"),
+    source: Optional[str] = Query(None, description="Джерело платежу для фільтрації (mono|pryvat|webapp|revolut|wise)"),
+    after: Optional[str] = Query(None, description="Курсор наступної сторінки (next_cursor з попередньої відповіді)"),
+    limit: int = Query(50, ge=1, le=500, description="Розмір сторінки"),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
+):
+    """
+    Повнотекстовий пошук платежів по опису за всі роки, впорядкований за релевантністю.
+    Відповідь має вигляд {items, next_cursor}
+    """
+    params = {
+        "q": q,
+        "currency": currency,
+        "group_user_id": group_user_id,
+        "source": source,
+        "after": after,
+        "limit": limit,
     }
-    return get_payments_detail(current_user.id, params=params)
+    return search_payments(current_user.id, params=params, membership=membership)
 
 
 @router.get("/api/payments/{payment_id}")
@@ -119,3 +211,50 @@ async def bulk_delete_payments(
         user_id=current_user.id,
         payment_ids=delete_data.payment_ids
     )
+
+
+def _filter_params(payment_filter: PaymentFilter) -> dict:
+    return payment_filter.model_dump(exclude={"preview", "new_category_id"}, exclude_none=True)
+
+
+@router.post("/api/payments/filter/change-category")
+async def change_payments_category_by_filter(
+    update_data: PaymentFilterCategoryUpdate = Body(...),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
+):
+    """
+    Масова зміна категорії всіх платежів за фільтрами списку (preview - лише кількість)
+    """
+    return update_payments_by_filter_(
+        current_user.id, "change_category", _filter_params(update_data), membership,
+        new_category_id=update_data.new_category_id, preview=update_data.preview,
+    )
+
+
+@router.post("/api/payments/filter/delete")
+async def delete_payments_by_filter(
+    payment_filter: PaymentFilter = Body(...),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
+):
+    """
+    Масове видалення платежів за фільтрами списку (preview - лише кількість)
+    """
+    return update_payments_by_filter_(
+        current_user.id, "delete", _filter_params(payment_filter), membership, preview=payment_filter.preview
+    )
+
+
+@router.post("/api/payments/filter/restore")
+async def restore_payments_by_filter(
+    payment_filter: PaymentFilter = Body(...),
+    current_user: User = Depends(get_current_user),
+    membership: GroupMembership = Depends(get_group_membership)
+):
+    """
+    Відновлення видалених платежів за фільтрами списку (preview - лише кількість)
+    """
+    return update_payments_by_filter_(
+        current_user.id, "restore", _filter_params(payment_filter), membership, preview=payment_filter.preview
+    )
@@ -45,6 +45,9 @@ class PaymentUpdate(PaymentBase):
         "extra": "ignore"  # Ігнорувати додаткові поля, які не повинні оновлюватися
     }
 
+class PaymentBulkCreate(BaseModel):
+    payments: List[PaymentCreate] = Field(..., min_length=1, max_length=1000, description="Платежі для створення")
+
 class PaymentCategoryUpdate(BaseModel):
     payment_ids: List[int] = Field(..., description="Список ID платежів")
     category_id: int = Field(..., description="ID нової категорії")
@@ -52,6 +55,18 @@ class PaymentCategoryUpdate(BaseModel):
 class PaymentBulkDelete(BaseModel):
     payment_ids: List[int] = Field(..., description="Список ID платежів для видалення")
 
+class PaymentFilter(BaseModel):
+    year: Optional[str] = Field(None, description="Рік. Без month - весь рік")
+    month: Optional[str] = Field(None, description="Місяць")
+    q: Optional[str] = Field(None, description="Пошуковий запит")
+    category_id: Optional[str] = Field(None, description="ID категорії (з підкатегоріями)")
+    source: Optional[str] = Field(None, description="Джерело платежу")
+    group_user_id: Optional[int] = Field(None, description="ID користувача групи")
+    preview: bool = Field(False, description="Лише порахувати платежі, без змін")
+
+class PaymentFilterCategoryUpdate(PaymentFilter):
+    new_category_id: int = Field(..., description="ID нової категорії")
+
 
 # Модель для відповіді з платежами
 class PaymentResponse(PaymentBase):
@@ -68,6 +83,19 @@ class OperationResult(BaseModel):
     status: str = "ok"
     detail: Optional[str] = None
 
+class PaymentBulkItemResult(BaseModel):
+    index: int = Field(..., description="Позиція платежу в запиті")
+    status: str = Field(..., description="created|duplicate|error")
+    id: Optional[int] = None
+    bank_payment_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class PaymentBulkCreateResult(OperationResult):
+    created: int = 0
+    duplicates: int = 0
+    errors: int = 0
+    items: List[PaymentBulkItemResult] = []
+
 class BulkOperationResult(OperationResult):
     count: int = 0
     
@@ -75,3 +103,6 @@ class BulkOperationResult(OperationResult):
     def success(cls, count: int, operation: str = "") -> dict:
         detail = f"{operation} {count} записів" if operation else None
         return cls(status="ok", count=count, detail=detail).model_dump()
+
+class BulkFilterOperationResult(BulkOperationResult):
+    preview: bool = False
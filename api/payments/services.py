@@ -1,20 +1,27 @@
 import datetime
+import json
 import logging
-import re
+from typing import Iterator
 
 from fastapi import HTTPException, status
-from sqlalchemy import select
-from api.payments.schemas import PaymentBase, PaymentCreate, PaymentUpdate, PaymentResponse, OperationResult, BulkOperationResult
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import TextClause, insert, select
+from api.payments.schemas import (
+    PaymentBase, PaymentCreate, PaymentUpdate, PaymentResponse, OperationResult, BulkOperationResult,
+    PaymentBulkCreateResult, PaymentBulkItemResult, BulkFilterOperationResult,
+)
 
-from api.funcs import get_last_rate, get_main_sql
+from api.cache.funcs import cached_aggregate
+from api.funcs import MainSqlShape, build_main_sql, get_last_rate, get_last_rates, get_main_sql_shape, main_sql_statement
 from api.payments.funcs import (
-    conv_refuel_data_to_desc, convert_desc_to_refuel_data, create_bank_payment_id, get_dates,
-    get_user_phones_from_config
+    PAYMENTS_RELEVANCE_SORT, PAYMENTS_SORT_COLUMNS, conv_refuel_data_to_desc, convert_desc_to_refuel_data, create_bank_payment_id,
+    decode_cursor, encode_cursor, enrich_payments, get_allowed_payments, get_dates, parse_payments_sort
 )
-from api.groups.services import check_user_in_group
+from api.groups.services import GroupMembership, is_group_admin, resolve_group_membership
+from api.rollup.funcs import mark_rollup_buckets
 from models.models import Payment
 from fastapi_sqlalchemy import db
-from utility_helpers import do_sql_sel
+from utility_helpers import do_sql_sel, do_sql_stream
 
 logger = logging.getLogger()
 
@@ -39,6 +46,9 @@ def add_payment_(user_id: int, payment_data: PaymentCreate):
     # Створюємо унікальний ID платежу
     payment_dict["bank_payment_id"] = create_bank_payment_id(payment_dict)
 
+    # Номер телефону, ім'я з PHONE_TO_NAME та виключення зі статистики визначаємо при записі, а не при кожному читанні
+    enrich_payments([payment_dict])
+
     # Розраховуємо суму в UAH, якщо валюта інша - працюємо зі словником
     currency = payment_dict.get("currency")
     currency_amount = payment_dict.get("currency_amount")
@@ -50,20 +60,11 @@ def add_payment_(user_id: int, payment_data: PaymentCreate):
         logger.info(f"[ADD PAYMENT] Entering currency conversion for {currency}")
         rate = get_last_rate(currency, rdate)
         logger.info(f"[ADD PAYMENT] Exchange rate retrieved: {rate}")
-
-        # Одразу записуємо в словник
-        payment_dict["amount"] = float(currency_amount) * rate
-        payment_dict["amount_original"] = currency_amount
-        payment_dict["currency_original"] = currency
-        payment_dict["exchange_rate"] = rate
+        _apply_exchange_rate(payment_dict, rate)
         logger.info(f"[ADD PAYMENT] Calculated: {currency_amount} * {rate} = {payment_dict['amount']}, tracking fields set")
     else:
         logger.info(f"[ADD PAYMENT] No conversion needed (UAH or no currency_amount)")
-        # Одразу записуємо в словник
-        payment_dict["amount"] = currency_amount
-        payment_dict["amount_original"] = currency_amount
-        payment_dict["currency_original"] = 'UAH'
-        payment_dict["exchange_rate"] = 1.0
+        _apply_exchange_rate(payment_dict, None)
         logger.info(f"[ADD PAYMENT] Set default values: amount={payment_dict['amount']}, exchange_rate=1.0")
 
     logger.info(f"[ADD PAYMENT] Payment data dict: {payment_dict}")
@@ -93,31 +94,179 @@ def add_payment_(user_id: int, payment_data: PaymentCreate):
     return PaymentResponse.model_validate(payment).model_dump()
 
 
-def get_payments_detail(user_id: int, params: dict) -> list[dict]:
+def _apply_exchange_rate(payment_dict: dict, rate: float | None):
     """
-    list or search all payments.
-    if not set conditions year and month then get current year and month
-    if set q then do search
+    Сума в UAH та поля оригінальної валюти. rate=None - платіж в UAH (або без суми)
+    """
+    currency_amount = payment_dict.get("currency_amount")
+    if rate is None:
+        payment_dict["amount"] = currency_amount
+        payment_dict["amount_original"] = currency_amount
+        payment_dict["currency_original"] = 'UAH'
+        payment_dict["exchange_rate"] = 1.0
+    else:
+        payment_dict["amount"] = float(currency_amount) * rate
+        payment_dict["amount_original"] = currency_amount
+        payment_dict["currency_original"] = payment_dict.get("currency")
+        payment_dict["exchange_rate"] = rate
+
+
+def _bulk_payment_dict(user_id: int, payment_data: PaymentCreate) -> dict:
+    """
+    Словник платежу як в add_payment_: опис заправки, bank_payment_id
+    """
+    payment_dict = payment_data.model_dump(exclude_unset=True)
+    payment_dict["user_id"] = user_id
+    # Валюта за замовчуванням зі схеми, інакше NULL currency рахувався б як не-UAH
+    payment_dict.setdefault("currency", payment_data.currency)
+    refuel_data = payment_dict.pop("refuel_data", None)
+    if refuel_data and refuel_data.get("km"):
+        if result := conv_refuel_data_to_desc(refuel_data):
+            payment_dict["mydesc"] = result
+    payment_dict["bank_payment_id"] = create_bank_payment_id(payment_dict)
+    return payment_dict
+
+
+def _payment_insert_row(payment_dict: dict) -> dict:
+    """
+    Рядок для multi-row INSERT: всі колонки payments (однаковий набір у кожному рядку),
+    відсутні значення - з default колонок моделі, як при записі через ORM
+    """
+    row = {}
+    for column in Payment.__table__.columns:
+        if column.primary_key:
+            continue
+        if column.key in payment_dict:
+            row[column.key] = payment_dict[column.key]
+        elif column.default is None:
+            row[column.key] = None
+        elif column.default.is_callable:
+            row[column.key] = column.default.arg(None)
+        else:
+            row[column.key] = column.default.arg
+    return row
+
+
+def add_payments_bulk_(user_id: int, payments: list[PaymentCreate]) -> dict:
+    """
+    Створює багато платежів в одній транзакції: курси для всіх пар (валюта, дата) одним запитом,
+    дублікати (за bank_payment_id) одним запитом, вставка одним multi-row INSERT.
+    Повертає результат по кожному платежу: created, duplicate або error
     """
+    results = [PaymentBulkItemResult(index=index, status="error") for index in range(len(payments))]
+    rows = {}
+    for index, payment_data in enumerate(payments):
+        if payment_data.rdate is None:
+            results[index].detail = "rdate is required"
+            continue
+        rows[index] = _bulk_payment_dict(user_id, payment_data)
+
+    rates = get_last_rates(
+        (row["currency"], row["rdate"]) for row in rows.values()
+        if row.get("currency", "UAH") != 'UAH' and row.get("currency_amount")
+    )
+    for index, row in list(rows.items()):
+        if row.get("currency", "UAH") == 'UAH' or not row.get("currency_amount"):
+            _apply_exchange_rate(row, None)
+        elif (rate := rates.get((row["currency"], row["rdate"]))) is not None:
+            _apply_exchange_rate(row, rate)
+        else:
+            results[index].detail = f"not found rates for {row['currency']}"
+            del rows[index]
+
+    # Дублікати: вже записані платежі та повтори в межах запиту
+    existing = dict(db.session.query(Payment.bank_payment_id, Payment.id).filter(
+        Payment.bank_payment_id.in_({row["bank_payment_id"] for row in rows.values()})
+    ).all()) if rows else {}
+    new_rows = {}
+    first_index = {}
+    for index, row in rows.items():
+        bank_payment_id = row["bank_payment_id"]
+        results[index].bank_payment_id = bank_payment_id
+        if bank_payment_id in existing or bank_payment_id in first_index:
+            results[index].status = "duplicate"
+            results[index].id = existing.get(bank_payment_id)
+            continue
+        first_index[bank_payment_id] = index
+        new_rows[index] = row
+
+    if new_rows:
+        insert_rows = [_payment_insert_row(row) for row in enrich_payments(list(new_rows.values()))]
+        try:
+            # Вставка повз ORM - місяці для rollup позначаємо вручну
+            mark_rollup_buckets(db.session, ((row["user_id"], row["rdate"]) for row in insert_rows))
+            db.session.execute(insert(Payment).values(insert_rows))
+            ids = dict(db.session.query(Payment.bank_payment_id, Payment.id).filter(
+                Payment.bank_payment_id.in_(first_index)
+            ).all())
+            db.session.commit()
+        except Exception as err:
+            db.session.rollback()
+            logger.error(f"Помилка при масовому додаванні платежів: {str(err)}")
+            raise err
+        for index, row in new_rows.items():
+            results[index].status = "created"
+            results[index].id = ids.get(row["bank_payment_id"])
+
+    for index, result in enumerate(results):
+        if result.status == "duplicate" and result.id is None:
+            # Повтор у межах запиту - id першого входження
+            result.id = results[first_index[result.bank_payment_id]].id
+
+    created = sum(result.status == "created" for result in results)
+    duplicates = sum(result.status == "duplicate" for result in results)
+    logger.info(f"Масове додавання платежів: створено {created}, дублікатів {duplicates}, помилок {len(results) - created - duplicates}")
+    return PaymentBulkCreateResult(
+        created=created,
+        duplicates=duplicates,
+        errors=len(results) - created - duplicates,
+        items=results,
+    ).model_dump()
+
+
+@main_sql_statement
+def _payments_statement(shape: MainSqlShape, sort_column: str, is_desc: bool, has_after: bool, has_limit: bool) -> str:
+    sort_expr = PAYMENTS_RELEVANCE_SORT if sort_column == "relevance" else PAYMENTS_SORT_COLUMNS[sort_column]
+    score = ", p.score" if shape.has_search else ""
+
+    # Keyset пагінація: (значення сортування, id) строго після курсора
+    keyset = ""
+    if has_after:
+        op = "<" if is_desc else ">"
+        keyset = f"AND ({sort_expr} {op} :after_value OR ({sort_expr} = :after_value AND p.`id` {op} :after_id))"
+
+    direction = "DESC" if is_desc else "ASC"
+    limit = "LIMIT :limit" if has_limit else ""
+
+    return f"""
+    SELECT p.id, p.rdate, p.category_id, c.name AS category_name,
+           c.parent_id, p.mydesc, p.amount,
+           m.name AS mono_user_name, p.currency, p.currency_amount, p.source,
+           u.login AS user_login, p.display_currency, p.phone_label{score}
+    from ({build_main_sql(shape)}) p
+    LEFT JOIN categories c ON p.category_id = c.id
+    LEFT OUTER JOIN mono_users m on p.mono_user_id = m.id
+    LEFT JOIN users u ON p.user_id = u.id
+    WHERE 1=1
+    {keyset}
+    ORDER BY {sort_expr} {direction}, p.`id` {direction}
+    {limit}
+    """
+
 
-    sort = params.get("sort")
+def _payments_filter_data(user_id: int, params: dict, membership: GroupMembership | None = None) -> dict:
+    """
+    Параметри основного запиту для фільтрів списку платежів (період, q, source, категорія, group_user_id)
+    """
     category_id = params.get("category_id")
     year = params.get("year")
     month = params.get("month")
     currency = params.get('currency', 'UAH') or 'UAH'
-    group_id = params.get("group_id")
     group_user_id = params.get("group_user_id")
     source = params.get("source")
 
-    if not sort:
-        sort = "order by `amount` desc"
-
     current_date, end_date, start_date = get_dates(month, year)
 
-    um = ""
-    if q := params.get("q"):
-        um = f" and LOWER(`mydesc`) LIKE '%{q.lower()}%'"
-
     data = {
         "start_date": start_date,
         "end_date": end_date,
@@ -128,9 +277,10 @@ def get_payments_detail(user_id: int, params: dict) -> list[dict]:
         "source": source,
     }
 
-    # Додаємо фільтрацію за групою
-    if group_id:
-        data["group_id"] = group_id
+    # Група та її учасники - з членства, визначеного для запиту
+    if membership is None:
+        membership = resolve_group_membership(user_id)
+    data.update(membership.as_params())
 
     # Додаємо фільтрацію за користувачем з групи
     if group_user_id:
@@ -142,45 +292,148 @@ def get_payments_detail(user_id: int, params: dict) -> list[dict]:
         else:
             data["category_id"] = category_id
 
-    main_sql = get_main_sql(data, um)
+    return data
 
-    sql = f"""
-    SELECT p.id, p.rdate, p.category_id, c.name AS category_name,
-           c.parent_id, p.mydesc, p.amount,
-           m.name AS mono_user_name, p.currency, p.currency_amount, p.source,
-           u.login AS user_login, p.display_currency
-    from ({main_sql}) p
-    LEFT JOIN categories c ON p.category_id = c.id
-    LEFT OUTER JOIN mono_users m on p.mono_user_id = m.id
-    LEFT JOIN users u ON p.user_id = u.id
-    WHERE 1=1
-    {sort}
+
+def _get_payments_query(
+        user_id: int, params: dict, membership: GroupMembership | None = None
+) -> tuple[TextClause, dict]:
+    """
+    Повертає підготовлений запит та параметри для списку платежів.
+    Якщо задано after, додається keyset умова відносно курсора
+    """
+    sort_column, is_desc = parse_payments_sort(params.get("sort"))
+    data = _payments_filter_data(user_id, params, membership)
+
+    if after := params.get("after"):
+        data["after_value"], data["after_id"] = decode_cursor(after)
+    if limit := params.get("limit"):
+        data["limit"] = int(limit)
+
+    shape = get_main_sql_shape(data)
+    stmt = _payments_statement(shape, sort_column, is_desc, bool(after), bool(limit))
+    return stmt, data
+
+
+def _annotate_payment_row(row: dict) -> dict:
     """
+    Додає назву категорії та ім'я власника телефону (збережене при записі) до опису платежу
+    """
+    # Додаємо назву категорії до результату
+    row["category_name"] = row.get("category_name", "")
+
+    if phone_label := row.pop("phone_label", None):
+        row["mydesc"] += f" [{phone_label}]"
+    return row
 
+
+def _select_payments(user_id: int, params: dict, membership: GroupMembership | None) -> list[dict]:
+    sql, data = _get_payments_query(user_id, params, membership)
+    return _fetch_payments(sql, data)
+
+
+def _fetch_payments(sql: TextClause, data: dict) -> list[dict]:
     try:
         result = do_sql_sel(sql, data)
     except Exception as e:
         logger.error(f"SQL error in get_payments_detail: {str(e)}")
-        logger.error(f"SQL query: {sql}")
+        logger.error(f"SQL query: {sql.text}")
         logger.error(f"Data: {data}")
         raise
 
     if not result:
         return []
 
-    pattern = re.compile(r"(\+38)?0\d{9}", re.MULTILINE)
-    user_phones = get_user_phones_from_config(user_id)
-    for row in result:
-        # Додаємо назву категорії до результату
-        row["category_name"] = row.get("category_name", "")
+    return [_annotate_payment_row(row) for row in result]
 
-        if pattern.search(row["mydesc"]):
-            phone_number = pattern.search(row["mydesc"]).group(0)
-            phone_number = f"+38{phone_number}" if not phone_number.startswith("+38") else phone_number
-            if phone_number in user_phones:
-                row["mydesc"] += f" [{user_phones[phone_number]}]"
 
-    return result
+def get_payments_detail(user_id: int, params: dict, membership: GroupMembership | None = None) -> list[dict]:
+    """
+    list or search all payments.
+    if not set conditions year and month then get current year and month
+    if set q then do search
+    """
+    sql, data = _get_payments_query(user_id, {**params, "after": None, "limit": None}, membership)
+    # Повний список (без пагінації) кешується так само, як агрегати
+    return cached_aggregate("payments_detail", sql, data, lambda: _fetch_payments(sql, data))
+
+
+def get_payments_page(user_id: int, params: dict, membership: GroupMembership | None = None) -> dict:
+    """
+    Сторінка платежів з keyset пагінацією.
+    Повертає items та next_cursor (None, якщо це остання сторінка)
+    """
+    limit = int(params["limit"])
+    # Беремо на один рядок більше, щоб знати, чи є наступна сторінка
+    rows = _select_payments(user_id, {**params, "limit": limit + 1}, membership)
+
+    sort_column, _ = parse_payments_sort(params.get("sort"))
+    return _payments_page(rows, limit, sort_column)
+
+
+def _payments_page(rows: list[dict], limit: int, sort_column: str) -> dict:
+    """
+    Обрізає вибірку з limit + 1 рядків до сторінки та формує курсор на наступну
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = last[sort_column]
+        # amount в SQL порівнюється як ROUND(amount, 2)
+        if sort_column == "amount" and value is not None:
+            value = round(value, 2)
+        next_cursor = encode_cursor(value, last["id"])
+
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+def search_payments(user_id: int, params: dict, membership: GroupMembership | None = None) -> dict:
+    """
+    Повнотекстовий пошук платежів по опису за всі роки (FULLTEXT ngram індекс).
+    Результати впорядковані за релевантністю, пагінація курсором по (score, id)
+    """
+    words = (params.get("q") or "").replace('"', " ").split()
+    if not words:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Порожній пошуковий запит")
+
+    limit = int(params.get("limit") or 50)
+    data = {
+        "user_id": user_id,
+        "currency": params.get("currency") or "UAH",
+        "search": " ".join(words),
+        "source": params.get("source"),
+        "limit": limit + 1,
+    }
+
+    if membership is None:
+        membership = resolve_group_membership(user_id)
+    data.update(membership.as_params())
+
+    if group_user_id := params.get("group_user_id"):
+        data["group_user_id"] = group_user_id
+    if after := params.get("after"):
+        data["after_value"], data["after_id"] = decode_cursor(after)
+
+    shape = get_main_sql_shape(data)
+    sql = _payments_statement(shape, "relevance", True, bool(after), True)
+    rows = _fetch_payments(sql, data)
+    return _payments_page(rows, limit, "score")
+
+
+def stream_payments_detail(user_id: int, params: dict, membership: GroupMembership | None = None) -> Iterator[str]:
+    """
+    Генератор NDJSON рядків зі списком платежів.
+    Рядки читаються з server-side курсора, тому пам'ять не залежить від розміру місяця
+    """
+    sql, data = _get_payments_query(user_id, {**params, "limit": None}, membership)
+
+    def generate():
+        for row in do_sql_stream(sql, data):
+            row = _annotate_payment_row(row)
+            yield json.dumps(jsonable_encoder(row), ensure_ascii=False) + "\n"
+
+    return generate()
 
 
 def get_payment_detail(payment_id: int):
@@ -259,20 +512,11 @@ def upd_payment_(payment_id: int, payment_data: PaymentUpdate):
         logger.info(f"[UPD PAYMENT {payment_id}] Entering currency conversion for {currency}")
         rate = get_last_rate(currency, rdate)
         logger.info(f"[UPD PAYMENT {payment_id}] Exchange rate retrieved: {rate}")
-
-        # Одразу записуємо в словник
-        update_data["amount"] = float(currency_amount) * rate
-        update_data["amount_original"] = currency_amount
-        update_data["currency_original"] = currency
-        update_data["exchange_rate"] = rate
+        _apply_exchange_rate(update_data, rate)
         logger.info(f"[UPD PAYMENT {payment_id}] Calculated: {currency_amount} * {rate} = {update_data['amount']}, tracking fields set")
     else:
         logger.info(f"[UPD PAYMENT {payment_id}] No conversion needed (UAH or no currency_amount)")
-        # Одразу записуємо в словник
-        update_data["amount"] = currency_amount
-        update_data["amount_original"] = currency_amount
-        update_data["currency_original"] = 'UAH'
-        update_data["exchange_rate"] = 1.0
+        _apply_exchange_rate(update_data, None)
         logger.info(f"[UPD PAYMENT {payment_id}] Set default values: amount={update_data['amount']}, exchange_rate=1.0")
 
     try:
@@ -281,8 +525,19 @@ def upd_payment_(payment_id: int, payment_data: PaymentUpdate):
 
         # Видаляємо поля які не можна оновити
         update_dict = {k: v for k, v in update_data.items() if k not in ['refuel_data', 'id']}
+
+        # Опис змінився - перераховуємо поля, що від нього залежать
+        if "mydesc" in update_dict:
+            enriched = enrich_payments([{"user_id": payment.user_id, "mydesc": update_dict["mydesc"]}])[0]
+            update_dict.update({k: v for k, v in enriched.items() if k not in ("user_id", "mydesc")})
         logger.info(f"[UPD PAYMENT {payment_id}] Final update dict: {update_dict}")
 
+        # Прямий UPDATE йде повз ORM - місяці (старий і новий) для rollup позначаємо вручну
+        mark_rollup_buckets(db.session, [
+            (payment.user_id, payment.rdate),
+            (payment.user_id, update_dict.get("rdate") or payment.rdate),
+        ])
+
         # КРИТИЧНО: Використовуємо прямий UPDATE замість setattr щоб уникнути проблем з SQLAlchemy
         db.session.query(Payment).filter(Payment.id == payment_id).update(update_dict)
 
@@ -296,32 +551,14 @@ def upd_payment_(payment_id: int, payment_data: PaymentUpdate):
     return get_payment_detail(payment_id)
 
 
-def change_payments_category_(user_id: int, payment_ids: list[int], category_id: int):
+def _update_allowed_payments(user_id: int, payment_ids: list[int], values: dict) -> int:
     """
-    Змінює категорію для списку платежів
-    Вхідні дані: payment_ids - список ID платежів, category_id - нова категорія
-    
-    Дозволяє адміністратору групи змінювати категорію платежів учасників групи
+    Один запит визначає платежі, доступні користувачу (власні або учасників групи, де він адміністратор),
+    другий - оновлює їх одним UPDATE. Commit робить викликач
     """
-    
-    # Отримуємо всі платежі
-    payments = db.session.query(Payment).filter(Payment.id.in_(payment_ids)).all()
-
-    # Платежі, до яких користувач має доступ
-    allowed_payments = []
-
-    # Перевіряємо доступ до кожного платежу
-    for payment in payments:
-        if payment.user_id == user_id:
-            # Користувач є власником платежу
-            allowed_payments.append(payment)
-        else:
-            # Перевіряємо, чи є користувач адміністратором групи, до якої належить платіж
-            is_admin = check_user_in_group(payment.user_id, user_id)
-            if is_admin:
-                allowed_payments.append(payment)
+    allowed = get_allowed_payments(user_id, payment_ids)
 
-    if not allowed_payments:
+    if not allowed:
         # Якщо немає платежів, до яких користувач має доступ
         logger.warning(f"Не знайдено платежів для користувача {user_id} з ID {payment_ids} або немає прав доступу")
         raise HTTPException(
@@ -329,19 +566,33 @@ def change_payments_category_(user_id: int, payment_ids: list[int], category_id:
             detail="Немає доступу до платежів"
         )
 
-    # Змінюємо категорію для доступних платежів
-    for payment in allowed_payments:
-        payment.category_id = category_id
+    # UPDATE йде повз ORM - місяці для rollup позначаємо вручну
+    mark_rollup_buckets(db.session, [(row.user_id, row.rdate) for row in allowed])
+    db.session.query(Payment).filter(
+        Payment.id.in_([row.id for row in allowed])
+    ).update(values, synchronize_session=False)
+    return len(allowed)
+
 
+def change_payments_category_(user_id: int, payment_ids: list[int], category_id: int):
+    """
+    Змінює категорію для списку платежів
+    Вхідні дані: payment_ids - список ID платежів, category_id - нова категорія
+    
+    Дозволяє адміністратору групи змінювати категорію платежів учасників групи
+    """
     try:
+        count = _update_allowed_payments(user_id, payment_ids, {Payment.category_id: category_id})
         db.session.commit()
-        logger.info(f"Змінено категорію для {len(allowed_payments)} платежів на {category_id}")
+        logger.info(f"Змінено категорію для {count} платежів на {category_id}")
+    except HTTPException:
+        raise
     except Exception as err:
         db.session.rollback()
         logger.error(f"Помилка при зміні категорії платежів: {str(err)}")
         raise err
     
-    return BulkOperationResult.success(len(allowed_payments), "Оновлено")
+    return BulkOperationResult.success(count, "Оновлено")
 
 
 def bulk_delete_payments_(user_id: int, payment_ids: list[int]):
@@ -351,42 +602,105 @@ def bulk_delete_payments_(user_id: int, payment_ids: list[int]):
     
     Дозволяє адміністратору групи видаляти платежі учасників групи
     """
+    try:
+        count = _update_allowed_payments(user_id, payment_ids, {Payment.is_deleted: True})
+        db.session.commit()
+        logger.info(f"Видалено {count} платежів")
+    except HTTPException:
+        raise
+    except Exception as err:
+        db.session.rollback()
+        logger.error(f"Помилка при видаленні платежів: {str(err)}")
+        raise err
     
-    # Отримуємо всі платежі
-    payments = db.session.query(Payment).filter(Payment.id.in_(payment_ids)).all()
+    return BulkOperationResult.success(count, "Видалено")
 
-    # Платежі, до яких користувач має доступ
-    allowed_payments = []
 
-    # Перевіряємо доступ до кожного платежу
-    for payment in payments:
-        if payment.user_id == user_id:
-            # Користувач є власником платежу
-            allowed_payments.append(payment)
-        else:
-            # Перевіряємо, чи є користувач адміністратором групи, до якої належить платіж
-            is_admin = check_user_in_group(payment.user_id, user_id)
-            if is_admin:
-                allowed_payments.append(payment)
+# Масові дії за фільтром: колонка, що змінюється, її значення (bound параметр) та чи діє на видалені платежі
+PAYMENTS_FILTER_ACTIONS = {
+    "change_category": ("category_id", ":new_category_id", False),
+    "delete": ("is_deleted", "1", False),
+    "restore": ("is_deleted", "0", True),
+}
+
+
+@main_sql_statement
+def _filter_buckets_statement(shape: MainSqlShape) -> str:
+    # Кількість для попереднього перегляду та місяці для rollup одним запитом
+    return f"""
+    SELECT p.user_id, YEAR(p.rdate) AS `year`, MONTH(p.rdate) AS `month`, COUNT(*) AS cnt
+    FROM ({build_main_sql(shape)}) p
+    GROUP BY p.user_id, YEAR(p.rdate), MONTH(p.rdate)
+    """
 
-    if not allowed_payments:
-        # Якщо немає платежів, до яких користувач має доступ
-        logger.warning(f"Не знайдено платежів для користувача {user_id} з ID {payment_ids} або немає прав доступу")
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Немає доступу до платежів"
-        )
 
-    # Позначаємо платежі як видалені
-    for payment in allowed_payments:
-        payment.is_deleted = True
+@main_sql_statement
+def _filter_update_statement(shape: MainSqlShape, dialect_name: str, column: str, value: str) -> str:
+    if dialect_name == 'sqlite':
+        return f"""
+        UPDATE payments SET `{column}` = {value}
+        WHERE id IN (SELECT p.id FROM ({build_main_sql(shape)}) p)
+        """
+    # MySQL не дозволяє підзапит до таблиці, що оновлюється - multi-table UPDATE з derived table
+    return f"""
+    UPDATE payments t
+    JOIN ({build_main_sql(shape)}) p ON p.id = t.id
+    SET t.`{column}` = {value}
+    """
+
+
+def update_payments_by_filter_(
+        user_id: int,
+        action: str,
+        params: dict,
+        membership: GroupMembership | None = None,
+        new_category_id: int | None = None,
+        preview: bool = False,
+):
+    """
+    Масова зміна категорії, видалення або відновлення платежів за фільтрами списку
+    (період, q, source, категорія, group_user_id) одним UPDATE на сервері.
+    Діє на ті самі платежі, що показує список; restore - на видалені.
+    Платежі інших учасників групи змінює лише адміністратор групи.
+    preview=True лише рахує платежі
+    """
+    column, value, deleted = PAYMENTS_FILTER_ACTIONS[action]
+
+    params = dict(params)
+    if params.get("year") and not params.get("month"):
+        # Рік без місяця - весь рік (список у такому разі показує поточний місяць)
+        params["month"] = "1"
+        data = _payments_filter_data(user_id, params, membership)
+        data["end_date"] = f"{int(data['start_date'][:4]) + 1}-01-01"
+    else:
+        data = _payments_filter_data(user_id, params, membership)
+
+    if not is_group_admin(user_id, data["group_id"]):
+        data["member_ids"] = [user_id]
+    data["deleted"] = deleted
+    data["new_category_id"] = new_category_id
+
+    shape = get_main_sql_shape(data)
+    buckets = do_sql_sel(_filter_buckets_statement(shape), data)
+    count = sum(int(row["cnt"]) for row in buckets)
+
+    if preview or not count:
+        return BulkFilterOperationResult(
+            count=count, preview=preview, detail=f"Знайдено {count} записів"
+        ).model_dump()
 
     try:
+        # UPDATE йде повз ORM - місяці для rollup позначаємо вручну
+        mark_rollup_buckets(db.session, (
+            (row["user_id"], datetime.date(int(row["year"]), int(row["month"]), 1)) for row in buckets
+        ))
+        dialect_name = db.session.get_bind().dialect.name
+        db.session.execute(_filter_update_statement(shape, dialect_name, column, value), data)
         db.session.commit()
-        logger.info(f"Видалено {len(allowed_payments)} платежів")
+        logger.info(f"Масова дія {action} за фільтром: {count} платежів користувача {user_id}")
     except Exception as err:
         db.session.rollback()
-        logger.error(f"Помилка при видаленні платежів: {str(err)}")
+        logger.error(f"Помилка масової дії {action} за фільтром: {str(err)}")
         raise err
-    
-    return BulkOperationResult.success(len(allowed_payments), "Видалено")
+
+    return BulkFilterOperationResult(count=count, detail=f"Оновлено {count} записів").model_dump()
@@ -0,0 +1,275 @@
+import datetime
+import json
+import logging
+import threading
+import time
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, or_
+from sqlalchemy.orm import Session
+
+from api.versions.funcs import DATA_VERSIONS_KEY, RATES_SCOPE, get_data_versions
+from app.config import RATE_TABLE_CHECK_INTERVAL
+from models.models import SprExchangeRates
+
+logger = logging.getLogger()
+
+# Курси за останні дні можуть оновлюватись на місці (UPDATE по id), тож хвіст перечитується
+RATE_TABLE_OVERLAP_DAYS = 7
+
+# Ключ у session.info: commit змінює курси - таблицю в пам'яті треба перечитати
+RATES_CHANGED_KEY = "rate_table_changed"
+
+
+# Назви колонок історичних джерел курсів (EUR-universal.json, CSV) -> колонки spr_exchange_rates
+RATE_SOURCE_COLUMNS = {
+    "time": "rdate", "date": "rdate", "rdate": "rdate",
+    "ccy": "currency", "currency": "currency",
+    "code": "code", "currencyCode": "code",
+    "sell": "saleRate", "sale": "saleRate", "saleRate": "saleRate",
+    "buy": "purchaseRate", "purchaseRate": "purchaseRate",
+}
+
+
+def read_rates_source(path: str, currency_codes: dict[int, str], currency: str | None = None) -> pd.DataFrame:
+    """
+    Історичні курси з JSON (список записів: sell, buy, time в мс, code ISO 4217 - як EUR-universal.json)
+    або CSV з тими ж чи стандартними назвами колонок. currency - валюта для всіх записів,
+    інакше з колонки currency або за кодом з currency_codes.
+    Результат: day, currency, saleRate, purchaseRate - останній курс кожного дня
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as source:
+            frame = pd.DataFrame.from_records(json.load(source))
+    else:
+        frame = pd.read_csv(path)
+    frame = frame.rename(columns=RATE_SOURCE_COLUMNS)
+
+    if pd.api.types.is_numeric_dtype(frame["rdate"]):
+        frame["rdate"] = pd.to_datetime(frame["rdate"], unit="ms", utc=True).dt.tz_localize(None)
+    else:
+        frame["rdate"] = pd.to_datetime(frame["rdate"])
+    if currency:
+        frame["currency"] = currency
+    elif "currency" not in frame:
+        frame["currency"] = frame["code"].map(currency_codes)
+    if "purchaseRate" not in frame:
+        frame["purchaseRate"] = np.nan
+
+    skipped = frame["currency"].isna() | frame["saleRate"].isna() | frame["rdate"].isna()
+    if skipped.any():
+        logger.warning(f"Rates source {path}: {int(skipped.sum())} rows without date, currency or rate skipped")
+    frame = frame[~skipped].sort_values("rdate", kind="stable")
+    frame["day"] = frame["rdate"].dt.normalize()
+    frame = frame.drop_duplicates(["currency", "day"], keep="last")
+    return frame[["day", "currency", "saleRate", "purchaseRate"]].reset_index(drop=True)
+
+
+def dense_daily_rates(points: pd.DataFrame, end_date: datetime.date) -> pd.DataFrame:
+    """
+    Щільний ряд: кожен календарний день від першого курсу валюти до end_date,
+    дні без курсу (вихідні, пропуски) заповнені останнім відомим курсом
+    """
+    frames = []
+    for currency, group in points.groupby("currency"):
+        series = group.set_index("day")[["saleRate", "purchaseRate"]].sort_index()
+        days = pd.date_range(series.index.min(), pd.Timestamp(end_date), freq="D", name="day")
+        dense = series.reindex(days).ffill().reset_index()
+        dense["currency"] = currency
+        frames.append(dense)
+    if not frames:
+        return pd.DataFrame(columns=["day", "currency", "saleRate", "purchaseRate"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def as_rate_datetime(value) -> datetime.datetime:
+    """
+    Дата для as-of пошуку курсу: як у SQL `rdate <= 'YYYY-MM-DD'`, дата без часу - це північ
+    """
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    value = str(value).strip()
+    try:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value[:10])
+
+
+@dataclass
+class _RateSeries:
+    """
+    Курси однієї валюти, відсортовані за датою (для однакової дати - за id)
+    """
+    keys: list = field(default_factory=list)  # (rdate, id)
+    rates: list = field(default_factory=list)
+    _dates: np.ndarray | None = None
+
+    def dates_array(self) -> np.ndarray:
+        if self._dates is None:
+            self._dates = np.array([rdate for rdate, _ in self.keys], dtype="datetime64[us]")
+        return self._dates
+
+
+class RateTable:
+    """
+    Курси продажу (saleRate) з spr_exchange_rates в пам'яті процесу.
+    Пошук останнього курсу на дату - bisect, без запиту на кожну конвертацію.
+    Не частіше ніж раз на check_interval секунд звіряє версію курсів (data_versions, scope "rates")
+    і при зміні дочитує нові записи та хвіст останніх RATE_TABLE_OVERLAP_DAYS днів
+    """
+
+    def __init__(self, check_interval: int = RATE_TABLE_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._series: dict[str, _RateSeries] = {}
+        self._version: int | None = None
+        self._max_id = 0
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def expire(self):
+        """
+        Наступний пошук звірить версію курсів (після commit, що змінив курси в цьому процесі)
+        """
+        self._checked_at = 0.0
+        self._version = None
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+            self._max_id = 0
+            self.expire()
+
+    def refresh(self, session: Session, force: bool = False):
+        if not force and time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            version = get_data_versions(session, [RATES_SCOPE]).get(RATES_SCOPE, 0)
+            if force or version != self._version or not self._series:
+                self._load(session)
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _load(self, session: Session):
+        query = session.query(
+            SprExchangeRates.id, SprExchangeRates.currency, SprExchangeRates.rdate, SprExchangeRates.saleRate
+        ).filter(SprExchangeRates.currency.isnot(None), SprExchangeRates.rdate.isnot(None))
+
+        cutoff = None
+        if self._series:
+            last_date = max(series.keys[-1][0] for series in self._series.values() if series.keys)
+            cutoff = last_date - datetime.timedelta(days=RATE_TABLE_OVERLAP_DAYS)
+            query = query.filter(or_(SprExchangeRates.id > self._max_id, SprExchangeRates.rdate >= cutoff))
+
+        rows = query.order_by(SprExchangeRates.rdate, SprExchangeRates.id).all()
+
+        # Нові серії будуються окремо і підміняються цілком - пошуки без блокування бачать узгоджений стан
+        series_by_currency = {}
+        if cutoff is not None:
+            for currency, series in self._series.items():
+                start = bisect_right(series.keys, (cutoff, -1))
+                series_by_currency[currency] = _RateSeries(series.keys[:start], series.rates[:start])
+        for rate_id, currency, rdate, sale_rate in rows:
+            series = series_by_currency.setdefault(currency, _RateSeries())
+            key = (rdate.replace(tzinfo=None), rate_id)
+            if series.keys and key < series.keys[-1]:
+                # Запис заднім числом (бекфіл) - вставка в середину
+                position = bisect_right(series.keys, key)
+                series.keys.insert(position, key)
+                series.rates.insert(position, sale_rate)
+            else:
+                series.keys.append(key)
+                series.rates.append(sale_rate)
+            self._max_id = max(self._max_id, rate_id)
+
+        self._series = series_by_currency
+        self.loads += 1
+        logger.info(f"Rate table {'refreshed' if cutoff else 'loaded'}: {len(rows)} rates")
+
+    def get_rate(self, session: Session, currency: str, end_date) -> float | None:
+        """
+        Останній курс currency з rdate <= end_date, None якщо курсу немає
+        """
+        if currency == 'UAH':
+            return 1
+        self.refresh(session)
+        series = self._series.get(currency)
+        if series is None:
+            return None
+        position = bisect_right(series.keys, (as_rate_datetime(end_date), float("inf"))) - 1
+        if position < 0:
+            return None
+        return series.rates[position]
+
+    def rates_for(self, session: Session, currency: str, dates: Iterable) -> np.ndarray:
+        """
+        Векторний as-of пошук для пакетної обробки: масив курсів для масиву дат, NaN - курсу немає
+        """
+        if isinstance(dates, (pd.Series, np.ndarray)) and np.issubdtype(dates.dtype, np.datetime64):
+            dates = np.asarray(dates, dtype="datetime64[us]")
+        else:
+            dates = np.asarray([as_rate_datetime(value) for value in dates], dtype="datetime64[us]")
+        if currency == 'UAH':
+            return np.ones(len(dates))
+        self.refresh(session)
+        series = self._series.get(currency)
+        if series is None:
+            return np.full(len(dates), np.nan)
+        positions = np.searchsorted(series.dates_array(), dates, side="right") - 1
+        rates = np.asarray(series.rates, dtype=float)[np.maximum(positions, 0)]
+        rates[positions < 0] = np.nan
+        return rates
+
+    def window(self, session: Session, currency: str, start, end) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Курси currency, потрібні для дат start..end: останній курс на start і всі пізніші до end.
+        Повертає копії (дати datetime64, курси) - знімок не змінюється при оновленні таблиці
+        """
+        self.refresh(session)
+        series = self._series.get(currency)
+        if series is None:
+            return np.array([], dtype="datetime64[us]"), np.array([], dtype=float)
+        dates = series.dates_array()
+        first = max(np.searchsorted(dates, np.datetime64(as_rate_datetime(start), "us"), side="right") - 1, 0)
+        last = np.searchsorted(dates, np.datetime64(as_rate_datetime(end), "us"), side="right")
+        return dates[first:last].copy(), np.asarray(series.rates[first:last], dtype=float)
+
+    def stats(self) -> dict:
+        return {
+            "currencies": len(self._series),
+            "rates": sum(len(series.keys) for series in self._series.values()),
+            "version": self._version,
+            "loads": self.loads,
+        }
+
+
+rate_table = RateTable()
+
+
+def _snapshot_rates_changed(session):
+    # Виконується до того, як версії забирають свої позначки з session.info
+    session.flush()
+    if RATES_SCOPE in session.info.get(DATA_VERSIONS_KEY, ()):
+        session.info[RATES_CHANGED_KEY] = True
+
+
+event.listen(Session, "before_commit", _snapshot_rates_changed, insert=True)
+
+
+@event.listens_for(Session, "after_commit")
+def _expire_rate_table(session):
+    if session.info.pop(RATES_CHANGED_KEY, False):
+        rate_table.expire()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rates_changed(session):
+    session.info.pop(RATES_CHANGED_KEY, None)
@@ -0,0 +1,521 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Callable, Iterable
+
+import pandas as pd
+import requests
+from sqlalchemy import and_, bindparam, delete, func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from api.config.schemas import ConfigTypes
+from api.rates.funcs import dense_daily_rates, rate_table
+from api.rollup.funcs import ROLLUP_RATE_CURRENCIES, mark_rollup_buckets, rebuild_payments_rollup
+from api.versions.funcs import RATES_SCOPE, mark_data_changed
+from app.config import (
+    PRIVAT_RATES_URL, RATES_FETCH_ATTEMPTS, RATES_FETCH_BACKOFF, RATES_INGEST_INTERVAL,
+)
+from models.models import Config, SprExchangeRates, SprExchangeRatesDaily, User
+from mydb import SessionLocal, text
+
+logger = logging.getLogger()
+
+# Скільки днів перераховувати назад від останнього заповненого дня (курси за день можуть оновлюватись)
+DAILY_RATES_OVERLAP_DAYS = 7
+
+# Розмір пачки multi-row INSERT при бекфілі курсів
+BACKFILL_CHUNK_SIZE = 5000
+
+# Розмір пачки платежів при перерахунку сум за виправленими курсами (одна коротка транзакція на пачку)
+RECOMPUTE_CHUNK_SIZE = 1000
+
+# Курс платежу вважається зміненим, якщо відрізняється від курсу дня більше ніж на це значення
+RECOMPUTE_RATE_EPSILON = 0.00001
+
+# Джерела, де amount - сума в UAH, яку повідомив банк (а не currency_amount * курс з довідника)
+RECOMPUTE_BANK_AMOUNT_SOURCES = ("mono", "p24", "pumb")
+
+# Платежі у валюті, збережений курс яких відрізняється від курсу їхнього дня (щоденна таблиця = as-of курс).
+# Лише суми, пораховані за довідником курсів: курс записаний (не NULL і не 1.0 за замовчуванням - його
+# лишають імпорти виписок) і джерело не з RECOMPUTE_BANK_AMOUNT_SOURCES
+_recompute_select_statement = text("""
+SELECT p.id, p.user_id, p.rdate
+FROM payments p
+JOIN spr_exchange_rates_daily er ON er.currency = p.currency AND er.rdate = DATE(p.rdate)
+WHERE p.currency = :currency
+AND p.id > :after_id
+AND p.rdate >= :start_date
+AND p.rdate < :end_date
+AND p.currency_amount IS NOT NULL
+AND p.exchange_rate IS NOT NULL
+AND p.exchange_rate <> 1
+AND (p.source IS NULL OR p.source NOT IN :bank_amount_sources)
+AND ABS(p.exchange_rate - er.saleRate) > :epsilon
+ORDER BY p.id
+LIMIT :chunk_size
+""").bindparams(bindparam("bank_amount_sources", expanding=True))
+
+_recompute_update_statements = {
+    # MySQL: UPDATE з join на курс дня, лише рядки пачки (блокування по первинному ключу)
+    "mysql": text("""
+    UPDATE payments p
+    JOIN spr_exchange_rates_daily er ON er.currency = p.currency AND er.rdate = DATE(p.rdate)
+    SET p.exchange_rate = er.saleRate, p.amount = p.currency_amount * er.saleRate
+    WHERE p.id IN :ids
+    """).bindparams(bindparam("ids", expanding=True)),
+    "sqlite": text("""
+    UPDATE payments
+    SET exchange_rate = er.saleRate, amount = payments.currency_amount * er.saleRate
+    FROM spr_exchange_rates_daily er
+    WHERE er.currency = payments.currency AND er.rdate = DATE(payments.rdate)
+    AND payments.id IN :ids
+    """).bindparams(bindparam("ids", expanding=True)),
+}
+
+
+def _last_rate_before(session: Session, currency: str, day: datetime.date) -> SprExchangeRates | None:
+    return session.query(SprExchangeRates).filter(
+        SprExchangeRates.currency == currency,
+        SprExchangeRates.rdate < day,
+    ).order_by(SprExchangeRates.rdate.desc(), SprExchangeRates.id.desc()).first()
+
+
+def _daily_rate_key(sale_rate, purchase_rate) -> tuple:
+    # Курси зберігаються як FLOAT(10, 5) - порівнюємо з тією ж точністю
+    return tuple(None if rate is None else round(float(rate), 5) for rate in (sale_rate, purchase_rate))
+
+
+def refresh_daily_rates(
+        session: Session,
+        start_date: datetime.date | None = None,
+        end_date: datetime.date | None = None,
+) -> int:
+    """
+    Перераховує spr_exchange_rates_daily: одна строка на валюту на кожен календарний день
+    з start_date по end_date включно, дні без курсу заповнюються останнім відомим курсом.
+    Без start_date продовжує з останнього заповненого дня (з перекриттям DAILY_RATES_OVERLAP_DAYS),
+    для порожньої таблиці - з першого курсу. Перезаписуються лише валюти, курси яких за період змінились.
+    Повертає кількість записаних строк, commit робить викликач
+    """
+    end_date = end_date or datetime.datetime.now(datetime.timezone.utc).date()
+    if start_date is None:
+        last_day = session.query(func.max(SprExchangeRatesDaily.rdate)).scalar()
+        if last_day:
+            start_date = last_day - datetime.timedelta(days=DAILY_RATES_OVERLAP_DAYS)
+
+    currencies = [row[0] for row in session.query(SprExchangeRates.currency).distinct() if row[0]]
+    total = 0
+    changed_days = set()
+    for currency in currencies:
+        query = session.query(SprExchangeRates).filter(
+            SprExchangeRates.currency == currency,
+            SprExchangeRates.rdate < end_date + datetime.timedelta(days=1),
+        )
+        seed = None
+        if start_date:
+            query = query.filter(SprExchangeRates.rdate >= start_date)
+            seed = _last_rate_before(session, currency, start_date)
+        rates = query.order_by(SprExchangeRates.rdate, SprExchangeRates.id).all()
+
+        # Останній курс за день перекриває попередні, тож достатньо словника по даті
+        by_day = {rate.rdate.date(): rate for rate in rates if rate.rdate}
+        if not by_day and seed is None:
+            continue
+
+        day = start_date or min(by_day)
+        current = seed
+        rows = []
+        while day <= end_date:
+            current = by_day.get(day, current)
+            if current is not None:
+                rows.append({
+                    "rdate": day,
+                    "base_currency": current.base_currency,
+                    "currency": currency,
+                    "saleRate": current.saleRate,
+                    "purchaseRate": current.purchaseRate,
+                    "created": datetime.datetime.now(datetime.timezone.utc),
+                })
+            day += datetime.timedelta(days=1)
+
+        period = (
+            SprExchangeRatesDaily.currency == currency,
+            SprExchangeRatesDaily.rdate >= (start_date or min(by_day)),
+            SprExchangeRatesDaily.rdate <= end_date,
+        )
+        # Перекриття щоразу перераховує ті самі дні - пишемо лише якщо щось змінилось
+        current_days = {
+            rdate: _daily_rate_key(sale_rate, purchase_rate)
+            for rdate, sale_rate, purchase_rate in session.query(
+                SprExchangeRatesDaily.rdate, SprExchangeRatesDaily.saleRate, SprExchangeRatesDaily.purchaseRate
+            ).filter(*period)
+        }
+        new_days = {row["rdate"]: _daily_rate_key(row["saleRate"], row["purchaseRate"]) for row in rows}
+        currency_changed_days = {
+            day for day in current_days.keys() | new_days.keys() if current_days.get(day) != new_days.get(day)
+        }
+        if not currency_changed_days:
+            continue
+
+        session.execute(delete(SprExchangeRatesDaily).where(*period))
+        if rows:
+            session.execute(insert(SprExchangeRatesDaily), rows)
+        total += len(rows)
+        changed_days |= currency_changed_days
+
+    # Від курсу дня залежать лише суми в EUR/USD - перераховуємо їх за місяці зі зміненими курсами
+    if changed_days:
+        first_day, last_day = min(changed_days), max(changed_days)
+        rebuild_payments_rollup(
+            session,
+            start_date=first_day.replace(day=1),
+            end_date=datetime.date(last_day.year + last_day.month // 12, last_day.month % 12 + 1, 1),
+            currencies=ROLLUP_RATE_CURRENCIES,
+        )
+        mark_data_changed(session, scopes=[RATES_SCOPE])
+
+    logger.info(f"Daily exchange rates refreshed: {total} rows")
+    return total
+
+
+def refresh_daily_rates_on_startup() -> int:
+    """
+    Догоняє щоденну таблицю курсів при старті (lifespan) або з CLI.
+    Використовує SessionLocal, бо middleware fastapi_sqlalchemy ще не ініціалізований
+    """
+    session = SessionLocal()
+    try:
+        total = refresh_daily_rates(session)
+        session.commit()
+        return total
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _insert_chunks(session: Session, model, rows: list[dict], chunk_size: int):
+    for start in range(0, len(rows), chunk_size):
+        session.execute(insert(model), rows[start:start + chunk_size])
+
+
+def backfill_rates(
+        session: Session,
+        points: pd.DataFrame,
+        end_date: datetime.date | None = None,
+        chunk_size: int = BACKFILL_CHUNK_SIZE,
+) -> dict:
+    """
+    Бекфіл історичних курсів (points - результат read_rates_source).
+    Дні, для яких у spr_exchange_rates вже є курс валюти, не перезаписуються (курси API пріоритетніші),
+    решта додаються з source="backfill". Потім spr_exchange_rates_daily перезаписується щільним рядом
+    від першого дня джерела до end_date. Вставка пачками по chunk_size, commit робить викликач
+    """
+    end_date = end_date or datetime.datetime.now(datetime.timezone.utc).date()
+    points = points[points["day"] <= pd.Timestamp(end_date)]
+    if points.empty:
+        return {"rates": 0, "daily": 0}
+    start_date = points["day"].min().date()
+    currencies = sorted(points["currency"].unique())
+
+    # Наявні курси за період одним запитом
+    existing = pd.DataFrame(
+        session.query(
+            SprExchangeRates.currency, SprExchangeRates.rdate, SprExchangeRates.saleRate, SprExchangeRates.purchaseRate
+        ).filter(
+            SprExchangeRates.currency.in_(currencies),
+            SprExchangeRates.rdate >= start_date,
+        ).order_by(SprExchangeRates.rdate, SprExchangeRates.id).all(),
+        columns=["currency", "rdate", "saleRate", "purchaseRate"],
+    )
+    existing["day"] = pd.to_datetime(existing["rdate"]).dt.normalize()
+    existing = existing.drop_duplicates(["currency", "day"], keep="last")
+
+    known = pd.MultiIndex.from_frame(existing[["currency", "day"]])
+    new_points = points[~pd.MultiIndex.from_frame(points[["currency", "day"]]).isin(known)]
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    _insert_chunks(session, SprExchangeRates, [
+        {
+            "rdate": day.to_pydatetime(), "base_currency": "UAH", "currency": currency,
+            "saleRate": float(sale), "purchaseRate": None if pd.isna(purchase) else float(purchase),
+            "source": "backfill", "created": now,
+        }
+        for day, currency, sale, purchase in new_points[["day", "currency", "saleRate", "purchaseRate"]].itertuples(index=False)
+    ], chunk_size)
+
+    dense = dense_daily_rates(pd.concat([existing[points.columns], new_points], ignore_index=True), end_date)
+    session.execute(delete(SprExchangeRatesDaily).where(
+        SprExchangeRatesDaily.currency.in_(currencies),
+        SprExchangeRatesDaily.rdate >= start_date,
+        SprExchangeRatesDaily.rdate <= end_date,
+    ))
+    _insert_chunks(session, SprExchangeRatesDaily, [
+        {
+            "rdate": day.date(), "base_currency": "UAH", "currency": currency,
+            "saleRate": float(sale), "purchaseRate": None if pd.isna(purchase) else float(purchase),
+            "created": now,
+        }
+        for day, currency, sale, purchase in dense[["day", "currency", "saleRate", "purchaseRate"]].itertuples(index=False)
+    ], chunk_size)
+
+    # Записи повз ORM: версія курсів і rollup (суми в EUR/USD) з першого дня бекфілу
+    mark_data_changed(session, scopes=[RATES_SCOPE])
+    rebuild_payments_rollup(session, start_date=start_date)
+
+    logger.info(f"Exchange rates backfilled from {start_date}: {len(new_points)} rates, {len(dense)} daily rows")
+    return {"rates": len(new_points), "daily": len(dense)}
+
+
+def recompute_payment_amounts(
+        session: Session,
+        currency: str,
+        start_date: datetime.date,
+        end_date: datetime.date,
+        after_id: int = 0,
+        chunk_size: int = RECOMPUTE_CHUNK_SIZE,
+        progress: Callable[[int, int], None] | None = None,
+) -> dict:
+    """
+    Перераховує amount = currency_amount * курс дня та exchange_rate для платежів у currency
+    з start_date (включно) по end_date (не включно), чий збережений курс не збігається з курсом
+    spr_exchange_rates_daily (після виправлення курсу викликати refresh_daily_rates за той самий період).
+    Платежі без записаного курсу (exchange_rate NULL або 1.0) та з сумою від банку
+    (RECOMPUTE_BANK_AMOUNT_SOURCES) не змінюються.
+    Пачки по chunk_size у порядку id, кожна - один SELECT, один UPDATE з join та власний commit
+    (rollup, версії та кеш оновлюються listeners при commit). Відновлюється з after_id;
+    вже перераховані платежі повторно не вибираються, тож перезапуск з нуля теж безпечний.
+    progress(перераховано, останній id) викликається після кожної пачки
+    """
+    update_statement = _recompute_update_statements[
+        'sqlite' if session.get_bind().dialect.name == 'sqlite' else 'mysql'
+    ]
+    params = {
+        "currency": currency,
+        "start_date": f"{start_date:%Y-%m-%d}",
+        "end_date": f"{end_date:%Y-%m-%d}",
+        "epsilon": RECOMPUTE_RATE_EPSILON,
+        "bank_amount_sources": list(RECOMPUTE_BANK_AMOUNT_SOURCES),
+        "chunk_size": chunk_size,
+    }
+    done = 0
+    while True:
+        rows = session.execute(_recompute_select_statement, {**params, "after_id": after_id}).fetchall()
+        if not rows:
+            break
+        try:
+            # UPDATE йде повз ORM - місяці для rollup позначаємо вручну
+            mark_rollup_buckets(session, ((row.user_id, row.rdate) for row in rows))
+            session.execute(update_statement, {"ids": [row.id for row in rows]})
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        done += len(rows)
+        after_id = rows[-1].id
+        logger.info(f"Recomputed {currency} amounts: {done} payments, last id {after_id}")
+        if progress:
+            progress(done, after_id)
+        if len(rows) < chunk_size:
+            break
+
+    return {"recomputed": done, "last_id": after_id}
+
+
+class PrivatRatesClient:
+    """
+    Клієнт публічного API курсів ПриватБанку.
+    http - requests.Session або сумісний об'єкт (get/post), url - для локальної заглушки API
+    """
+
+    def __init__(self, url: str = PRIVAT_RATES_URL, http=None, timeout: float = 10):
+        self.url = url
+        self.http = http or requests.Session()
+        self.timeout = timeout
+
+    def fetch(self) -> list[dict]:
+        response = self.http.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def fetch_rates_with_retry(
+        client: PrivatRatesClient,
+        attempts: int = RATES_FETCH_ATTEMPTS,
+        backoff: float = RATES_FETCH_BACKOFF,
+        sleep: Callable[[float], None] = time.sleep,
+) -> list[dict]:
+    """
+    Курси з API з повторами: затримка backoff, 2*backoff, 4*backoff... між спробами
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return client.fetch()
+        except (requests.RequestException, ValueError) as err:
+            if attempt >= attempts:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Exchange rates fetch failed (attempt {attempt}/{attempts}): {err}, retry in {delay}s")
+            sleep(delay)
+
+
+def _parse_rates(rates_from_api: Iterable[dict]) -> list[dict]:
+    rows = []
+    for rate in rates_from_api:
+        try:
+            rows.append({
+                "currency": rate["ccy"],
+                "base_currency": rate["base_ccy"],
+                "saleRate": float(rate["sale"]),
+                "purchaseRate": float(rate["buy"]),
+            })
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"Skip invalid exchange rate: {rate}")
+    return rows
+
+
+def _latest_rates(session: Session, keys: set[tuple[str, str]]) -> dict[tuple[str, str], SprExchangeRates]:
+    """
+    Останній курс для кожної пари (валюта, базова валюта) одним запитом
+    """
+    latest = session.query(
+        SprExchangeRates.currency, SprExchangeRates.base_currency, func.max(SprExchangeRates.rdate).label("rdate")
+    ).filter(
+        SprExchangeRates.currency.in_({currency for currency, _ in keys})
+    ).group_by(SprExchangeRates.currency, SprExchangeRates.base_currency).subquery()
+    rows = session.query(SprExchangeRates).join(latest, and_(
+        SprExchangeRates.currency == latest.c.currency,
+        SprExchangeRates.base_currency == latest.c.base_currency,
+        SprExchangeRates.rdate == latest.c.rdate,
+    )).order_by(SprExchangeRates.id)
+    return {(rate.currency, rate.base_currency): rate for rate in rows}
+
+
+def _rate_change_messages(previous: dict, rows: list[dict]) -> list[str]:
+    messages = []
+    for row in rows:
+        last_rate = previous.get((row["currency"], row["base_currency"]))
+        if last_rate is None:
+            continue
+        for field, title in (("saleRate", "Sale"), ("purchaseRate", "Purchase")):
+            old, new = getattr(last_rate, field), row[field]
+            if old is not None and old != new:
+                change = new - old
+                messages.append(
+                    f"{title} rate change for {row['currency']}:\n"
+                    f" - from {old} to {new} ({'+' if change > 0 else ''}{change:.4f})"
+                )
+    return messages
+
+
+def ingest_rates(session: Session, rates_from_api: Iterable[dict], rdate: datetime.date | None = None) -> list[str]:
+    """
+    Записує курси з API за день rdate одним multi-row upsert (ключ: валюта, базова валюта, rdate),
+    оновлює щоденну таблицю та rollup. Якщо курси не змінились - нічого не пише.
+    Повертає повідомлення про зміну курсів, commit робить викликач
+    """
+    rdate = rdate or datetime.datetime.now(datetime.timezone.utc).date()
+    rows = _parse_rates(rates_from_api)
+    if not rows:
+        return []
+
+    day = datetime.datetime.combine(rdate, datetime.time())
+    previous = _latest_rates(session, {(row["currency"], row["base_currency"]) for row in rows})
+    changed = [
+        row for row in rows
+        if (rate := previous.get((row["currency"], row["base_currency"]))) is None
+        or rate.rdate != day or rate.saleRate != row["saleRate"] or rate.purchaseRate != row["purchaseRate"]
+    ]
+    if not changed:
+        return []
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    values = [{**row, "rdate": day, "source": "pryvat_api", "created": now, "updated": now} for row in changed]
+    if session.get_bind().dialect.name == 'sqlite':
+        stmt = sqlite_insert(SprExchangeRates).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SprExchangeRates.currency, SprExchangeRates.base_currency, SprExchangeRates.rdate],
+            set_={field: getattr(stmt.excluded, field) for field in ("saleRate", "purchaseRate", "updated", "source")},
+        )
+    else:
+        stmt = mysql_insert(SprExchangeRates).values(values)
+        stmt = stmt.on_duplicate_key_update(
+            {field: getattr(stmt.inserted, field) for field in ("saleRate", "purchaseRate", "updated", "source")}
+        )
+    session.execute(stmt)
+    # Upsert йде повз ORM - версію курсів позначаємо вручну
+    mark_data_changed(session, scopes=[RATES_SCOPE])
+    refresh_daily_rates(session, end_date=rdate)
+
+    logger.info(f"Exchange rates ingested: {len(changed)} of {len(rows)} changed")
+    return _rate_change_messages(previous, changed)
+
+
+def _notify_rate_changes(session: Session, http, messages: list[str]):
+    # Повідомлення про зміну курсів - адміністраторам з налаштованим Telegram
+    rows = session.query(Config.user_id, Config.type_data, Config.value_data).join(
+        User, User.id == Config.user_id
+    ).filter(
+        User.is_admin.is_(True),
+        Config.type_data.in_((ConfigTypes.TELEGRAM_TOKEN.value, ConfigTypes.TELEGRAM_CHAT_ID.value)),
+    ).all()
+    settings = {}
+    for user_id, type_data, value_data in rows:
+        settings.setdefault(user_id, {})[type_data] = value_data
+    for user_settings in settings.values():
+        token = user_settings.get(ConfigTypes.TELEGRAM_TOKEN.value)
+        chat_id = user_settings.get(ConfigTypes.TELEGRAM_CHAT_ID.value)
+        if not token or not chat_id:
+            continue
+        try:
+            http.post(
+                f"https://api.telegram.org/bot{token}/sendMessage",
+                json={"chat_id": chat_id, "text": "\n".join(messages), "parse_mode": "Markdown"},
+                timeout=10,
+            )
+        except requests.RequestException as err:
+            logger.error(f"Exchange rates telegram notification failed: {err}")
+
+
+def ingest_rates_job(client: PrivatRatesClient | None = None) -> list[str]:
+    """
+    Один запуск завантаження курсів (фонова задача або CLI): API з повторами, upsert, commit,
+    прогрів курсів у пам'яті процесу. Використовує SessionLocal - поза запитом
+    """
+    client = client or PrivatRatesClient()
+    rates_from_api = fetch_rates_with_retry(client)
+    session = SessionLocal()
+    try:
+        messages = ingest_rates(session, rates_from_api)
+        session.commit()
+        rate_table.refresh(session, force=True)
+        if messages:
+            _notify_rate_changes(session, client.http, messages)
+        return messages
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+async def run_rates_scheduler(client: PrivatRatesClient | None = None, interval: int = RATES_INGEST_INTERVAL):
+    """
+    Фонова задача lifespan: завантажує курси одразу та далі кожні interval секунд.
+    Помилка одного запуску логується і не зупиняє розклад
+    """
+    while True:
+        try:
+            await run_in_threadpool(ingest_rates_job, client)
+        except Exception as err:
+            logger.error(f"Exchange rates ingestion failed: {err}")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    refresh_daily_rates_on_startup()
@@ -0,0 +1,196 @@
+import datetime
+import logging
+from typing import Iterable
+
+from sqlalchemy import bindparam, event, extract
+from sqlalchemy.orm import Session, attributes
+
+from api.funcs import MainSqlShape, build_main_sql, get_main_sql_shape, main_sql_statement
+from api.versions.funcs import mark_data_changed
+from models.models import Payment, PaymentMonthlyRollup
+from mydb import SessionLocal, text
+
+logger = logging.getLogger()
+
+# Валюти, для яких суми зберігаються в payments_monthly_rollup (інші рахуються з payments)
+ROLLUP_CURRENCIES = ("UAH", "EUR", "USD")
+
+# Представлення, суми яких залежать від курсів (перераховуються при зміні курсів)
+ROLLUP_RATE_CURRENCIES = tuple(currency for currency in ROLLUP_CURRENCIES if currency != "UAH")
+
+# Межа "без кінця" для перерахунку: основний запит без end_date обрізає платежі поточним місяцем,
+# а rollup має покривати й платежі з майбутніми датами
+ROLLUP_MAX_DATE = datetime.date(9999, 12, 1)
+
+# Ключ у session.info з набором (user_id, year, month), які треба перерахувати перед commit
+ROLLUP_BUCKETS_KEY = "payments_rollup_buckets"
+
+
+@main_sql_statement
+def _rollup_insert_statement(shape: MainSqlShape) -> str:
+    # Ті самі правила, що й у статистиці (основний запит), згруповані по власнику, місяцю та кореню категорії
+    return f"""
+    INSERT INTO payments_monthly_rollup (user_id, `year`, `month`, root_category_id, currency_view, amount_sum, cnt, created)
+    SELECT p.user_id, YEAR(p.rdate), MONTH(p.rdate), r.id, :currency, SUM(p.amount), COUNT(*), CURRENT_TIMESTAMP
+    FROM ({build_main_sql(shape)}) p
+    LEFT JOIN (
+        category_closure cc
+        JOIN categories r ON r.id = cc.ancestor_id AND r.parent_id = 0
+    ) ON cc.descendant_id = p.category_id
+    GROUP BY p.user_id, YEAR(p.rdate), MONTH(p.rdate), r.id
+    """
+
+
+_rollup_delete_statement = text("""
+DELETE FROM payments_monthly_rollup
+WHERE user_id = :user_id
+AND `year` * 100 + `month` >= :from_period
+AND `year` * 100 + `month` < :to_period
+AND currency_view IN :currencies
+""").bindparams(bindparam("currencies", expanding=True))
+
+
+def refresh_rollup_range(
+        session: Session,
+        user_id: int,
+        start_date: datetime.date | None = None,
+        end_date: datetime.date | None = None,
+        currencies: Iterable[str] = ROLLUP_CURRENCIES,
+):
+    """
+    Перераховує rollup користувача за місяці з start_date (включно) по end_date (не включно).
+    Дати - перші числа місяців, None - без обмеження; currencies - які представлення перераховувати
+    """
+    currencies = tuple(currencies)
+    # DELETE і INSERT покривають один і той самий діапазон місяців
+    end_date = end_date or ROLLUP_MAX_DATE
+    session.execute(_rollup_delete_statement, {
+        "user_id": user_id,
+        "from_period": start_date.year * 100 + start_date.month if start_date else 0,
+        "to_period": end_date.year * 100 + end_date.month,
+        "currencies": currencies,
+    })
+    for currency in currencies:
+        data = {
+            "user_id": user_id,
+            "member_ids": [user_id],
+            "group_id": None,
+            "currency": currency,
+            "start_date": f"{start_date:%Y-%m-%d}" if start_date else None,
+            "end_date": f"{end_date:%Y-%m-%d}",
+        }
+        session.execute(_rollup_insert_statement(get_main_sql_shape(data)), data)
+
+
+def refresh_rollup_buckets(session: Session, buckets: Iterable[tuple[int, int, int]]):
+    for user_id, year, month in sorted(buckets):
+        start_date = datetime.date(year, month, 1)
+        end_date = datetime.date(year + month // 12, month % 12 + 1, 1)
+        refresh_rollup_range(session, user_id, start_date, end_date)
+
+
+def rebuild_payments_rollup(
+        session: Session,
+        user_id: int | None = None,
+        start_date: datetime.date | None = None,
+        end_date: datetime.date | None = None,
+        currencies: Iterable[str] = ROLLUP_CURRENCIES,
+) -> int:
+    """
+    Повна (або за місяці start_date..end_date, end_date не включно) перебудова rollup -
+    бекфіл і виправлення розбіжностей. Commit робить викликач. Повертає кількість перерахованих користувачів
+    """
+    if start_date:
+        start_date = start_date.replace(day=1)
+    currencies = tuple(currencies)
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        user_ids = [row[0] for row in session.query(Payment.user_id).distinct() if row[0] is not None]
+    for uid in user_ids:
+        refresh_rollup_range(session, uid, start_date, end_date, currencies)
+    logger.info(f"Payments rollup rebuilt for {len(user_ids)} users from {start_date or 'the beginning'}")
+    return len(user_ids)
+
+
+def _period_of(rdate) -> tuple[int, int]:
+    if isinstance(rdate, str):
+        rdate = datetime.date.fromisoformat(rdate[:10])
+    return rdate.year, rdate.month
+
+
+def mark_rollup_buckets(session: Session, rows: Iterable[tuple]):
+    """
+    Позначає місяці (user_id, rdate) для перерахунку при commit.
+    Для записів повз ORM (bulk insert, query.update)
+    """
+    buckets = session.info.setdefault(ROLLUP_BUCKETS_KEY, set())
+    user_ids = set()
+    for user_id, rdate in rows:
+        if user_id is None or not rdate:
+            continue
+        buckets.add((int(user_id), *_period_of(rdate)))
+        user_ids.add(user_id)
+    # Ті самі записи повз ORM змінюють і версію даних користувачів (ETag)
+    mark_data_changed(session, user_ids=user_ids)
+
+
+def mark_rollup_payments(session: Session, *criteria):
+    """
+    Позначає місяці всіх платежів, що підпадають під criteria (викликати до масового UPDATE)
+    """
+    rows = session.query(
+        Payment.user_id, extract('year', Payment.rdate), extract('month', Payment.rdate)
+    ).filter(*criteria).distinct().all()
+    buckets = session.info.setdefault(ROLLUP_BUCKETS_KEY, set())
+    buckets.update((int(u), int(y), int(m)) for u, y, m in rows if u is not None and y is not None)
+    mark_data_changed(session, user_ids={u for u, _, _ in rows})
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_rollup_buckets(session, flush_context, instances):
+    rows = []
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, Payment):
+            continue
+        rows.append((obj.user_id, obj.rdate))
+        # Платіж перенесли в інший місяць або іншому користувачу - старий місяць теж змінився
+        old_user = attributes.get_history(obj, "user_id").deleted
+        old_rdate = attributes.get_history(obj, "rdate").deleted
+        if old_user or old_rdate:
+            rows.append((old_user[0] if old_user else obj.user_id, old_rdate[0] if old_rdate else obj.rdate))
+    if rows:
+        mark_rollup_buckets(session, rows)
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_rollup_before_commit(session):
+    # flush, щоб before_flush зібрав ще не записані зміни платежів
+    session.flush()
+    buckets = session.info.pop(ROLLUP_BUCKETS_KEY, None)
+    if buckets:
+        refresh_rollup_buckets(session, buckets)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rollup_buckets(session):
+    session.info.pop(ROLLUP_BUCKETS_KEY, None)
+
+
+def ensure_payments_rollup_on_startup() -> bool:
+    """
+    Заповнює порожній rollup при старті (lifespan), наприклад одразу після міграції.
+    Використовує SessionLocal, бо middleware fastapi_sqlalchemy ще не ініціалізований
+    """
+    session = SessionLocal()
+    try:
+        if session.query(PaymentMonthlyRollup.id).first() or not session.query(Payment.id).first():
+            return False
+        rebuild_payments_rollup(session)
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
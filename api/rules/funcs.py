@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from sqlalchemy import and_, event
+from sqlalchemy.orm import Session, attributes
+
+from api.config.schemas import ConfigTypes
+from models.models import Category, Config
+
+logger = logging.getLogger()
+
+# Категорія для описів без правила і без категорії з такою назвою
+DEFAULT_CATEGORY_ID = 17  # Інші
+
+# Скільки секунд живе скомпільований набір правил (зміни з інших процесів, напр. скриптів)
+USER_RULES_TTL = 300
+
+# Ключ у session.info з користувачами, правила або категорії яких змінились - скидаються після commit
+RULES_CHANGED_KEY = "user_rules_changed"
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо-Корасік: усі входження набору рядків за один прохід тексту.
+    Порожній рядок (str.find("") == 0) входить у будь-який текст
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        self._always: list[int] = []
+        self.patterns = list(patterns)
+        for index, pattern in enumerate(self.patterns):
+            if pattern == "":
+                self._always.append(index)
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(index)
+
+        # Суфіксні посилання в ширину; виходи стану доповнюються виходами його суфікса
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def matches(self, text: str) -> set[int]:
+        """
+        Індекси шаблонів, що входять у text
+        """
+        found = set(self._always)
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+def _fold(value: str) -> str:
+    # Порівняння як у MySQL *_ai_ci: без регістру та діакритики
+    return "".join(
+        char for char in unicodedata.normalize("NFKD", value) if not unicodedata.combining(char)
+    ).casefold()
+
+
+def _query_category_id(session: Session, user_id: int, category_name: str) -> int:
+    category = session.query(Category).filter(
+        and_(
+            Category.name.like(f'%{category_name}%'), Category.user_id == user_id, Category.parent_id == 0, )
+    ).one_or_none()
+    return category.id if category else DEFAULT_CATEGORY_ID
+
+
+@dataclass
+class _ReplaceRule:
+    position: int
+    category_id: int
+    pattern: int  # індекс value_data.strip() в автоматі (імпорт виписок)
+    raw_pattern: int  # індекс value_data в автоматі (моно)
+
+
+@dataclass
+class UserRuleSet:
+    """
+    Скомпільовані правила користувача (CATEGORY_REPLACE, IS_DELETED_BY_DESCRIPTION) та його
+    кореневі категорії. Правила перевіряються одним проходом автомата по опису; як і раніше,
+    спрацьовує перше за порядком правило категорії, а позначка видалення - лише від правил до нього
+    """
+    user_id: int
+    replace_rules: list[_ReplaceRule] = field(default_factory=list)
+    delete_rules: list[tuple[int, str, int]] = field(default_factory=list)  # (позиція, value_data, індекс в автоматі)
+    categories: list[tuple[int, str]] = field(default_factory=list)  # (id, назва для порівняння)
+    automaton: AhoCorasick | None = None
+    compiled_at: float = 0.0
+
+    @classmethod
+    def compile(cls, session: Session, user_id: int) -> "UserRuleSet":
+        # Порядок унікального індексу (user_id, type_data, value_data) - у ньому user.config
+        # перебирався раніше: правила категорій за value_data, потім правила видалення
+        rows = session.query(Config.type_data, Config.value_data, Config.add_value).filter(
+            Config.user_id == user_id,
+            Config.type_data.in_((ConfigTypes.CATEGORY_REPLACE.value, ConfigTypes.IS_DELETED_BY_DESCRIPTION.value)),
+        ).order_by(Config.type_data, Config.value_data).all()
+
+        patterns: dict[str, int] = {}
+
+        def pattern_index(value: str) -> int:
+            return patterns.setdefault(value, len(patterns))
+
+        rules = cls(user_id=user_id)
+        for position, (type_data, value_data, add_value) in enumerate(rows):
+            if value_data is None:
+                continue
+            if type_data == ConfigTypes.IS_DELETED_BY_DESCRIPTION.value:
+                rules.delete_rules.append((position, value_data, pattern_index(value_data)))
+            elif add_value:
+                try:
+                    category_id = int(add_value)
+                except ValueError as err:
+                    logging.warning(f'can not set category id for cat: {add_value=}, {err}')
+                    continue
+                rules.replace_rules.append(_ReplaceRule(
+                    position, category_id, pattern_index(value_data.strip()), pattern_index(value_data)
+                ))
+
+        rules.categories = [
+            (category_id, _fold(name or ""))
+            for category_id, name in session.query(Category.id, Category.name).filter(
+                Category.user_id == user_id, Category.parent_id == 0
+            )
+        ]
+        rules.automaton = AhoCorasick(patterns)
+        rules.compiled_at = time.monotonic()
+        return rules
+
+    def _first_replace(self, matched: set[int], raw: bool) -> _ReplaceRule | None:
+        for rule in self.replace_rules:
+            if (rule.raw_pattern if raw else rule.pattern) in matched:
+                return rule
+        return None
+
+    def find_category(self, description: str) -> tuple[int | None, bool]:
+        """
+        Правила для імпорту виписок: видалення - точний збіг опису, категорія - входження value_data.strip().
+        Повертає (category_id або None, is_deleted)
+        """
+        rule = self._first_replace(self.automaton.matches(description), raw=False)
+        limit = rule.position if rule else float("inf")
+        is_deleted = any(position < limit and value == description for position, value, _ in self.delete_rules)
+        return (rule.category_id if rule else None), (1 if is_deleted else False)
+
+    def mono_category(self, description: str) -> tuple[int | None, int]:
+        """
+        Правила для моно: видалення і категорія - входження value_data в опис
+        """
+        matched = self.automaton.matches(description)
+        rule = self._first_replace(matched, raw=True)
+        limit = rule.position if rule else float("inf")
+        is_deleted = any(position < limit and pattern in matched for position, _, pattern in self.delete_rules)
+        return (rule.category_id if rule else None), (1 if is_deleted else 0)
+
+    def category_id(self, session: Session, category_name: str) -> int:
+        """
+        Коренева категорія, назва якої містить category_name (як `name LIKE '%...%'`), інакше DEFAULT_CATEGORY_ID.
+        Кілька збігів чи символи шаблону LIKE - звичайний запит до БД, щоб поведінка не змінилась
+        """
+        if "%" in category_name or "_" in category_name:
+            return _query_category_id(session, self.user_id, category_name)
+        needle = _fold(category_name)
+        found = [category_id for category_id, name in self.categories if needle in name]
+        if len(found) > 1:
+            return _query_category_id(session, self.user_id, category_name)
+        return found[0] if found else DEFAULT_CATEGORY_ID
+
+
+class UserRulesCache:
+    """
+    Скомпільовані UserRuleSet по користувачах. Скидається після commit, що змінює
+    config або категорії користувача, і за USER_RULES_TTL
+    """
+
+    def __init__(self, ttl: int = USER_RULES_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rules: dict[int, UserRuleSet] = {}
+        self.compiles = 0
+
+    def get(self, session: Session, user_id: int) -> UserRuleSet:
+        rules = self._rules.get(user_id)
+        if rules is None or time.monotonic() - rules.compiled_at > self.ttl:
+            rules = UserRuleSet.compile(session, user_id)
+            with self._lock:
+                self._rules[user_id] = rules
+                self.compiles += 1
+        return rules
+
+    def invalidate(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                self._rules.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._rules.clear()
+
+
+user_rules = UserRulesCache()
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_rules_owners(session, flush_context, instances):
+    owners = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Config, Category)):
+            owners.update([obj.user_id, *attributes.get_history(obj, "user_id").deleted])
+    owners.discard(None)
+    if owners:
+        session.info.setdefault(RULES_CHANGED_KEY, set()).update(owners)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_user_rules(session):
+    owners = session.info.pop(RULES_CHANGED_KEY, None)
+    if owners:
+        user_rules.invalidate(owners)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rules_owners(session):
+    session.info.pop(RULES_CHANGED_KEY, None)
@@ -3,90 +3,31 @@ import logging
 import io
 from typing import Any, List, Dict, Optional
 
-from fastapi import HTTPException, UploadFile, status
-from pandas import read_csv, read_excel
+from fastapi import HTTPException, status
+from pandas import DataFrame, read_csv, read_excel
 
-from api.core.funcs import p24_to_pmt
-from api.core.revolut.funcs import revolut_to_pmt
-from api.core.wise.funcs import wise_to_pmt
+from api.core.funcs import ImportContext, p24_frame_to_payments
+from api.core.revolut.funcs import revolut_frame_to_payments
+from api.core.wise.funcs import wise_frame_to_payments
 from api.core.pumb.funcs import parse_pumb_pdf, pumb_to_pmt
 from api.core.erste.funcs import parse_erste_pdf, erste_to_pmt
 from api.core.raiffeisen.funcs import parse_raiffeisen_csv, raiffeisen_to_pmt
-from api.funcs import add_bulk_payments
-from api.mono.funcs import add_new_payment
-from models import User
-from mydb import db
 
 logger = logging.getLogger()
 
 
-async def bank_import(user: User, bank: str, file: UploadFile, action: str = "import"):
+def parse_statement(bank: str, filename: str, file_content: bytes) -> List[Dict[str, Any]] | DataFrame:
     """
-    Імпорт даних з банківських виписок
+    Розбирає завантажений файл без звернень до БД (виконується в процесі пулу парсингу)
 
     Параметри:
-        user_id: ID користувача
-        bank: Назва банку ("wise", "mono", "revolut", "p24", "pumb", "erste", "raiffeisen")
-        file: Завантажений файл через FastAPI UploadFile
-        action: Дія - "show" для попереднього перегляду або "import" для імпорту даних
-    """
-    if not file:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Файл не знайдено в запиті')
-
-    if file.filename == '':
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Не вказано імя файлу')
-
-    try:
-        # Зчитуємо вміст файлу
-        file_content = await file.read()
-
-        # Перетворюємо дані
-        data_ = await convert_file_to_data(user, file_content, file.filename, bank)
-
-        if not data_:
-            logger.error(f"Невалідні дані у файлі {file.filename} для банку {bank}. Отримано порожній результат", exc_info=True)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Невалідні дані у файлі")
-
-        if action == 'show':
-            return data_
-
-        if action == 'import':
-            result = add_bulk_payments(data_)
-            if result:
-                for pmt_row in data_:
-                    pmt_row['sql'] = True
-            else:
-                for pmt_row in data_:
-                    result = add_new_payment(pmt_row)
-                    if result:
-                        pmt_row['sql'] = True
-                    else:
-                        pmt_row['sql'] = False
-        return data_
-    except HTTPException:
-        # Передаємо HTTPException без змін
-        raise
-    except Exception as err:
-        from sqlalchemy.exc import IntegrityError
-        # Дозволяємо IntegrityError пройти до глобального обробника
-        if isinstance(err, IntegrityError):
-            raise err
-        logger.error(f'Помилка при імпорті даних: {err}', exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Помилка при імпорті файлу: {str(err)}")
-
-
-async def convert_file_to_data(user: User, file_content: bytes, filename: str, bank: str) -> List[Dict[str, Any]]:
-    """
-    Перетворює завантажений файл на дані платежів
-
-    Параметри:
-        user: Об'єкт користувача
-        file_content: Вміст файлу в бінарному форматі
-        filename: Ім'я файлу
         bank: Назва банку
+        filename: Ім'я файлу
+        file_content: Вміст файлу в бінарному форматі
+
+    Повертає транзакції (PDF, CSV Raiffeisen) або DataFrame виписки (xls, csv)
     """
-    logger.info(f"Converting file {filename} for bank {bank}, file size: {len(file_content)} bytes")
-    data = []
+    logger.info(f"Parsing file {filename} for bank {bank}, file size: {len(file_content)} bytes")
 
     # Обробка PDF файлів PUMB
     if bank == 'pumb':
@@ -95,16 +36,7 @@ async def convert_file_to_data(user: User, file_content: bytes, filename: str, b
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Для PUMB банку підтримуються тільки PDF файли'
             )
-        
-        # Парсимо PDF та конвертуємо транзакції
-        transactions = parse_pumb_pdf(file_content)
-        
-        for transaction in transactions:
-            pmt = pumb_to_pmt(user, transaction)
-            if pmt:
-                data.append(pmt.model_dump())
-        
-        return data
+        return parse_pumb_pdf(file_content)
 
     # Обробка PDF файлів Erste Bank
     if bank == 'erste':
@@ -113,16 +45,7 @@ async def convert_file_to_data(user: User, file_content: bytes, filename: str, b
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Для Erste Bank підтримуються тільки PDF файли'
             )
-        
-        # Парсимо PDF та конвертуємо транзакції
-        transactions = parse_erste_pdf(file_content)
-        
-        for transaction in transactions:
-            pmt = erste_to_pmt(user, transaction)
-            if pmt:
-                data.append(pmt.model_dump())
-        
-        return data
+        return parse_erste_pdf(file_content)
 
     # Обробка CSV файлів Raiffeisen Bank
     if bank == 'raiffeisen':
@@ -145,7 +68,7 @@ async def convert_file_to_data(user: User, file_content: bytes, filename: str, b
                     detail='Невалідні дані у файлі'
                 )
 
-        # Парсимо CSV та конвертуємо транзакції
+        # Парсимо CSV
         try:
             transactions = parse_raiffeisen_csv(file_content_str)
             logger.info(f"Parsed {len(transactions)} transactions from Raiffeisen CSV")
@@ -155,22 +78,7 @@ async def convert_file_to_data(user: User, file_content: bytes, filename: str, b
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Невалідні дані у файлі'
             )
-
-        for i, transaction in enumerate(transactions):
-            try:
-                pmt = raiffeisen_to_pmt(user, transaction)
-                if pmt:
-                    data.append(pmt.model_dump())
-                    logger.debug(f"Successfully converted transaction {i+1}: {transaction['description']}")
-                else:
-                    logger.debug(f"Skipped transaction {i+1}: {transaction['description']} (amount: {transaction['amount_uah']})")
-            except Exception as e:
-                logger.error(f"Error converting Raiffeisen transaction {i+1}: {e}", exc_info=True)
-                continue
-
-        logger.info(f"Converted {len(data)} transactions out of {len(transactions)} parsed")
-
-        return data
+        return transactions
 
     # Створюємо об'єкт для читання файлу
     file_obj = io.BytesIO(file_content)
@@ -196,31 +104,62 @@ async def convert_file_to_data(user: User, file_content: bytes, filename: str, b
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f'Файл {filename} порожній'
         )
+    return df
 
-    for _, row in df.iterrows():
-        pmt = None
-        # Обробляємо дані залежно від банку
-        match bank:
-            case 'revolut':
-                pmt = revolut_to_pmt(user, row)
-            case 'wise':
-                pmt = wise_to_pmt(user, row)
-            case 'p24':
-                pmt = p24_to_pmt(user, row)
-            case 'pumb':
-                # PUMB обробляється окремо вище
-                continue
-            case 'erste':
-                # Erste обробляється окремо вище
-                continue
-            case 'raiffeisen':
-                # Raiffeisen обробляється окремо вище
+
+def convert_statement(context: ImportContext, bank: str, parsed: List[Dict[str, Any]] | DataFrame) -> List[Dict[str, Any]]:
+    """
+    Перетворює результат parse_statement на дані платежів (категорії, курси - з контексту імпорту)
+    """
+    data = []
+
+    if bank == 'pumb':
+        for transaction in parsed:
+            pmt = pumb_to_pmt(context, transaction)
+            if pmt:
+                data.append(pmt.model_dump())
+        return data
+
+    if bank == 'erste':
+        context.prefetch_rates(["EUR"], [transaction['date'] for transaction in parsed])
+        for transaction in parsed:
+            pmt = erste_to_pmt(context, transaction)
+            if pmt:
+                data.append(pmt.model_dump())
+        return data
+
+    if bank == 'raiffeisen':
+        transactions = parsed
+        context.prefetch_rates(
+            [transaction['currency'] for transaction in transactions],
+            [transaction['date'] for transaction in transactions],
+        )
+        for i, transaction in enumerate(transactions):
+            try:
+                pmt = raiffeisen_to_pmt(context, transaction)
+                if pmt:
+                    data.append(pmt.model_dump())
+                    logger.debug(f"Successfully converted transaction {i+1}: {transaction['description']}")
+                else:
+                    logger.debug(f"Skipped transaction {i+1}: {transaction['description']} (amount: {transaction['amount_uah']})")
+            except Exception as e:
+                logger.error(f"Error converting Raiffeisen transaction {i+1}: {e}", exc_info=True)
                 continue
-            case _:
-                logger.warning(f"Непідтримуваний банк: {bank}")
-                pmt = None
 
-        if pmt:
-            data.append(pmt.model_dump())
+        logger.info(f"Converted {len(data)} transactions out of {len(transactions)} parsed")
+
+        return data
+
+    df = parsed
+    # Вся виписка конвертується операціями над колонками та валідується одним викликом
+    match bank:
+        case 'revolut':
+            data = revolut_frame_to_payments(context, df)
+        case 'wise':
+            data = wise_frame_to_payments(context, df)
+        case 'p24':
+            data = p24_frame_to_payments(context, df)
+        case _:
+            logger.warning(f"Непідтримуваний банк: {bank}")
 
     return data
@@ -23,7 +23,7 @@ from api.schemas.common import (
     UtilityReadingCreate, UtilityReadingUpdate, UtilityReadingResponse,
     GroupedReadingsResponse, LatestPeriodResponse
 )
-from dependencies import get_current_user
+from dependencies import get_current_user, utilities_etag
 from models.models import User
 import logging
 
@@ -333,7 +333,11 @@ async def get_latest_period_with_readings_endpoint(
     return {"period": period or datetime.now().strftime("%Y-%m")}
 
 
-@router.get("/api/utilities/grouped-readings", response_model=GroupedReadingsResponse)
+@router.get(
+    "/api/utilities/grouped-readings",
+    response_model=GroupedReadingsResponse,
+    dependencies=[Depends(utilities_etag)],
+)
 async def get_grouped_readings_endpoint(
     address_id: int = Query(..., description="ID адреси"),
     period: str = Query(None, description="Період у форматі YYYY-MM"),
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+from typing import Iterable
+
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, attributes
+
+from models.models import (
+    DataVersion, Group, SprExchangeRates, SprExchangeRatesDaily, User, UtilityService, UtilityTariff,
+)
+
+logger = logging.getLogger()
+
+# Ключ у session.info з набором scope, версії яких треба збільшити при commit
+DATA_VERSIONS_KEY = "data_versions_scopes"
+
+# Глобальний scope курсів валют - від нього залежать суми в EUR/USD
+RATES_SCOPE = "rates"
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def group_scope(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+def mark_data_changed(
+        session: Session,
+        user_ids: Iterable[int] = (),
+        group_ids: Iterable[int] = (),
+        scopes: Iterable[str] = (),
+):
+    """
+    Позначає scope, версії яких збільшаться при commit.
+    ORM зміни позначаються автоматично, викликати для записів повз ORM
+    """
+    marked = session.info.setdefault(DATA_VERSIONS_KEY, set())
+    marked.update(user_scope(int(user_id)) for user_id in user_ids if user_id is not None)
+    marked.update(group_scope(int(group_id)) for group_id in group_ids if group_id is not None)
+    marked.update(scopes)
+
+
+def _object_scopes(session: Session, obj) -> Iterable[str]:
+    if isinstance(obj, DataVersion):
+        return
+    if isinstance(obj, User):
+        yield user_scope(obj.id)
+    if isinstance(obj, Group):
+        yield group_scope(obj.id)
+    if isinstance(obj, (SprExchangeRates, SprExchangeRatesDaily)):
+        yield RATES_SCOPE
+    if isinstance(obj, UtilityTariff):
+        # Тариф належить користувачу через службу
+        service = session.get(UtilityService, obj.service_id) if obj.service_id else None
+        if service is not None:
+            yield user_scope(service.user_id)
+
+    for field, scope in (("user_id", user_scope), ("group_id", group_scope)):
+        if not hasattr(obj, field):
+            continue
+        # Старе значення теж: запис переданий іншому користувачу змінює дані обох
+        values = [getattr(obj, field), *attributes.get_history(obj, field).deleted]
+        yield from (scope(value) for value in values if value is not None)
+
+
+def bump_data_versions(session: Session, scopes: Iterable[str]):
+    """
+    Збільшує версії scope одним upsert (відсутні створюються з версією 1)
+    """
+    rows = [{"scope": scope, "version": 1} for scope in sorted(set(scopes))]
+    if not rows:
+        return
+    if session.get_bind().dialect.name == 'sqlite':
+        stmt = sqlite_insert(DataVersion).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DataVersion.scope], set_={"version": DataVersion.version + 1}
+        )
+    else:
+        stmt = mysql_insert(DataVersion).values(rows)
+        stmt = stmt.on_duplicate_key_update(version=DataVersion.version + 1)
+    session.execute(stmt)
+
+
+def get_data_versions(session: Session, scopes: Iterable[str]) -> dict[str, int]:
+    scopes = list(scopes)
+    rows = session.query(DataVersion.scope, DataVersion.version).filter(DataVersion.scope.in_(scopes))
+    return {scope: version for scope, version in rows}
+
+
+def make_data_etag(session: Session, key: str, scopes: Iterable[str]) -> str:
+    """
+    Сильний ETag з версій scope: змінюється при будь-якому commit, що зачіпає ці дані
+    """
+    scopes = sorted(set(scopes))
+    versions = get_data_versions(session, scopes)
+    state = "|".join([key, *(f"{scope}={versions.get(scope, 0)}" for scope in scopes)])
+    return f'"{hashlib.sha1(state.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match порівнюється слабко, тож W/"..." теж збігається
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_data_scopes(session, flush_context, instances):
+    scopes = set()
+    with session.no_autoflush:
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            scopes.update(_object_scopes(session, obj))
+    if scopes:
+        mark_data_changed(session, scopes=scopes)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_data_versions_before_commit(session):
+    # flush, щоб before_flush зібрав ще не записані зміни
+    session.flush()
+    scopes = session.info.pop(DATA_VERSIONS_KEY, None)
+    if scopes:
+        bump_data_versions(session, scopes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_data_scopes(session):
+    session.info.pop(DATA_VERSIONS_KEY, None)
@@ -12,6 +12,28 @@ SQLALCHEMY_DATABASE_URI = environ["DATABASE_URI"]
 MONO_API_URL = "https://api.monobank.ua"
 DEBUG = environ.get("DEBUG", "False").lower() in ("true", "1", "t")
 
+# In-process кеш агрегатів (api.cache.funcs): час життя запису, кількість записів і пам'ять
+AGGREGATE_CACHE_TTL = int(environ.get("AGGREGATE_CACHE_TTL", 300))
+AGGREGATE_CACHE_MAX_ENTRIES = int(environ.get("AGGREGATE_CACHE_MAX_ENTRIES", 2048))
+AGGREGATE_CACHE_MAX_BYTES = int(environ.get("AGGREGATE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# Курси валют в пам'яті (api.rates.funcs.RateTable): як часто звіряти версію курсів, секунд
+RATE_TABLE_CHECK_INTERVAL = int(environ.get("RATE_TABLE_CHECK_INTERVAL", 60))
+
+# Завантаження курсів ПриватБанку фоновою задачею (api.rates.services): адреса API, інтервал у секундах,
+# спроби з експоненційною затримкою
+PRIVAT_RATES_URL = environ.get("PRIVAT_RATES_URL", "https://api.privatbank.ua/p24api/pubinfo?exchange&json&coursid=11")
+RATES_INGEST_ENABLED = environ.get("RATES_INGEST_ENABLED", "True").lower() in ("true", "1", "t")
+RATES_INGEST_INTERVAL = int(environ.get("RATES_INGEST_INTERVAL", 3600))
+RATES_FETCH_ATTEMPTS = int(environ.get("RATES_FETCH_ATTEMPTS", 4))
+RATES_FETCH_BACKOFF = float(environ.get("RATES_FETCH_BACKOFF", 2.0))
+
+# Фонові задачі імпорту виписок (api.imports.funcs): процеси для парсингу файлів, потоки для запису в БД,
+# скільки платежів записувати за один commit
+IMPORT_PARSE_WORKERS = int(environ.get("IMPORT_PARSE_WORKERS", 2))
+IMPORT_WRITE_WORKERS = int(environ.get("IMPORT_WRITE_WORKERS", 2))
+IMPORT_SAVE_CHUNK_SIZE = int(environ.get("IMPORT_SAVE_CHUNK_SIZE", 500))
+
 logger_config = {
     "version": 1,
     "formatters": {
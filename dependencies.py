@@ -1,5 +1,6 @@
-from fastapi import Depends, HTTPException, status, Header, Security
+from fastapi import Depends, HTTPException, status, Header, Request, Response, Security
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
+from datetime import datetime
 from typing import Optional
 import logging
 import traceback
@@ -8,6 +9,7 @@ from sqlalchemy.orm import Session
 from mydb import get_db
 from models.models import User
 from app.auth.jwt import decode_token
+from api.versions.funcs import RATES_SCOPE, etag_matches, group_scope, make_data_etag, user_scope
 
 logger = logging.getLogger(__name__)
 
@@ -111,3 +113,56 @@ async def get_current_user(token: str = Depends(get_token), db: Session = Depend
             detail="Недійсний токен або помилка аутентифікації",
             headers={"WWW-Authenticate": "Bearer"}
         )
+
+
+async def get_group_membership(current_user: User = Depends(get_current_user)):
+    """
+    Членство поточного користувача в групі (GroupMembership).
+    FastAPI кешує залежність в межах запиту, тож група та її учасники визначаються один раз
+    """
+    from api.groups.services import resolve_group_membership
+
+    return resolve_group_membership(current_user.id)
+
+
+def data_etag(members: bool = False, group: bool = False, rates: bool = False, dated: bool = False):
+    """
+    Залежність для GET ендпоінтів: ETag з версій даних користувача (учасників групи, групи, курсів).
+    dated - представлення залежить від поточної дати (поточний місяць за замовчуванням, останні 14 днів,
+    суми до поточного місяця), тож дата входить у ключ і після її зміни старий ETag не збігається.
+    Якщо If-None-Match збігається, відповідає 304 ще до запитів самого ендпоінта
+    """
+    async def check_data_etag(
+        request: Request,
+        response: Response,
+        current_user: User = Depends(get_current_user),
+        membership=Depends(get_group_membership),
+        db: Session = Depends(get_db),
+    ) -> str:
+        scopes = [user_scope(current_user.id)]
+        if members:
+            scopes.extend(user_scope(member_id) for member_id in membership.member_ids)
+        if group and membership.group_id:
+            scopes.append(group_scope(membership.group_id))
+        if rates:
+            scopes.append(RATES_SCOPE)
+
+        # Ключ включає користувача та запит: однакові версії різних представлень не збігаються
+        key = f"{current_user.id}|{request.url.path}?{request.url.query}"
+        if dated:
+            # Та сама дата, від якої рахують get_dates та get_current_end_date
+            key += f"|{datetime.now():%Y-%m-%d}"
+        etag = make_data_etag(db, key, scopes)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        response.headers.update(headers)
+        return etag
+
+    return check_data_etag
+
+
+# Платежі залежать від даних усіх учасників групи, групових категорій, курсів (EUR/USD) та поточної дати
+payments_etag = data_etag(members=True, group=True, rates=True, dated=True)
+categories_etag = data_etag(group=True)
+utilities_etag = data_etag()
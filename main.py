@@ -4,7 +4,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import logging
 
 # Імпортуємо конфігурацію
-from app.config import logger_config, SQLALCHEMY_DATABASE_URI
+from app.config import logger_config, SQLALCHEMY_DATABASE_URI, RATES_INGEST_ENABLED
 from models.models import SprCurrency
 from mydb import db
 from models import *
@@ -16,7 +16,13 @@ logger = logging.getLogger(__name__)
 
 # Запуск на старті через lifespan контекст
 from api.config.funcs import check_and_fill_spr_config_table, check_exsists_table
+from api.rates.services import refresh_daily_rates_on_startup, run_rates_scheduler
+from api.cache.funcs import aggregate_cache
+from api.rollup.funcs import ensure_payments_rollup_on_startup
+from api.categories.funcs import ensure_category_closure_on_startup
+from api.imports.funcs import fail_interrupted_import_jobs, shutdown_import_executors
 from contextlib import asynccontextmanager
+import asyncio
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -51,6 +57,38 @@ async def lifespan(app: FastAPI):
             logger.info("Creating SprCurrency table...")
             SprCurrency.__table__.create(db.engine)
 
+        if not check_exsists_table(DataVersion):
+            logger.info("Creating DataVersion table...")
+            DataVersion.__table__.create(db.engine)
+
+        logger.info("Refreshing daily exchange rates...")
+        if not check_exsists_table(SprExchangeRatesDaily):
+            logger.info("Creating SprExchangeRatesDaily table...")
+            SprExchangeRatesDaily.__table__.create(db.engine)
+        if not check_exsists_table(PaymentMonthlyRollup):
+            logger.info("Creating PaymentMonthlyRollup table...")
+            PaymentMonthlyRollup.__table__.create(db.engine)
+        if not check_exsists_table(ImportJob):
+            logger.info("Creating ImportJob table...")
+            ImportJob.__table__.create(db.engine)
+
+        # Фільтри за категоріями та rollup спираються на category_closure
+        if not check_exsists_table(CategoryClosure):
+            logger.info("Creating CategoryClosure table...")
+            CategoryClosure.__table__.create(db.engine)
+        if ensure_category_closure_on_startup():
+            logger.info("Category closure rebuilt")
+
+        refresh_daily_rates_on_startup()
+
+        interrupted_jobs = fail_interrupted_import_jobs()
+        if interrupted_jobs:
+            logger.warning(f"{interrupted_jobs} import jobs interrupted by restart marked as failed")
+
+        logger.info("Checking payments rollup...")
+        if ensure_payments_rollup_on_startup():
+            logger.info("Payments rollup rebuilt")
+
         logger.info("=" * 80)
         logger.info("✅ Application startup completed successfully!")
         logger.info("=" * 80)
@@ -70,10 +108,17 @@ async def lifespan(app: FastAPI):
         # Re-raise to prevent app from starting in broken state
         raise
 
+    # Курси ПриватБанку завантажуються фоновою задачею процесу (раніше - cron у GitHub Actions)
+    rates_task = asyncio.create_task(run_rates_scheduler()) if RATES_INGEST_ENABLED else None
+
     yield  # Тут виконується програма
 
     # Код для виконання при завершенні
     logger.info("Shutting down FinMan API application...")
+    if rates_task is not None:
+        rates_task.cancel()
+    shutdown_import_executors()
+    logger.info(f"Aggregate cache stats: {aggregate_cache.stats()}")
 
 # Створюємо екземпляр FastAPI з підтримкою OAuth2
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
@@ -108,6 +153,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # DBSessionMiddleware для управління сесіями через ContextVar
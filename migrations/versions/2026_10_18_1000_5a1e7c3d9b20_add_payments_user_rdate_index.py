@@ -0,0 +1,25 @@
+"""Add (user_id, rdate) index on payments
+
+Revision ID: 5a1e7c3d9b20
+Revises: add_currency_indexes
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1e7c3d9b20'
+down_revision = 'add_currency_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Payment scans filter by user_id IN (group members) and an rdate range
+    op.create_index('idx_payments_user_rdate', 'payments', ['user_id', 'rdate'])
+
+
+def downgrade():
+    op.drop_index('idx_payments_user_rdate', table_name='payments')
@@ -0,0 +1,41 @@
+"""Add spr_exchange_rates_daily table
+
+Revision ID: 7c2d4e6f8a10
+Revises: 5a1e7c3d9b20
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2d4e6f8a10'
+down_revision = '5a1e7c3d9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Forward-filled rates, one row per currency per day; populated on app startup
+    op.create_table(
+        'spr_exchange_rates_daily',
+        sa.Column('rdate', sa.Date(), nullable=False, comment='calendar day'),
+        sa.Column('base_currency', sa.String(length=3), nullable=True, comment='UAH'),
+        sa.Column('currency', sa.String(length=3), nullable=False, comment='EUR|USD'),
+        sa.Column('saleRate', mysql.FLOAT(precision=10, scale=5), nullable=True),
+        sa.Column('purchaseRate', mysql.FLOAT(precision=10, scale=5), nullable=True),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_spr_exchange_rates_daily'))
+    )
+    op.create_index(
+        'ix_spr_exchange_rates_daily_currency', 'spr_exchange_rates_daily', ['currency', 'rdate'], unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('ix_spr_exchange_rates_daily_currency', table_name='spr_exchange_rates_daily')
+    op.drop_table('spr_exchange_rates_daily')
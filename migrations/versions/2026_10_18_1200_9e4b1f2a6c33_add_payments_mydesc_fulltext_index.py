@@ -0,0 +1,27 @@
+"""Add FULLTEXT (ngram) index on payments.mydesc
+
+Revision ID: 9e4b1f2a6c33
+Revises: 7c2d4e6f8a10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1f2a6c33'
+down_revision = '7c2d4e6f8a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ngram parser indexes substrings, so merchant names match inside descriptions (Cyrillic included)
+    op.create_index(
+        'ft_payments_mydesc', 'payments', ['mydesc'], mysql_prefix='FULLTEXT', mysql_with_parser='ngram'
+    )
+
+
+def downgrade():
+    op.drop_index('ft_payments_mydesc', table_name='payments')
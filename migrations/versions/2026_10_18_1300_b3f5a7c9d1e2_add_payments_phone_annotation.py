@@ -0,0 +1,33 @@
+"""Add phone / phone_label columns to payments
+
+Revision ID: b3f5a7c9d1e2
+Revises: 9e4b1f2a6c33
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f5a7c9d1e2'
+down_revision = '9e4b1f2a6c33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled on write; existing rows: scripts/backfill_payment_phones.py
+    op.add_column('payments', sa.Column(
+        'phone', sa.String(length=13), nullable=True, comment='normalized phone from mydesc, +380XXXXXXXXX'
+    ))
+    op.add_column('payments', sa.Column(
+        'phone_label', sa.String(length=255), nullable=True, comment="name for phone from owner's phone_to_name config"
+    ))
+    op.create_index('idx_payments_user_phone', 'payments', ['user_id', 'phone'])
+
+
+def downgrade():
+    op.drop_index('idx_payments_user_phone', table_name='payments')
+    op.drop_column('payments', 'phone_label')
+    op.drop_column('payments', 'phone')
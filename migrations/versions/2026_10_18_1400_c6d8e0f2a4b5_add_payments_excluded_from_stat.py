@@ -0,0 +1,37 @@
+"""Add excluded_from_stat flag to payments
+
+Revision ID: c6d8e0f2a4b5
+Revises: b3f5a7c9d1e2
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6d8e0f2a4b5'
+down_revision = 'b3f5a7c9d1e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('payments', sa.Column(
+        'excluded_from_stat', sa.Boolean(), server_default='0', nullable=False,
+        comment="mydesc matches owner's exclude_from_stat"
+    ))
+    op.create_index(
+        'idx_payments_user_excluded_rdate', 'payments', ['user_id', 'excluded_from_stat', 'rdate']
+    )
+    # Initial flags from existing rules
+    op.execute("""
+        UPDATE payments p
+        JOIN config c ON c.user_id = p.user_id AND c.type_data = 'exclude_from_stat' AND c.value_data = p.mydesc
+        SET p.excluded_from_stat = 1
+    """)
+
+
+def downgrade():
+    op.drop_index('idx_payments_user_excluded_rdate', table_name='payments')
+    op.drop_column('payments', 'excluded_from_stat')
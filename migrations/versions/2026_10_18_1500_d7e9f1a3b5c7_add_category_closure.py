@@ -0,0 +1,51 @@
+"""Add category_closure table
+
+Revision ID: d7e9f1a3b5c7
+Revises: c6d8e0f2a4b5
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7e9f1a3b5c7'
+down_revision = 'c6d8e0f2a4b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'category_closure',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False, comment='0 - the category itself'),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_category_closure'))
+    )
+    op.create_index('idx_category_closure_ancestor', 'category_closure', ['ancestor_id', 'descendant_id'], unique=True)
+    op.create_index('idx_category_closure_descendant', 'category_closure', ['descendant_id', 'depth'])
+
+    # Initial fill from categories.parent_id (same as api.categories.funcs.REBUILD_CATEGORY_CLOSURE_SQL)
+    op.execute("""
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM categories
+            UNION ALL
+            SELECT t.ancestor_id, c.id, t.depth + 1
+            FROM tree t
+            JOIN categories c ON c.parent_id = t.descendant_id
+            WHERE t.depth < 20
+        )
+        SELECT ancestor_id, descendant_id, depth FROM tree
+    """)
+
+
+def downgrade():
+    op.drop_index('idx_category_closure_descendant', table_name='category_closure')
+    op.drop_index('idx_category_closure_ancestor', table_name='category_closure')
+    op.drop_table('category_closure')
@@ -0,0 +1,45 @@
+"""Add payments_monthly_rollup table
+
+Revision ID: e8f0a2b4c6d8
+Revises: d7e9f1a3b5c7
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f0a2b4c6d8'
+down_revision = 'd7e9f1a3b5c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled on app startup when empty, or by scripts/rebuild_payments_rollup.py
+    op.create_table(
+        'payments_monthly_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False, comment='payment owner'),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('root_category_id', sa.Integer(), nullable=True,
+                  comment='root (parent_id = 0) category of the payment category'),
+        sa.Column('currency_view', sa.String(length=3), nullable=False,
+                  comment='UAH|EUR|USD - currency amounts are shown in'),
+        sa.Column('amount_sum', sa.Float(), nullable=False),
+        sa.Column('cnt', sa.Integer(), nullable=False),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_payments_monthly_rollup'))
+    )
+    op.create_index(
+        'idx_payments_rollup_key', 'payments_monthly_rollup',
+        ['user_id', 'currency_view', 'year', 'month', 'root_category_id'], unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('idx_payments_rollup_key', table_name='payments_monthly_rollup')
+    op.drop_table('payments_monthly_rollup')
@@ -0,0 +1,36 @@
+"""Add data_versions table
+
+Revision ID: f9a1b3c5d7e9
+Revises: e8f0a2b4c6d8
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9a1b3c5d7e9'
+down_revision = 'e8f0a2b4c6d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Рядки створюються при першому commit, що змінює дані scope (відсутній scope має версію 0)
+    op.create_table(
+        'data_versions',
+        sa.Column('scope', sa.String(length=64), nullable=False, comment='user:<id> | group:<id> | rates'),
+        sa.Column('version', sa.Integer(), nullable=False,
+                  comment='bumped on every commit that changes scope data'),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_data_versions'))
+    )
+    op.create_index('idx_data_versions_scope', 'data_versions', ['scope'], unique=True)
+
+
+def downgrade():
+    op.drop_index('idx_data_versions_scope', table_name='data_versions')
+    op.drop_table('data_versions')
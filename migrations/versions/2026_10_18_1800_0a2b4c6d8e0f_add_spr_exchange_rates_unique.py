@@ -0,0 +1,35 @@
+"""Add unique key on spr_exchange_rates (currency, base_currency, rdate)
+
+Revision ID: 0a2b4c6d8e0f
+Revises: f9a1b3c5d7e9
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0a2b4c6d8e0f'
+down_revision = 'f9a1b3c5d7e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Дублікати курсу на той самий момент: залишаємо останній записаний (найбільший id)
+    op.execute("""
+        DELETE older FROM spr_exchange_rates older
+        JOIN spr_exchange_rates newer
+            ON newer.currency = older.currency
+            AND newer.base_currency = older.base_currency
+            AND newer.rdate = older.rdate
+            AND newer.id > older.id
+    """)
+    # Ключ для multi-row INSERT ... ON DUPLICATE KEY UPDATE при завантаженні курсів
+    op.create_index(
+        'ix_spr_exchange_rates_currency', 'spr_exchange_rates', ['currency', 'base_currency', 'rdate'], unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('ix_spr_exchange_rates_currency', table_name='spr_exchange_rates')
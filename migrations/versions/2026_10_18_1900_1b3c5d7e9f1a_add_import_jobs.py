@@ -0,0 +1,51 @@
+"""Add import_jobs table
+
+Revision ID: 1b3c5d7e9f1a
+Revises: 0a2b4c6d8e0f
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = '1b3c5d7e9f1a'
+down_revision = '0a2b4c6d8e0f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'import_jobs',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('bank', sa.String(length=29), nullable=False,
+                  comment='wise | p24 | revolut | pumb | erste | raiffeisen'),
+        sa.Column('filename', sa.String(length=255), nullable=True),
+        sa.Column('action', sa.String(length=10), nullable=False, comment='show | import'),
+        sa.Column('status', sa.String(length=16), nullable=False,
+                  comment='queued | parsing | converting | saving | done | failed'),
+        sa.Column('total_rows', sa.Integer(), nullable=False),
+        sa.Column('processed_rows', sa.Integer(), nullable=False),
+        sa.Column('created_rows', sa.Integer(), nullable=False),
+        sa.Column('duplicate_rows', sa.Integer(), nullable=False),
+        sa.Column('error_rows', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text().with_variant(mysql.LONGTEXT(), 'mysql'), nullable=True,
+                  comment='JSON: converted payments with sql flag'),
+        sa.Column('started', sa.DateTime(), nullable=True),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_import_jobs_user_id_users')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_import_jobs'))
+    )
+    op.create_index('idx_import_jobs_user', 'import_jobs', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_import_jobs_user', table_name='import_jobs')
+    op.drop_table('import_jobs')
@@ -3,13 +3,18 @@ from .models import (
     SprTypePayment, 
     SprConfigTypes,
     Category,
+    CategoryClosure,
     # Category_,
     # SubCategory,
     User,
     MonoUser,
     Config, 
     Payment,
+    PaymentMonthlyRollup,
+    DataVersion,
     SprExchangeRates,
+    SprExchangeRatesDaily,
+    ImportJob,
     GroupInvitation,
     UtilityAddress,
     UtilityService,
@@ -22,13 +27,18 @@ __all__ = [
     "SprTypePayment",
     "SprConfigTypes",
     "Category",
+    "CategoryClosure",
     # "Category_",
     # "SubCategory",
     "User",
     "MonoUser",
     "Config",
     "Payment",
+    "PaymentMonthlyRollup",
+    "DataVersion",
     "SprExchangeRates",
+    "SprExchangeRatesDaily",
+    "ImportJob",
     "GroupInvitation",
     "UtilityAddress",
     "UtilityService",
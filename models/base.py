@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import Column, DateTime, Integer
+from sqlalchemy import Column, DateTime, Integer, inspect
 
 from mydb import db
 
@@ -12,17 +12,36 @@ class BaseModel(db.Model):
     created = Column(DateTime, default=datetime.datetime.now(datetime.timezone.utc))
     updated = Column(DateTime)
 
+    # Класові набори атрибутів для update: {клас: (всі атрибути, колонки)}
+    _update_keys_cache = {}
+
     def __init__(self, **kwargs):
         self.update(**kwargs)
 
+    @classmethod
+    def _update_keys(cls) -> tuple[frozenset, frozenset]:
+        """
+        Атрибути класу (те, що раніше давав dir(self) на кожен ключ) та колонки,
+        значення яких не може бути моделлю - для них getattr перевірка не потрібна.
+        Рахується один раз на клас
+        """
+        keys = BaseModel._update_keys_cache.get(cls)
+        if keys is None:
+            columns = frozenset(attr.key for attr in inspect(cls).column_attrs)
+            keys = BaseModel._update_keys_cache[cls] = (frozenset(dir(cls)) - {"id"}, columns - {"id"})
+        return keys
+
     def update(self, **data):
         """
         Function to update model
         """
+        attrs, columns = self._update_keys()
         for key, value in data.items():
-            if key not in dir(self):
+            if key in columns:
+                setattr(self, key, value)
                 continue
-            if key == "id":
+            # Атрибути, додані екземпляру, dir(self) теж бачив
+            if key not in attrs and (key == "id" or key not in self.__dict__):
                 continue
             if isinstance(getattr(self, key), BaseModel):
                 continue
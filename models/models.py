@@ -1,8 +1,8 @@
 import datetime
 import uuid
 
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text, Float)
-from sqlalchemy.dialects.mysql import FLOAT
+from sqlalchemy import (Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, String, Text, Float)
+from sqlalchemy.dialects.mysql import FLOAT, LONGTEXT
 from sqlalchemy.orm import relationship
 
 from .base import BaseModel
@@ -63,6 +63,22 @@ class Category(Base):
 Category.comment = 'Directory of expense categories'
 
 
+class CategoryClosure(Base):
+    __tablename__ = 'category_closure'
+
+    ancestor_id = Column(Integer, nullable=False)
+    descendant_id = Column(Integer, nullable=False)
+    depth = Column(Integer, nullable=False, default=0, comment="0 - the category itself")
+
+    __table_args__ = (
+        Index('idx_category_closure_ancestor', 'ancestor_id', 'descendant_id', unique=True),
+        Index('idx_category_closure_descendant', 'descendant_id', 'depth'),
+    )
+
+
+CategoryClosure.comment = 'All ancestor/descendant pairs of the category tree, maintained by api.categories.funcs'
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -162,10 +178,25 @@ class Payment(Base):
     currency_original = Column(String(3), nullable=True, default='UAH', comment="Original transaction currency")
     exchange_rate = Column(Float, nullable=True, default=1.0, comment="Exchange rate at transaction time")
 
+    # Write-time enrichment from mydesc and owner rules (see api.payments.funcs.enrich_payments)
+    phone = Column(String(13), nullable=True, comment="normalized phone from mydesc, +380XXXXXXXXX")
+    phone_label = Column(String(255), nullable=True, comment="name for phone from owner's phone_to_name config")
+    excluded_from_stat = Column(
+        Boolean, default=False, server_default='0', nullable=False, comment="mydesc matches owner's exclude_from_stat"
+    )
+
     __table_args__ = (Index(
         None, 'rdate', 'user_id', 'category_id', 'mydesc', 'amount', 'is_deleted', 'bank_payment_id', unique=True
     ), Index(
         None, bank_payment_id, unique=True
+    ), Index(
+        'idx_payments_user_rdate', 'user_id', 'rdate'
+    ), Index(
+        'ft_payments_mydesc', 'mydesc', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'
+    ), Index(
+        'idx_payments_user_phone', 'user_id', 'phone'
+    ), Index(
+        'idx_payments_user_excluded_rdate', 'user_id', 'excluded_from_stat', 'rdate'
     ),)
 
     _default_fields = ["rdate", "category_id", "mydesc", "currency_amount", "currency", "category", "source",
@@ -177,6 +208,39 @@ class Payment(Base):
 Payment.comment = 'List of expenses'
 
 
+class PaymentMonthlyRollup(Base):
+    __tablename__ = 'payments_monthly_rollup'
+
+    user_id = Column(Integer, nullable=False, comment="payment owner")
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=False)
+    root_category_id = Column(Integer, nullable=True, comment="root (parent_id = 0) category of the payment category")
+    currency_view = Column(String(3), nullable=False, comment="UAH|EUR|USD - currency amounts are shown in")
+    amount_sum = Column(Float, nullable=False, default=0)
+    cnt = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index(
+        'idx_payments_rollup_key', 'user_id', 'currency_view', 'year', 'month', 'root_category_id', unique=True
+    ),)
+
+
+PaymentMonthlyRollup.comment = 'Monthly payment sums per owner and root category, maintained by api.rollup.funcs'
+
+
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+
+    scope = Column(String(64), nullable=False, comment="user:<id> | group:<id> | rates")
+    version = Column(Integer, nullable=False, default=0, comment="bumped on every commit that changes scope data")
+
+    __table_args__ = (Index(
+        'idx_data_versions_scope', 'scope', unique=True
+    ),)
+
+
+DataVersion.comment = 'Monotonic data version per user/group, used for ETag on read endpoints'
+
+
 class SprExchangeRates(Base):
     __tablename__ = 'spr_exchange_rates'
 
@@ -187,6 +251,55 @@ class SprExchangeRates(Base):
     purchaseRate = Column(FLOAT(10, 5))
     source = Column(String(39), comment="pryvat_api | UkrRates")
 
+    # Один курс на валюту на момент часу - ключ для upsert при завантаженні курсів
+    __table_args__ = (Index(
+        None, 'currency', 'base_currency', 'rdate', unique=True
+    ),)
+
+
+class SprExchangeRatesDaily(Base):
+    __tablename__ = 'spr_exchange_rates_daily'
+
+    rdate = Column(Date, nullable=False, comment="calendar day")
+    base_currency = Column(String(3), comment="UAH")
+    currency = Column(String(3), nullable=False, comment="EUR|USD")
+    saleRate = Column(FLOAT(10, 5))
+    purchaseRate = Column(FLOAT(10, 5))
+
+    __table_args__ = (Index(
+        None, 'currency', 'rdate', unique=True
+    ),)
+
+
+SprExchangeRatesDaily.comment = 'Exchange rates forward-filled to one row per currency per day'
+
+
+class ImportJob(Base):
+    __tablename__ = 'import_jobs'
+
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    bank = Column(String(29), nullable=False, comment="wise | p24 | revolut | pumb | erste | raiffeisen")
+    filename = Column(String(255))
+    action = Column(String(10), nullable=False, default="import", comment="show | import")
+    status = Column(String(16), nullable=False, default="queued",
+                    comment="queued | parsing | converting | saving | done | failed")
+    total_rows = Column(Integer, nullable=False, default=0)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    created_rows = Column(Integer, nullable=False, default=0)
+    duplicate_rows = Column(Integer, nullable=False, default=0)
+    error_rows = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    result = Column(Text().with_variant(LONGTEXT(), "mysql"), comment="JSON: converted payments with sql flag")
+    started = Column(DateTime)
+    finished = Column(DateTime)
+
+    __table_args__ = (Index(
+        'idx_import_jobs_user', 'user_id', 'id'
+    ),)
+
+
+ImportJob.comment = 'Statement import jobs run in the background by api.imports.funcs'
+
 
 class Group(Base):
     __tablename__ = 'groups'
@@ -1,6 +1,6 @@
 import re
 import logging
-from mydb import text
+from mydb import text, engine
 from fastapi_sqlalchemy import db
 from sqlalchemy.orm import Session
 from datetime import datetime
@@ -59,18 +59,34 @@ def do_sql(sql="", data=None):
 
 def do_sql_sel(sql="", data=None):
     """
-    Виконати SQL запит та повернути список результатів
+    Виконати SQL запит та повернути список результатів.
+    sql може бути рядком або вже підготовленим text() виразом
     """
     if data is None:
         data = {}
     try:
         conn = db.session.connection()
-        return [r._asdict() for r in conn.execute(text(sql), data).fetchall()]
+        stmt = text(sql) if isinstance(sql, str) else sql
+        return [r._asdict() for r in conn.execute(stmt, data).fetchall()]
     except Exception as db_err:
         logger.error(f"{sql}\n{db_err}")
         raise Exception(f"error exec sql:\n{db_err}")
 
 
+def do_sql_stream(sql="", data=None, chunk_size=500):
+    """
+    Виконати SQL запит через server-side курсор та віддавати рядки по одному.
+    Використовує окреме з'єднання, бо генератор живе довше за сесію запиту
+    """
+    if data is None:
+        data = {}
+    stmt = text(sql) if isinstance(sql, str) else sql
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt, data)
+        for row in result:
+            yield row._asdict()
+
+
 def convert_currency_code(code: int) -> str:
     conversion_map = {
         840: "USD",